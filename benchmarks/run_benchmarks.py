@@ -0,0 +1,228 @@
+# Purpose:
+# Scale benchmarks for every pipeline stage, with a JSON run history.
+
+# For each size, a throwaway workspace (copy of src/ + config/) gets one
+# generated messy dataset from industrial_data.py in data/raw/. Each stage
+# then runs as its own child process, in pipeline order:
+#   check, clean, analyze, train, uncertainty, predict -> analysis_pipeline.py --stages <stage> --force
+#   dashboard                                          -> summary_dashboard.py
+# Wall time and the child's peak RSS (wait4) are recorded per stage with the
+# row throughput. Every run is appended to benchmarks/history.json and
+# compared with the previous run of the same size / stage, so regressions
+# show up run over run.
+#
+# The harness itself stays tiny (no pandas; data is generated by a child
+# process too): a forked child's ru_maxrss starts from its parent's RSS.
+#
+#   python benchmarks/run_benchmarks.py                       # 10k 100k 1M 10M
+#   python benchmarks/run_benchmarks.py --sizes 10k,100k --stages clean,predict
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+BENCH_DIR = ROOT_DIR / "benchmarks"
+WORK_DIR = BENCH_DIR / ".work"
+HISTORY_PATH = BENCH_DIR / "history.json"
+
+SIZES = ["10k", "100k", "1M", "10M"]
+STAGES = ["check", "clean", "analyze", "train", "uncertainty", "predict", "dashboard"]
+DATASET = "bench_machine_data"
+STAGE_TIMEOUT = 6 * 3600     # seconds before a stage is killed and marked "timeout"
+REGRESSION = 0.20            # flag stages >20% slower / bigger than last run
+COPY_DIRS = ["src", "config"]
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def stage_command(stage):
+    if stage == "dashboard":
+        return [sys.executable, "src/summary_dashboard.py"]
+    return [sys.executable, "src/analysis_pipeline.py", "--stages", stage, "--force"]
+
+
+# ------------------ WORKSPACE ------------------
+def prepare_workspace(rows, options):
+    """
+    Fresh project copy holding only the generated dataset. Returns its root.
+    """
+    workspace = WORK_DIR / f"rows_{rows}"
+    if workspace.exists():
+        shutil.rmtree(workspace)
+    for name in COPY_DIRS:
+        if (ROOT_DIR / name).exists():
+            shutil.copytree(ROOT_DIR / name, workspace / name,
+                            ignore=shutil.ignore_patterns("__pycache__"))
+    for name in ["data/raw", "data/processed", "models", "output"]:
+        (workspace / name).mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    out = workspace / "data" / "raw" / f"{DATASET}.csv"
+    command = [sys.executable, str(ROOT_DIR / "industrial_data.py"), "--rows", str(rows), "--out", str(out)]
+    for option, value in options.items():
+        command += [f"--{option.replace('_', '-')}", str(value)]
+    subprocess.run(command, check=True, capture_output=True)
+    with open(out, "rb") as f:
+        written = sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1
+    print(f"🧪 Generated {written} rows in {time.perf_counter() - start:.1f}s")
+    return workspace, written
+
+
+# ------------------ MEASURE ------------------
+def run_stage(workspace, stage, rows, timeout=STAGE_TIMEOUT):
+    """
+    Runs one stage in a child process. Peak RSS comes from wait4(), i.e.
+    the child's own high-water mark (including children it waited for).
+    """
+    log_path = workspace / "output" / f"bench_{stage}.log"
+    env = {**os.environ, "MPLBACKEND": "Agg", "PYTHONHASHSEED": "0"}
+    with open(log_path, "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(stage_command(stage), cwd=workspace, stdout=log,
+                                   stderr=subprocess.STDOUT, env=env)
+        status = "ok"
+        deadline = start + timeout
+        while True:
+            pid, exit_status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.perf_counter() > deadline:
+                process.kill()
+                pid, exit_status, usage = os.wait4(process.pid, 0)
+                status = "timeout"
+                break
+            time.sleep(0.05)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(exit_status)  # already reaped
+    if status == "ok" and process.returncode != 0:
+        status = f"exit {process.returncode}"
+
+    return {
+        "stage": stage,
+        "rows": rows,
+        "status": status,
+        "wall_s": round(wall, 3),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),  # ru_maxrss is KiB on Linux
+        "rows_per_s": round(rows / wall, 1) if wall > 0 else None,
+        "log": str(log_path.relative_to(ROOT_DIR)),
+    }
+
+
+# ------------------ HISTORY ------------------
+def load_history():
+    if HISTORY_PATH.exists():
+        with open(HISTORY_PATH) as f:
+            return json.load(f)
+    return []
+
+
+def save_history(history):
+    tmp_path = HISTORY_PATH.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_path, HISTORY_PATH)
+
+
+def previous_result(history, rows, stage):
+    for run in reversed(history):
+        for result in run["results"]:
+            if result["rows"] == rows and result["stage"] == stage and result["status"] == "ok":
+                return result
+    return None
+
+
+def compare(result, previous):
+    """
+    '+12% time, -3% RSS' against the last run; flags regressions.
+    """
+    if previous is None or result["status"] != "ok":
+        return ""
+    notes = []
+    for key, label in [("wall_s", "time"), ("peak_rss_mb", "RSS")]:
+        if previous[key]:
+            change = result[key] / previous[key] - 1
+            mark = " ⚠️" if change > REGRESSION else ""
+            notes.append(f"{change:+.0%} {label}{mark}")
+    return ", ".join(notes)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# ------------------ MAIN ------------------
+def run_benchmarks(sizes=SIZES, stages=STAGES, options=None, keep=False, timeout=STAGE_TIMEOUT):
+    options = options or {}
+    history = load_history()
+    run = {
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": git_commit(),
+        "machine": {"cpus": os.cpu_count(), "platform": platform.platform(),
+                    "python": platform.python_version()},
+        "options": options,
+        "results": [],
+    }
+
+    for size in sizes:
+        rows = parse_size(size)
+        print(f"\n{'=' * 60}\n📏 {size} rows\n{'=' * 60}")
+        workspace, written = prepare_workspace(rows, options)
+        failed = False
+        for stage in stages:
+            result = run_stage(workspace, stage, written, timeout)
+            run["results"].append(result)
+            note = compare(result, previous_result(history, written, stage))
+            print(f"{stage:<12} {result['status']:<8} {result['wall_s']:>9.2f}s "
+                  f"{result['peak_rss_mb']:>9.1f} MB {result['rows_per_s'] or 0:>12,.0f} rows/s"
+                  + (f"   ({note})" if note else ""))
+            if result["status"] != "ok":
+                print(f"   ↳ see {result['log']}; later stages of this size are skipped")
+                failed = True
+                break
+        if not (keep or failed):
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    history.append(run)
+    save_history(history)
+    print(f"\n📝 Appended to {HISTORY_PATH.relative_to(ROOT_DIR)}")
+    return run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage at several data sizes")
+    parser.add_argument("--sizes", default=",".join(SIZES), help="comma-separated, e.g. 10k,100k,1M")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"subset of: {','.join(STAGES)}")
+    parser.add_argument("--extra-columns", type=int, default=0)
+    parser.add_argument("--categories", type=int, default=3)
+    parser.add_argument("--null-rate", type=float, default=0.05)
+    parser.add_argument("--duplicate-rate", type=float, default=0.01)
+    parser.add_argument("--outlier-rate", type=float, default=0.0002)
+    parser.add_argument("--timeout", type=float, default=STAGE_TIMEOUT, help="seconds per stage")
+    parser.add_argument("--keep", action="store_true", help="keep the workspaces in benchmarks/.work")
+    args = parser.parse_args()
+
+    stages = args.stages.split(",")
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+    run_benchmarks(args.sizes.split(","), stages,
+                   {"extra_columns": args.extra_columns, "categories": args.categories,
+                    "null_rate": args.null_rate, "duplicate_rate": args.duplicate_rate,
+                    "outlier_rate": args.outlier_rate},
+                   keep=args.keep, timeout=args.timeout)
@@ -1,42 +1,101 @@
+import argparse
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 
-np.random.seed(42)
-rows = 4999
-
-# 1. Generate base data
-data = {
-    'Type': np.random.choice(['Low', 'Medium', 'High', '??'], rows), # Added a '??' noise category
-    'Air_Temp_K': np.random.uniform(295, 305, rows),
-    'Process_Temp_K': np.random.uniform(305, 315, rows),
-    'Rotational_Speed_RPM': np.random.uniform(1200, 2800, rows),
-    'Torque_Nm': np.random.uniform(10, 80, rows),
-    'Tool_Wear_Min': np.random.randint(0, 250, rows),
-}
-
-df = pd.DataFrame(data)
-
-# 2. INTENTIONALLY ADD PROBLEMS
-# Add Missing Values (NaNs) - about 5% of the data
-for col in ['Air_Temp_K', 'Torque_Nm']:
-    df.loc[df.sample(frac=0.05).index, col] = np.nan
-
-# Add Duplicate Rows
-duplicates = df.iloc[:50] # Take first 50 rows
-df = pd.concat([df, duplicates], ignore_index=True)
-
-# Add Outliers (Impossible values)
-df.loc[10, 'Air_Temp_K'] = 9999.0 
-df.loc[20, 'Rotational_Speed_RPM'] = -500.0
-
-# Add Wrong Data Types (Store numbers as strings in one column)
-df['Tool_Wear_Min'] = df['Tool_Wear_Min'].astype(str)
-
-# 3. Create Target
-failure_prob = (np.random.rand(len(df)) < 0.05)
-df['Machine_Failure'] = np.where(failure_prob, 1, 0)
-
-# Save to your raw folder
-df.to_csv('data/raw/messy_machine_data.csv', index=False)
-print(f"✅ Created messy_machine_data.csv with {len(df)} rows.")
-print("⚠️ Features: Missing values, Duplicates, Outliers, and String-types included!")
\ No newline at end of file
+# Synthetic "messy machine" data factory. The defaults reproduce the
+# original data/raw/messy_machine_data.csv (4,999 rows + 50 duplicates,
+# seed 42); every knob can be turned for scale tests (see benchmarks/).
+
+BASE_CATEGORIES = ['Low', 'Medium', 'High']
+NOISE_CATEGORY = '??'       # Added a '??' noise category
+CHUNK_ROWS = 1_000_000      # rows generated per chunk when writing big files
+
+def make_machine_data(rows=4999, extra_columns=0, categories=3, null_rate=0.05,
+                      duplicate_rate=0.01, outlier_rate=0.0002, seed=42):
+    """
+    One messy frame:
+      rows            base rows before duplicates are appended
+      extra_columns   additional numeric sensor columns (Sensor_1, ...)
+      categories      'Type' cardinality, not counting the '??' noise label
+      null_rate       share of NaNs in Air_Temp_K and Torque_Nm
+      duplicate_rate  leading rows appended again as exact duplicates
+      outlier_rate    share of impossible values in Air_Temp_K / RPM
+    """
+    rng = np.random.RandomState(seed)
+    type_labels = (BASE_CATEGORIES + [f"Type_{i}" for i in range(len(BASE_CATEGORIES), categories)])[:categories]
+
+    # 1. Generate base data
+    data = {
+        'Type': rng.choice(type_labels + [NOISE_CATEGORY], rows),
+        'Air_Temp_K': rng.uniform(295, 305, rows),
+        'Process_Temp_K': rng.uniform(305, 315, rows),
+        'Rotational_Speed_RPM': rng.uniform(1200, 2800, rows),
+        'Torque_Nm': rng.uniform(10, 80, rows),
+        'Tool_Wear_Min': rng.randint(0, 250, rows),
+    }
+    # Extra sensors (only drawn when asked for, so the defaults keep their random stream)
+    for i in range(1, extra_columns + 1):
+        data[f"Sensor_{i}"] = rng.normal(0, 1, rows)
+
+    df = pd.DataFrame(data)
+
+    # 2. INTENTIONALLY ADD PROBLEMS
+    # Add Missing Values (NaNs)
+    for col in ['Air_Temp_K', 'Torque_Nm']:
+        df.loc[df.sample(frac=null_rate, random_state=rng).index, col] = np.nan
+
+    # Add Duplicate Rows
+    duplicates = df.iloc[:int(round(rows * duplicate_rate))] # Take the first rows
+    df = pd.concat([df, duplicates], ignore_index=True)
+
+    # Add Outliers (Impossible values): rows 10 / 20 first, random rows beyond that
+    n_outliers = int(round(rows * outlier_rate))
+    for col, value, first in [('Air_Temp_K', 9999.0, 10), ('Rotational_Speed_RPM', -500.0, 20)]:
+        if n_outliers and first < len(df):
+            df.loc[first, col] = value
+        if n_outliers > 1:
+            df.loc[rng.choice(len(df), n_outliers - 1, replace=False), col] = value
+
+    # Add Wrong Data Types (Store numbers as strings in one column)
+    df['Tool_Wear_Min'] = df['Tool_Wear_Min'].astype(str)
+
+    # 3. Create Target
+    failure_prob = (rng.rand(len(df)) < 0.05)
+    df['Machine_Failure'] = np.where(failure_prob, 1, 0)
+    return df
+
+def write_machine_data(path, rows=4999, chunk_rows=CHUNK_ROWS, seed=42, **options):
+    """
+    Writes `rows` base rows to `path` in chunks (each chunk seeded from
+    `seed`), so files of any size are built in bounded memory.
+    Returns the number of rows written (duplicates included).
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        df = make_machine_data(min(chunk_rows, rows - start), seed=seed + i, **options)
+        df.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+        written += len(df)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a messy synthetic machine dataset")
+    parser.add_argument("--rows", type=int, default=4999, help="base rows (duplicates come on top)")
+    parser.add_argument("--extra-columns", type=int, default=0, help="additional numeric sensor columns")
+    parser.add_argument("--categories", type=int, default=3, help="'Type' cardinality (plus the '??' label)")
+    parser.add_argument("--null-rate", type=float, default=0.05)
+    parser.add_argument("--duplicate-rate", type=float, default=0.01)
+    parser.add_argument("--outlier-rate", type=float, default=0.0002)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="data/raw/messy_machine_data.csv")
+    args = parser.parse_args()
+
+    n = write_machine_data(args.out, args.rows, seed=args.seed, extra_columns=args.extra_columns,
+                           categories=args.categories, null_rate=args.null_rate,
+                           duplicate_rate=args.duplicate_rate, outlier_rate=args.outlier_rate)
+    # Save to your raw folder
+    print(f"✅ Created {Path(args.out).name} with {n} rows.")
+    print("⚠️ Features: Missing values, Duplicates, Outliers, and String-types included!")
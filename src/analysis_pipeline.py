@@ -1,4 +1,6 @@
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 # 1. Setup Project Root properly
@@ -6,52 +8,216 @@ ROOT_DIR = Path(__file__).resolve().parent.parent
 sys.path.append(str(ROOT_DIR))
 
 # 2. Import your modules using the 'src.' prefix for reliability
-from src.data_check import check_data
-from src.modeling.train_base_model import train_model
-from src.modeling.uncertainty import estimate_uncertainty
-from src.modeling.visualize_failure import plot_failure_distribution
+# Only the light modules here: each stage imports its own heavy libraries
+# (sklearn, matplotlib, seaborn) when it first runs, so a run that only
+# needs some stages (e.g. --stages predict) starts fast.
+from src.pipeline_context import PipelineContext
+from src.build_manifest import BuildManifest
+from src.stage_graph import PipelineCancelled, Stage, run_graph, select_stages
+from src import instrumentation
+
+# ---------------- PER-DATASET STAGE TASKS ----------------
+# Top-level functions so they can run on a process pool. Each takes the
+# DatasetState, loads whatever it is missing, and returns its result to the
+# parent (which stores it on the parent's DatasetState via the stage's apply).
+
+def _check_task(ds):
+    from src import data_cleaning
+    from src.data_check import check_data
+    # Streaming mode profiles the file chunk by chunk instead of holding it
+    df = None if data_cleaning.STREAMING_MODE else ds.load_raw()
+    check_data(ds.raw_path.name, df)
+    return df
+
+def _clean_task(ds):
+    from src import data_cleaning
+    if not data_cleaning.STREAMING_MODE:
+        ds.load_raw()
+    return data_cleaning.process_dataset(ds.raw_path, ds.raw_df)
+
+def _analyze_task(ds):
+    from multiprocessing import parent_process
+    from src.feature_analysis import RENDER_WORKERS, analyze_dataset
+    # No frame at hand (pool worker, cleaning skipped or streamed): the
+    # memory-mapped feature cache, else the cleaned file parsed once here
+    features = ds.load_features() if ds.clean_df is None else None
+    # On a pipeline pool worker the stages already run in parallel: draw inline
+    render_workers = 1 if parent_process() is not None else RENDER_WORKERS
+    analyze_dataset(ds.load_cleaned() if features is None else None, f"{ds.cleaned_name}.csv",
+                    render_workers, features=features)
+    return ds.clean_df
+
+def _train_task(ds, n_jobs):
+    from src.modeling.train_base_model import train_dataset
+    features = ds.load_features()
+    df = ds.clean_df if features is not None else ds.load_cleaned()
+    model, transformer, detector = train_dataset(df, ds.cleaned_name, n_jobs, features, full_fit=ds.rebuild)
+    return ds.clean_df, model, transformer, detector
+
+def _uncertainty_task(ds, n_jobs):
+    from src.modeling.uncertainty import estimate_dataset_uncertainty
+    ds.load_cleaned()
+    if ds.load_model() is None:
+        raise FileNotFoundError(f"no model trained on {ds.name} and none matching its columns")
+    return estimate_dataset_uncertainty(ds.clean_df, ds.model, ds.cleaned_name, ds.transformer,
+                                        n_jobs, ds.detector, ds.load_features())
+
+def _plot_task(ds):
+    from src.modeling.visualize_failure import plot_failure_distribution
+    plot_failure_distribution({ds.cleaned_name: ds.load_failure()})
+
+def _predict_task(ds):
+    from src.predict import run_predictions
+    if ds.load_model() is None:
+        raise FileNotFoundError(f"no model trained on {ds.name} and none matching its columns")
+    run_predictions(ds.raw_path, ds.model, ds.transformer, ds.detector, model_file=ds.model_file)
+
+# ---------------- RESULT HAND-OVER ----------------
+def _keep_raw(ds, raw_df):
+    ds.raw_df = raw_df
+
+def _keep_cleaned(ds, result):
+    ds.clean_df, ds.cleaning_stats = result
+    ds.release_raw()
+
+def _keep_analyzed(ds, clean_df):
+    if clean_df is not None:
+        ds.clean_df = clean_df
+
+def _keep_model(ds, result):
+    clean_df, ds.model, ds.transformer, ds.detector = result
+    if clean_df is not None:
+        ds.clean_df = clean_df
+
+def _keep_failure(ds, failure_df):
+    ds.failure_df = failure_df
+
+# ---------------- STAGE GRAPH ----------------
+# After cleaning, analysis and training are independent branches; the plot
+# and predict stages only need the training branch.
+PIPELINE = [
+    Stage("check", "Running Data Quality Checks...", _check_task,
+          inputs=lambda ds: [ds.raw_path], outputs=lambda ds: [ds.profile_path], apply=_keep_raw),
+    Stage("clean", "Cleaning & Preprocessing All Datasets...", _clean_task, requires=["check"],
+          inputs=lambda ds: [ds.raw_path, ds.rules_path] + ds.index_inputs, serial=True,
+          outputs=lambda ds: [ds.cleaned_path, ds.report_path, ds.features_dir], apply=_keep_cleaned),
+    Stage("analyze", "Generating Statistical Analysis & Plots...", _analyze_task, requires=["clean"],
+          inputs=lambda ds: [ds.cleaned_path], outputs=lambda ds: [ds.analysis_dir], apply=_keep_analyzed,
+          ships_frames=False),
+    Stage("train", "Training Baseline Models & Saving .pkl files...", _train_task, requires=["clean"],
+          inputs=lambda ds: [ds.cleaned_path], outputs=lambda ds: ds.model_artifacts,
+          apply=_keep_model, uses_cores=True, ships_frames=False),
+    Stage("uncertainty", "Estimating Model Uncertainty & Failure Risks...", _uncertainty_task,
+          requires=["train"], inputs=lambda ds: [ds.cleaned_path] + ds.scoring_artifacts,
+          outputs=lambda ds: [ds.failure_path], apply=_keep_failure, uses_cores=True),
+    Stage("plot", "Generating Final Risk Charts (PNGs)...", _plot_task, requires=["uncertainty"],
+          inputs=lambda ds: [ds.failure_path], outputs=lambda ds: [ds.plot_path]),
+    Stage("predict", "Scoring Raw Data with Each Dataset's Model...", _predict_task, requires=["train"],
+          inputs=lambda ds: [ds.raw_path] + ds.scoring_artifacts,
+          outputs=lambda ds: [ds.prediction_path, ds.prediction_columns_path]),
+]
+STAGES = tuple(stage.name for stage in PIPELINE)
+
+# ---------------- PROGRESS EVENTS ----------------
+# run_pipeline(on_event=...) reports every step as a dict:
+#   {"stage": None, "status": "planned", "datasets": [names], "stages": [names]}
+#   {"stage", "status": "started", "dataset"}
+#   {"stage", "status": "skipped" | "done", "dataset", "outputs": [paths]}
+#   {"stage", "status": "failed", "dataset", "error"}
+
+# ---------------- PIPELINE ----------------
+def run_pipeline(force=False, workers=1, cpu_budget=None, on_event=None, cancel=None, stages=None,
+                 trace=True, profile=False):
+    """
+    Stages whose inputs and code are unchanged since the last run are
+    skipped (see build_manifest.py). force=True rebuilds everything.
+    stages: names of the stages to run (default: all of STAGES); the ones
+    left out are taken from disk as they are.
+
+    workers > 1 runs ready (dataset, stage) nodes concurrently on a process
+    pool - independent datasets and independent branches of one dataset.
+    cpu_budget (default: all cores) is shared between those workers and the
+    forests' own n_jobs.
+
+    on_event(dict) receives progress events (see PROGRESS EVENTS above) as
+    each dataset finishes a stage; setting the `cancel` Event stops the run
+    with PipelineCancelled (see job_runner.py).
+
+    trace=True writes every stage's and sub-step's timings, rows and memory
+    to output/traces/ (JSONL + Chrome trace, see instrumentation.py) and
+    prints the slowest steps per dataset; profile=True also samples stacks
+    inside each stage. A trace already active (PIPELINE_TRACE set by a
+    caller) is appended to instead.
+    """
+    selected = select_stages(PIPELINE, stages)
 
-def run_pipeline():
     print("\n" + "="*60)
     print("🚀 STARTING AI-BASED MODEL FAILURE PREDICTOR PIPELINE 🚀")
     print("="*60)
 
-    # ---------------- STEP 1: Data Quality Checks ----------------
-    print("\n[STEP 1] Running Data Quality Checks...")
+    # Every raw CSV is parsed at most once and handed from stage to stage
     RAW_DIR = ROOT_DIR / "data" / "raw"
-    csv_files = list(RAW_DIR.glob("*.csv"))
-    
-    if not csv_files:
+    ctx = PipelineContext(RAW_DIR)
+    if not len(ctx):
         print("❌ No CSV files found in data/raw/!")
         return
+    manifest = BuildManifest()
+    for ds in ctx:
+        ds.rebuild = force
 
-    for raw_file in csv_files:
-        check_data(raw_file.name)
-
-    # ---------------- STEP 2: Automated Cleaning ----------------
-    print("\n[STEP 2] Cleaning & Preprocessing All Datasets...")
-    import src.data_cleaning  # Executes cleaning loop
-
-    # ---------------- STEP 3: Stats & Visuals ----------------
-    print("\n[STEP 3] Generating Statistical Analysis & Plots...")
-    import src.feature_analysis # Executes analysis/viz loop
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    workers = max(1, min(workers, cpu_budget))
+    forest_jobs = max(1, cpu_budget // workers)
 
-    # ---------------- STEP 4: Model Training ----------------
-    print("\n[STEP 4] Training Baseline Models & Saving .pkl files...")
-    train_model()
+    # Started before the pool so the workers inherit the trace file
+    own_trace = trace and instrumentation.trace_path() is None
+    trace_path = instrumentation.start_trace(profile=profile) if own_trace else instrumentation.trace_path()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    if executor:
+        print(f"⚙️  {workers} workers x {forest_jobs} forest jobs")
+    if stages is not None:
+        print(f"🎯 Stages: {', '.join(stage.name for stage in selected)}")
 
-    # ---------------- STEP 5: Uncertainty Logic ----------------
-    print("\n[STEP 5] Estimating Model Uncertainty & Failure Risks...")
-    estimate_uncertainty()
-
-    # ---------------- STEP 6: Failure Visualization ----------------
-    print("\n[STEP 6] Generating Final Risk Charts (PNGs)...")
-    plot_failure_distribution()
+    try:
+        with instrumentation.span("pipeline", cat="run"):
+            run_graph(ctx, PIPELINE, selected, manifest, executor, forest_jobs, force, on_event, cancel)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        if own_trace:
+            instrumentation.stop_trace()
 
+    failures = ctx.failures()
     print("\n" + "="*60)
-    print("✅ ALL PHASES COMPLETED SUCCESSFULLY!")
+    if failures:
+        print(f"⚠️ PIPELINE FINISHED WITH {len(failures)} FAILED DATASET(S):")
+        for ds in failures:
+            print(f"   - {ds.name} ({ds.error})")
+    else:
+        print("✅ ALL PHASES COMPLETED SUCCESSFULLY!")
     print("Check 'output/' for CSVs/PNGs and 'models/' for saved models.")
+    if own_trace:
+        instrumentation.print_trace_summary(trace_path)
+        chrome_path = instrumentation.export_chrome_trace(trace_path)
+        print(f"\n🧭 Trace: {trace_path.relative_to(ROOT_DIR)} (Chrome: {chrome_path.name})")
     print("="*60)
+    return ctx
 
 if __name__ == "__main__":
-    run_pipeline()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the failure-risk pipeline over data/raw/*.csv")
+    parser.add_argument("--force", action="store_true", help="ignore the build manifest, rebuild everything")
+    parser.add_argument("--workers", type=int, default=1, help="(dataset, stage) nodes run concurrently")
+    parser.add_argument("--cpu-budget", type=int, default=None, help="total cores for workers x forest n_jobs")
+    parser.add_argument("--stages", type=lambda value: value.split(","), default=None,
+                        help=f"comma-separated subset of: {','.join(STAGES)}")
+    parser.add_argument("--no-trace", action="store_true", help="don't write output/traces/")
+    parser.add_argument("--profile", action="store_true", help="sample stacks in every stage (<trace>.folded)")
+    args = parser.parse_args()
+    try:
+        select_stages(PIPELINE, args.stages)
+    except ValueError as e:
+        parser.error(str(e))
+    run_pipeline(force=args.force, workers=args.workers, cpu_budget=args.cpu_budget, stages=args.stages,
+                 trace=not args.no_trace, profile=args.profile)
@@ -0,0 +1,121 @@
+# Purpose:
+# Content-hash build manifest for incremental pipeline runs.
+
+# For every dataset and stage the manifest remembers a key built from
+#   - the content hash of the stage's input files (raw CSV, upstream outputs)
+#   - the content hash of the code that implements the stage
+# plus the hashes of the files the stage wrote. When a later run computes the
+# same key and the recorded outputs are still on disk unchanged, the stage is
+# skipped. Uploading one new CSV then only costs the stages of that file.
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+MANIFEST_PATH = ROOT_DIR / "output" / "build_manifest.json"
+
+# Code each stage depends on (relative to the project root). Editing any of
+# these files invalidates that stage for every dataset.
+STAGE_CODE = {
+    "check": ["src/data_check.py", "src/profiler.py", "src/row_index.py", "src/schema.py"],
+    "clean": ["src/data_cleaning.py", "src/validation_rules.py", "src/feature_cache.py", "src/row_index.py",
+              "src/timeseries_features.py", "src/modeling/feature_transformer.py", "src/utils.py", "src/schema.py"],
+    "analyze": ["src/feature_analysis.py", "src/feature_cache.py", "src/timeseries_features.py", "src/schema.py"],
+    "train": ["src/modeling/train_base_model.py", "src/modeling/feature_transformer.py",
+              "src/modeling/compiled_forest.py", "src/modeling/ood_detector.py",
+              "src/feature_cache.py", "src/timeseries_features.py", "src/row_index.py", "src/utils.py",
+              "src/schema.py"],
+    "uncertainty": ["src/modeling/uncertainty.py", "src/modeling/forest_inference.py",
+                    "src/modeling/compiled_forest.py", "src/modeling/feature_transformer.py",
+                    "src/modeling/ood_detector.py", "src/feature_cache.py", "src/schema.py"],
+    "plot": ["src/modeling/visualize_failure.py"],
+    "predict": ["src/predict.py", "src/prediction_store.py", "src/row_index.py", "src/timeseries_features.py",
+                "src/modeling/forest_inference.py", "src/modeling/compiled_forest.py",
+                "src/modeling/feature_transformer.py", "src/modeling/ood_detector.py", "src/utils.py",
+                "src/schema.py"],
+}
+
+HASH_BLOCK = 1 << 20  # read files 1 MB at a time
+
+class BuildManifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = Path(path)
+        self.data = {"files": {}, "stages": {}}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.data = json.load(f)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    # ---------------- HASHING ----------------
+    def file_hash(self, path):
+        """
+        sha256 of a file (or of every file in a directory, e.g. a compiled
+        forest). Cached by size + mtime so unchanged files aren't re-read.
+        """
+        path = Path(path)
+        if path.is_dir():
+            digest = hashlib.sha256()
+            for child in sorted(p for p in path.rglob("*") if p.is_file()):
+                digest.update(child.relative_to(path).as_posix().encode())
+                digest.update(self.file_hash(child).encode())
+            return digest.hexdigest()
+
+        stat = path.stat()
+        cached = self.data["files"].get(str(path))
+        if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+            return cached["hash"]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                digest.update(block)
+        self.data["files"][str(path)] = {"size": stat.st_size, "mtime": stat.st_mtime,
+                                         "hash": digest.hexdigest()}
+        return digest.hexdigest()
+
+    def stage_key(self, stage, inputs, config=None):
+        """
+        Hash of the stage's input files, its code files and any config values.
+        """
+        digest = hashlib.sha256(stage.encode())
+        for path in list(inputs) + [ROOT_DIR / code for code in STAGE_CODE.get(stage, [])]:
+            digest.update(self.file_hash(path).encode() if Path(path).exists() else b"missing")
+        digest.update(json.dumps(config or {}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    # ---------------- STAGE RECORDS ----------------
+    def is_current(self, dataset, stage, key, outputs=()):
+        """
+        True when the stage already ran with this exact key and every output
+        is as it left it: same content, or still missing when the stage
+        wrote none (e.g. predict skipping a regressor dataset).
+        """
+        entry = self.data["stages"].get(dataset, {}).get(stage)
+        if not entry or entry["key"] != key:
+            return False
+        for path in outputs:
+            if str(path) not in entry["outputs"]:
+                return False
+            recorded = entry["outputs"][str(path)]
+            if recorded is None:
+                if Path(path).exists():
+                    return False
+            elif not Path(path).exists() or self.file_hash(path) != recorded:
+                return False
+        return True
+
+    def record(self, dataset, stage, key, outputs=()):
+        self.data["stages"].setdefault(dataset, {})[stage] = {
+            "key": key,
+            # None = the stage finished without writing this output
+            "outputs": {str(path): self.file_hash(path) if Path(path).exists() else None for path in outputs},
+        }
+        self.save()
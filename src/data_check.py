@@ -2,7 +2,7 @@
 # Inspect the dataset before touching it.
 
 # This file should:
-# Load raw CSV using utils.py
+# Profile the raw CSV in one chunked pass (see profiler.py)
 
 # Print:
 # number of rows & columns
@@ -10,30 +10,50 @@
 # data types
 # missing values per column
 # duplicate rows count
-# basic statistics
+# basic statistics (approximate distinct counts and quantiles)
 
 # Output:
-# Only terminal output
+# Terminal output
+# output/<dataset>_profile.json (reused by later stages and the UI)
 # No plots
-# No saving files
 from pathlib import Path
+import sys
 import pandas as pd
 
 # Project root
 ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
 
-def check_data(file_name):
-    # Load data
+from src.profiler import profile_csv, profile_frame, save_profile, summary_table
+from src.schema import get_schema
+from src.instrumentation import span
+
+def check_data(file_name, df=None):
+    # Profile the frame the pipeline already parsed, otherwise stream the file
     data_path = ROOT_DIR / "data" / "raw" / file_name
-    df = pd.read_csv(data_path)
-    
+    with span("profile", rows_in=None if df is None else len(df)):
+        if df is None:
+            profile = profile_csv(data_path)
+        else:
+            profile = profile_frame(df, source=file_name)
+
+    # A parsed frame is already schema-typed: keep what each column arrived as
+    raw_dtypes = get_schema(data_path)["raw_dtypes"]
+    for col, column in profile["columns"].items():
+        column["raw_dtype"] = raw_dtypes.get(col, column["dtype"])
+    save_profile(profile)
+
+    columns = profile["columns"]
     print("\n--- DATA CHECK ---")
-    print(f"Shape: {df.shape}")
-    print("\nColumns:", df.columns.tolist())
-    print("\nData types:\n", df.dtypes)
-    print("\nMissing values:\n", df.isnull().sum())
-    print("\nDuplicate rows:", df.duplicated().sum())
-    print("\nStatistical summary:\n", df.describe(include="all"))
+    print(f"Shape: ({profile['rows']}, {profile['n_columns']})")
+    print("\nColumns:", list(columns))
+    print("\nData types (raw -> typed):\n",
+          pd.DataFrame({"raw": {col: c["raw_dtype"] for col, c in columns.items()},
+                        "typed": {col: c["dtype"] for col, c in columns.items()}}))
+    print("\nMissing values:\n", pd.Series({col: c["nulls"] for col, c in columns.items()}))
+    print("\nDuplicate rows:", profile["duplicate_rows"])
+    print("\nStatistical summary:\n", summary_table(profile))
+    return profile
 
 # ------------------ RUN AS SCRIPT ------------------
 if __name__ == "__main__":
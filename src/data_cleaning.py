@@ -1,4 +1,6 @@
 import pandas as pd
+import numpy as np
+from contextlib import nullcontext
 from pathlib import Path
 import sys
 
@@ -6,7 +8,13 @@ import sys
 ROOT_DIR = Path(__file__).resolve().parent.parent
 sys.path.append(str(ROOT_DIR))
 
-from src.utils import fix_data_types
+from src.utils import fix_data_types, detect_target_column
+from src.schema import INT_TYPES, get_schema, read_csv_typed
+from src.instrumentation import span, timed_chunks
+from src.validation_rules import RULES_DIR, load_rules, merge_counts, rules_path
+from src.feature_cache import write_feature_cache, write_feature_cache_csv
+from src.row_index import SeenHashes, clean_filter, hash_rows, mark_seen, upload_order
+from src.timeseries_features import add_series_features, add_series_features_csv
 
 RAW_DIR = ROOT_DIR / "data" / "raw"
 PROCESSED_DIR = ROOT_DIR / "data" / "processed"
@@ -15,73 +23,339 @@ OUTPUT_DIR = ROOT_DIR / "output"
 PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-# ------------------ PROCESS ALL DATASETS ------------------
-for raw_file in RAW_DIR.glob("*.csv"):
-    print(f"\nProcessing file: {raw_file.name}")
+# ------------------ SETTINGS ------------------
+STREAMING_MODE = False  # True = clean in fixed-size chunks (bounded memory)
+CHUNK_SIZE = 50_000     # rows per chunk in streaming mode
+SKIP_INGESTED = True    # drop cleaned rows another raw file already contributed (see row_index.py)
+TIMESERIES_MODE = True  # datasets with a date column get lag / rolling / return features (timeseries_features.py)
 
-    df = pd.read_csv(raw_file)
 
-    file_stem = raw_file.stem
-    processed_file = PROCESSED_DIR / f"{file_stem}_cleaned.csv"
-    report_file = OUTPUT_DIR / f"{file_stem}_report.txt"
+# ------------------ CLEANING HELPERS ------------------
+def apply_cleaning_rules(df, rules=None, types=None):
+    """
+    Type rescue + the dataset's validation rules on a frame (whole file or
+    one chunk). `types` (see stream_types) fixes the numeric columns up front
+    instead of deciding from this frame's values. Returns (frame, {rule:
+    violating rows}); without a RuleSet nothing is filtered.
+    """
+    # Step A: Rescue "String Numbers"
+    with span("type fix", rows_in=len(df)):
+        df = fix_data_types(df) if types is None else apply_stream_types(df, types)
 
-    # ------------------ BEFORE CLEANING ------------------
-    rows_before = df.shape[0]
-    cols_before = df.shape[1]
-    nulls_before = df.isnull().sum()
-    duplicates_before = df.duplicated().sum()
+    # Step B: Domain Validation (Garbage Removal), e.g. 'Sun-hot' outliers
+    # (like 9999K) and negative speeds - one fused mask, one filtered copy
+    if rules is None:
+        return df, {}
+    with span("validate", rows_in=len(df)) as current:
+        df, counts = rules.apply(df)
+        current.rows_out = len(df)
+    return df, counts
 
-    # ------------------ CLEANING LOGIC ------------------
-    # Step A: Rescue "String Numbers"
-    df = fix_data_types(df) 
 
-    # Step B: Domain Physics Validation (Garbage Removal)
-    # Remove 'Sun-hot' outliers (like 9999K) and negative speeds
-    df = df[df['Air_Temp_K'] < 500]
-    df = df[df['Rotational_Speed_RPM'] >= 0]
+# ------------------ STREAMING TYPES ------------------
+def stream_types(raw_file, first_chunk):
+    """
+    {column: 'int64' | 'float64'} for every chunk of a streamed file, decided
+    once: the file's cached schema (schema.py) for the columns it types as
+    numbers, and fix_data_types()' rule on the first chunk for text columns.
+    """
+    schema = get_schema(raw_file)["dtypes"]
+    types = {}
+    for col in first_chunk.columns:
+        kind = schema.get(str(col))
+        if kind in INT_TYPES:
+            types[col] = "int64"
+        elif kind in ("float32", "float64", "number"):
+            types[col] = "float64"
+        elif kind is None and not pd.to_numeric(first_chunk[col], errors="coerce").isna().all():
+            types[col] = "float64"
+    return types
 
-    # Step C: Strict Cleaning (Remove duplicates and remaining NaNs)
-    df = df.drop_duplicates() 
-    df = df.dropna() 
 
-    # ------------------ AFTER CLEANING ------------------
-    rows_after = df.shape[0]
-    cols_after = df.shape[1]
-    nulls_after = df.isnull().sum()
-    duplicates_after = df.duplicated().sum()
+def apply_stream_types(chunk, types):
+    """
+    Text chunk -> numbers for the columns in `types` (unparseable values
+    become NaN, as in fix_data_types). Integer columns stay float64 until
+    their NaNs are dropped (see finish_stream_types).
+    """
+    chunk = chunk.copy(deep=False)
+    for col in types:
+        if col in chunk.columns:
+            chunk[col] = pd.to_numeric(chunk[col], errors="coerce").astype("float64")
+    return chunk
 
-    # ------------------ SAVE CLEANED DATA ------------------
-    # We save as '_cleaned.csv' so Step 5 (Uncertainty) can find it
-    df.to_csv(processed_file, index=False)
 
-    # ------------------ WRITE REPORT ------------------
+def finish_stream_types(chunk, types):
+    """
+    Integer columns back to int64 once NaNs are gone, so every chunk writes
+    them alike (and like the in-memory path does).
+    """
+    ints = [col for col, kind in types.items() if kind == "int64" and col in chunk.columns
+            and (chunk[col] % 1 == 0).all()]
+    return chunk.astype({col: "int64" for col in ints}) if ints else chunk
+
+
+def write_report(report_file, raw_name, stats):
     with open(report_file, "w") as f:
         f.write(f"DATA CLEANING REPORT\n")
-        f.write(f"Dataset: {raw_file.name}\n")
+        f.write(f"Dataset: {raw_name}\n")
         f.write("-" * 45 + "\n\n")
 
         f.write("STRUCTURE\n")
-        f.write(f"Columns before: {cols_before}\n")
-        f.write(f"Columns after: {cols_after}\n\n")
+        f.write(f"Columns before: {stats['cols_before']}\n")
+        f.write(f"Columns after: {stats['cols_after']}\n\n")
 
         f.write("ROWS\n")
-        f.write(f"Rows before cleaning: {rows_before}\n")
-        f.write(f"Rows after cleaning: {rows_after}\n")
-        f.write(f"Net Rows Lost: {rows_before - rows_after}\n\n")
+        f.write(f"Rows before cleaning: {stats['rows_before']}\n")
+        f.write(f"Rows after cleaning: {stats['rows_after']}\n")
+        f.write(f"Net Rows Lost: {stats['rows_before'] - stats['rows_after']}\n\n")
 
         f.write("ACTIONS TAKEN\n")
         f.write("- Applied numeric type rescue (utils.py)\n")
-        f.write("- Filtered physical anomalies (Temp < 500K, RPM >= 0)\n")
-        f.write("- Removed duplicates and null values\n\n")
+        if stats["rule_violations"] is None:
+            f.write(f"- No validation rules ({stats['rules_file']} not found), nothing filtered\n")
+        else:
+            f.write(f"- Filtered rows breaking the validation rules in {stats['rules_file']}\n")
+        f.write("- Removed duplicates and null values\n")
+        if stats.get("rows_already_ingested") is not None:
+            f.write("- Skipped rows already ingested from other files (data/row_index/)\n")
+        if stats.get("series") is not None:
+            series = stats["series"]
+            f.write(f"- Sorted by '{series['date_column']}' and added {series['features']} lag / rolling / "
+                    f"return features ({series['computed_rows']} rows computed, the rest reused)\n")
+        f.write("\n")
+
+        if stats.get("rows_already_ingested") is not None:
+            f.write("ROW INDEX (across files)\n")
+            f.write(f"New rows: {stats['rows_after']}\n")
+            f.write(f"Already ingested from other files: {stats['rows_already_ingested']}\n\n")
+
+        if stats["rule_violations"] is not None:
+            f.write("VALIDATION RULES (violating rows)\n")
+            for label, n in stats["rule_violations"].items():
+                f.write(f"{label}: {n}\n")
+            f.write(f"Rows removed by rules: {stats['rows_failing_rules']}\n\n")
 
         f.write("NULL VALUES (Before)\n")
-        f.write(nulls_before.to_string())
+        f.write(stats['nulls_before'].to_string())
         f.write("\n\n")
 
         f.write("DUPLICATES (Before)\n")
-        f.write(f"Count: {duplicates_before}\n")
+        f.write(f"Count: {stats['duplicates_before']}\n")
+
+
+# ------------------ IN-MEMORY CLEANING ------------------
+def _rule_stats(raw_file, rules):
+    path = RULES_DIR / rules.source if rules is not None else rules_path(Path(raw_file).stem)
+    return {"rules_file": path.relative_to(ROOT_DIR).as_posix(),
+            "rule_violations": None if rules is None else {label: 0 for label in rules.labels},
+            "rows_failing_rules": 0, "series": None}
+
+
+def _series_stats(spec, computed):
+    return {"date_column": spec.date_column, "features": len(spec.feature_names), "computed_rows": computed}
+
+
+def _skip_ingested(df, row_filter):
+    """
+    Drops the cleaned rows another raw file already contributed.
+    """
+    if row_filter is None:
+        return df
+    with span("skip ingested", rows_in=len(df)) as current:
+        df = row_filter.apply(df)
+        current.rows_out = len(df)
+    return df
+
+
+def clean_dataset(raw_file, processed_file, df=None, rules=None, row_filter=None):
+    """
+    Cleans a whole frame at once. Pass `df` when the raw file is already
+    parsed (the frame is cleaned in place of a fresh read), `rules` to
+    validate it (see validation_rules.py) and a row_index.SourceFilter to
+    leave out rows other files already contributed.
+    Returns (cleaned frame, report stats).
+    """
+    if df is None:
+        df = read_csv_typed(raw_file)
+
+    # ------------------ BEFORE CLEANING ------------------
+    with span("stats before", rows_in=len(df)):
+        stats = {
+            "rows_before": df.shape[0],
+            "cols_before": df.shape[1],
+            "nulls_before": df.isnull().sum(),
+            "duplicates_before": df.duplicated().sum(),
+            **_rule_stats(raw_file, rules),
+        }
+
+    # ------------------ CLEANING LOGIC ------------------
+    rows = len(df)
+    df, counts = apply_cleaning_rules(df, rules)
+    if rules is not None:
+        stats["rule_violations"] = counts
+        stats["rows_failing_rules"] = rows - len(df)
+
+    # Step C: Strict Cleaning (Remove duplicates and remaining NaNs)
+    with span("dedup", rows_in=len(df)) as current:
+        df = df.drop_duplicates()
+        current.rows_out = len(df)
+    with span("dropna", rows_in=len(df)) as current:
+        df = df.dropna()
+        current.rows_out = len(df)
+    df = _skip_ingested(df, row_filter).reset_index(drop=True)
+
+    # Step D: Time series - sort by date once, add lag / rolling / return features
+    if TIMESERIES_MODE:
+        with span("series features", rows_in=len(df)) as current:
+            df, spec, computed = add_series_features(df, Path(raw_file).stem, detect_target_column(df))
+            current.attrs["computed_rows"] = computed
+        if spec is not None:
+            stats["series"] = _series_stats(spec, computed)
+
+    # ------------------ AFTER CLEANING ------------------
+    stats["rows_after"] = df.shape[0]
+    stats["cols_after"] = df.shape[1]
+
+    # ------------------ SAVE CLEANED DATA ------------------
+    # We save as '_cleaned.csv' so Step 5 (Uncertainty) can find it
+    with span("write", rows_in=len(df)):
+        df.to_csv(processed_file, index=False)
+    return df, stats
+
+
+# ------------------ STREAMING CLEANING ------------------
+def clean_dataset_streaming(raw_file, processed_file, chunk_size=CHUNK_SIZE, rules=None, row_filter=None):
+    """
+    Same cleaning as clean_dataset(), but one chunk at a time.
+    Duplicates are tracked across chunks as 8-byte row hashes (SeenHashes),
+    so memory follows chunk_size plus 8 bytes per distinct row. Column types
+    are decided once (stream_types), so every chunk is typed alike.
+    """
+    stats = {"rows_before": 0, "cols_before": 0, "rows_after": 0, "cols_after": 0,
+             "nulls_before": None, "duplicates_before": 0, **_rule_stats(raw_file, rules)}
+    raw_seen = SeenHashes()
+    clean_seen = SeenHashes()
+    types = None
+    first_write = True
+
+    # Read as text so every chunk is hashed the same way before type rescue
+    for chunk in timed_chunks(pd.read_csv(raw_file, chunksize=chunk_size, dtype=object)):
+        # ------------------ BEFORE CLEANING ------------------
+        with span("stats before", rows_in=len(chunk)):
+            stats["rows_before"] += chunk.shape[0]
+            stats["cols_before"] = chunk.shape[1]
+            nulls = chunk.isnull().sum()
+            stats["nulls_before"] = nulls if stats["nulls_before"] is None else stats["nulls_before"] + nulls
+            is_dup, raw_seen = mark_seen(hash_rows(chunk), raw_seen)
+            stats["duplicates_before"] += int(is_dup.sum())
+
+        # ------------------ CLEANING LOGIC ------------------
+        if types is None:
+            types = stream_types(raw_file, chunk)
+        rows = len(chunk)
+        chunk, counts = apply_cleaning_rules(chunk, rules, types)
+        if rules is not None:
+            merge_counts(stats["rule_violations"], counts)
+            stats["rows_failing_rules"] += rows - len(chunk)
+
+        # Step C: drop NaNs first (fewer hashes to keep), then cross-chunk duplicates
+        with span("dropna", rows_in=len(chunk)) as current:
+            chunk = finish_stream_types(chunk.dropna(), types)
+            current.rows_out = len(chunk)
+        with span("dedup", rows_in=len(chunk)) as current:
+            is_dup, clean_seen = mark_seen(hash_rows(chunk), clean_seen)
+            chunk = chunk[~is_dup]
+            current.rows_out = len(chunk)
+        chunk = _skip_ingested(chunk, row_filter)
+
+        # ------------------ APPEND CLEANED CHUNK ------------------
+        stats["rows_after"] += chunk.shape[0]
+        stats["cols_after"] = chunk.shape[1]
+        with span("write", rows_in=len(chunk)):
+            chunk.to_csv(processed_file, mode="w" if first_write else "a",
+                         header=first_write, index=False)
+        first_write = False
+
+    if stats["nulls_before"] is None:
+        stats["nulls_before"] = pd.Series(dtype="int64")
+
+    # A series is sorted as a whole: the cleaned file is read back once
+    if TIMESERIES_MODE and stats["rows_after"]:
+        with span("series features", rows_in=stats["rows_after"]) as current:
+            df, spec, computed = add_series_features_csv(processed_file, Path(raw_file).stem)
+            current.attrs["computed_rows"] = computed
+        if spec is not None:
+            stats["series"] = _series_stats(spec, computed)
+            stats["cols_after"] = df.shape[1]
+    return stats
+
+
+# ------------------ PROCESS ONE DATASET ------------------
+def process_dataset(raw_file, df=None):
+    """
+    Cleans one raw file, writes '<stem>_cleaned.csv' and its report.
+    Returns (cleaned frame, report stats); the frame is None in streaming
+    mode, where the cleaned rows only ever exist on disk.
+    """
+    print(f"\nProcessing file: {raw_file.name}")
+
+    file_stem = raw_file.stem
+    processed_file = PROCESSED_DIR / f"{file_stem}_cleaned.csv"
+    report_file = OUTPUT_DIR / f"{file_stem}_report.txt"
+    rules = load_rules(file_stem, pd.read_csv(raw_file, nrows=0).columns)
+    if rules is None:
+        print(f"⚠️ No validation rules for {file_stem} (config/rules/{file_stem}.json, or one matching its "
+              f"columns): the data is NOT validated")
+    elif rules.source != f"{file_stem}.json":
+        print(f"ℹ️ No config/rules/{file_stem}.json, validating with {rules.source} (same columns)")
+    row_filter = clean_filter(raw_file) if SKIP_INGESTED else None
+
+    with row_filter or nullcontext():
+        if STREAMING_MODE:
+            clean_df = None
+            stats = clean_dataset_streaming(raw_file, processed_file, rules=rules, row_filter=row_filter)
+        else:
+            clean_df, stats = clean_dataset(raw_file, processed_file, df, rules, row_filter)
+
+        # ------------------ ROW INDEX ------------------
+        # Recorded once the cleaned file is written: these rows are now this file's
+        stats["rows_already_ingested"] = None
+        if row_filter is not None:
+            row_filter.commit()
+            stats["rows_already_ingested"] = row_filter.skipped_rows
+            print(f"🆕 {row_filter.summary()}")
+    if stats["series"] is not None:
+        series = stats["series"]
+        print(f"📈 Time series by '{series['date_column']}': {series['features']} features "
+              f"({series['computed_rows']} rows computed)")
+
+    # ------------------ FEATURE CACHE ------------------
+    # The model matrix, encoded once for training / uncertainty / analysis
+    with span("feature cache", rows_in=stats["rows_after"]):
+        if clean_df is None:
+            features_dir = write_feature_cache_csv(processed_file)
+        else:
+            features_dir = write_feature_cache(clean_df, processed_file)
+
+    # ------------------ WRITE REPORT ------------------
+    write_report(report_file, raw_file.name, stats)
 
     print(f"Cleaned data saved to: {processed_file.name}")
+    if features_dir is not None:
+        print(f"Feature cache saved to: {features_dir.relative_to(ROOT_DIR)}/")
     print(f"Report generated: {report_file.name}")
+    return clean_df, stats
+
+
+# ------------------ PROCESS ALL DATASETS ------------------
+def clean_all_datasets():
+    # Oldest upload first, as in the pipeline (see row_index.py)
+    for raw_file in upload_order(RAW_DIR.glob("*.csv")):
+        process_dataset(raw_file)
+
+    print("\nAll datasets processed successfully ✅")
+
 
-print("\nAll datasets processed successfully ✅")
\ No newline at end of file
+if __name__ == "__main__":
+    clean_all_datasets()
@@ -4,67 +4,436 @@
 # This file should:
 # Load cleaned data
 # For numerical columns:
-# mean, median, std
+# mean, std
 # min, max
-# outlier detection (IQR method)
+# histogram
 # For categorical columns:
 # unique values
 # value counts
 # Correlation between numerical columns
 
+# Every number behind the figures is computed over the FULL dataset (no
+# sampling) as mergeable chunk aggregates:
+#   - moments: count / sum / sum of squares per column
+#   - correlations: pairwise-complete cross-product sums (X'X-style matrix
+#     products per chunk, same result as DataFrame.corr())
+#   - histograms: fixed bin count whose range doubles (merging bin pairs)
+#     when a later chunk falls outside it
+#   - category counts: summed value_counts
+# so a cleaned CSV can also be streamed in chunks (analyze_csv). Figures are
+# then rendered headless (Agg) into output/analysis/<stem>/, one PNG per
+# feature, on a process pool across features and datasets. A time series'
+# derived lag / rolling / return columns (timeseries_features.py) are left
+# out: the analysis describes the dataset's own columns.
+
+import atexit
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import sys
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns  # better heatmaps
 
 # ------------------ PATH SETUP ------------------
 ROOT_DIR = Path(__file__).resolve().parent.parent
 PROCESSED_DIR = ROOT_DIR / "data" / "processed"
+ANALYSIS_DIR = ROOT_DIR / "output" / "analysis"
+sys.path.append(str(ROOT_DIR))
+
+from src.schema import get_schema, apply_schema
+from src.instrumentation import span
+from src.timeseries_features import load_spec
 
 # ------------------ SETTINGS ------------------
-MAX_POINTS = 5000  # maximum points to plot for big datasets
+HIST_BINS = 20
+AGG_CHUNK_SIZE = 100_000                 # rows aggregated at a time
+RENDER_WORKERS = min(4, os.cpu_count() or 1)  # processes drawing figures (1 = inline)
+SHOW_PLOTS = False                       # True = also open each figure in a window (needs a display)
 
-# ------------------ PROCESS ALL DATASETS ------------------
-for processed_file in PROCESSED_DIR.glob("*.csv"):
-    print(f"\n--- ANALYSIS & VISUALIZATION: {processed_file.name} ---")
 
-    # Load data
-    df = pd.read_csv(processed_file)
+# ------------------ STREAMING HISTOGRAM ------------------
+class Histogram:
+    """
+    `bins` (even) equal-width bins over [lo, lo + width * bins). Values
+    outside the range double the width - neighbouring bins merge pairwise
+    and the range grows towards the overflow - so every update is exact.
+    """
+    def __init__(self, bins=HIST_BINS, lo=None, hi=None):
+        """
+        lo/hi: known data range (e.g. from a min/max pass); without it the
+        first chunk's range is used and widened as needed.
+        """
+        self.bins = bins + bins % 2
+        self.lo = None
+        self.width = None
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        if lo is not None and np.isfinite(lo) and np.isfinite(hi):
+            self._cover(lo, hi)
 
-    # ------------------ NUMERICAL FEATURES ------------------
-    num_cols = df.select_dtypes(include=["int64", "float64"]).columns
-    if len(num_cols) > 0:
-        print("\nNumerical Columns Stats:")
-        print(df[num_cols].describe())
+    @property
+    def hi(self):
+        return self.lo + self.width * self.bins
 
-        # Sample for large datasets
-        df_sample = df[num_cols].sample(min(len(df), MAX_POINTS))
+    def _cover(self, vmin, vmax):
+        vmin, vmax = float(vmin), float(vmax)  # float32 ranges would swallow the margin below
+        if self.lo is None:
+            span = vmax - vmin
+            self.lo = vmin
+            # Slightly wider than the data so vmax falls inside the last bin
+            self.width = span * (1 + 1e-9) / self.bins if span > 0 else 1.0
+            return
+        half = np.zeros(self.bins // 2, dtype=np.int64)
+        while vmin < self.lo or vmax >= self.hi:
+            merged = self.counts.reshape(-1, 2).sum(axis=1)
+            if vmin < self.lo:
+                self.lo -= self.width * self.bins
+                self.counts = np.concatenate([half, merged])
+            else:
+                self.counts = np.concatenate([merged, half])
+            self.width *= 2
 
-        # Histograms
-        df_sample.hist(bins=20, figsize=(12,6), edgecolor="black")
-        plt.suptitle(f"Histograms of Numerical Features ({processed_file.name})")
-        plt.tight_layout(rect=[0, 0, 1, 0.95])
-        plt.show()
+    def update(self, values):
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return self
+        self._cover(float(values.min()), float(values.max()))
+        index = np.clip(((values - self.lo) / self.width).astype(np.int64), 0, self.bins - 1)
+        self.counts += np.bincount(index, minlength=self.bins)
+        return self
+
+    def merge(self, other):
+        """
+        Folds in a histogram built on another chunk. Exact when both share
+        a grid; otherwise each of the other's bins lands whole in the bin
+        holding its centre.
+        """
+        if other.lo is None:
+            return self
+        centres = other.lo + other.width * (np.arange(other.bins) + 0.5)
+        occupied = centres[other.counts > 0]
+        if len(occupied) == 0:
+            return self
+        self._cover(float(occupied.min()), float(occupied.max()))
+        index = np.clip(((centres - self.lo) / self.width).astype(np.int64), 0, self.bins - 1)
+        np.add.at(self.counts, index, other.counts)
+        return self
+
+    def edges(self):
+        return self.lo + self.width * np.arange(self.bins + 1)
+
+    def trimmed(self):
+        """
+        (edges, counts) without the empty bins at either end.
+        """
+        occupied = np.flatnonzero(self.counts)
+        first, last = (occupied[0], occupied[-1] + 1) if len(occupied) else (0, self.bins)
+        return self.edges()[first:last + 1], self.counts[first:last]
+
+
+# ------------------ FULL-DATA AGGREGATES ------------------
+class FeatureAggregates:
+    """
+    Everything the analysis prints and plots, accumulated chunk by chunk.
+    Numeric sums are taken around a fixed shift (the first chunk's means)
+    to keep the variance / correlation arithmetic well conditioned.
+    """
+    def __init__(self, ranges=None, exclude=()):
+        """
+        ranges: optional {column: (min, max)} to lay the histograms out on.
+        exclude: columns not to analyze.
+        """
+        self.ranges = ranges or {}
+        self.exclude = set(exclude)
+        self.rows = 0
+        self.numeric = None        # numeric column names (from the first chunk)
+        self.categorical = None
+        self.shift = None
+        # Pairwise-complete sums, [i, j] over rows where both i and j are present
+        self.n = self.sx = self.sxx = self.sxy = None
+        self.min = self.max = None
+        self.histograms = {}
+        self.counts = {}
+
+    def _start(self, chunk):
+        self.numeric = [col for col in chunk.select_dtypes(include="number").columns if col not in self.exclude]
+        self.categorical = list(chunk.select_dtypes(include=["object", "string", "category"]).columns)
+        k = len(self.numeric)
+        self.n, self.sx, self.sxx, self.sxy = (np.zeros((k, k)) for _ in range(4))
+        self.min, self.max = np.full(k, np.inf), np.full(k, -np.inf)
+        self.histograms = {col: Histogram(HIST_BINS, *self.ranges.get(col, (None, None)))
+                           for col in self.numeric}
+        self.counts = {col: pd.Series(dtype="int64") for col in self.categorical}
+
+    def update(self, chunk):
+        if self.numeric is None:
+            self._start(chunk)
+        self.rows += len(chunk)
+
+        X = chunk[self.numeric].to_numpy(dtype=np.float64, na_value=np.nan)
+        present = np.isfinite(X)
+        if self.shift is None:
+            with np.errstate(invalid="ignore"):
+                self.shift = np.nan_to_num(np.nansum(np.where(present, X, 0.0), axis=0) / present.sum(axis=0))
+        Z = np.where(present, X - self.shift, 0.0)
+        M = present.astype(np.float64)
+        self.n += M.T @ M
+        self.sx += Z.T @ M
+        self.sxx += (Z * Z).T @ M
+        self.sxy += Z.T @ Z
+        if len(X):
+            self.min = np.fmin(self.min, np.nanmin(np.where(present, X, np.inf), axis=0))
+            self.max = np.fmax(self.max, np.nanmax(np.where(present, X, -np.inf), axis=0))
+        for i, col in enumerate(self.numeric):
+            self.histograms[col].update(X[:, i])
+
+        for col in self.categorical:
+            self.counts[col] = self.counts[col].add(chunk[col].value_counts(), fill_value=0).astype("int64")
+        return self
+
+    def _reshift(self, shift):
+        """
+        Re-expresses the sums around another shift (needed to merge).
+        """
+        d = self.shift - shift
+        n, sx = self.n, self.sx
+        self.sxy = self.sxy + d[:, None] * sx.T + d[None, :] * sx + np.outer(d, d) * n
+        self.sxx = self.sxx + 2 * d[:, None] * sx + (d * d)[:, None] * n
+        self.sx = sx + d[:, None] * n
+        self.shift = shift
+
+    def merge(self, other):
+        """
+        Folds in the aggregates of another part of the same file.
+        """
+        if other.numeric is None:
+            return self
+        if self.numeric is None:
+            self.__dict__.update(other.__dict__)
+            return self
+        other._reshift(self.shift)
+        self.rows += other.rows
+        for name in ("n", "sx", "sxx", "sxy"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.min, self.max = np.fmin(self.min, other.min), np.fmax(self.max, other.max)
+        for col in self.numeric:
+            self.histograms[col].merge(other.histograms[col])
+        for col in self.categorical:
+            self.counts[col] = self.counts[col].add(other.counts[col], fill_value=0).astype("int64")
+        return self
+
+    # ------------------ RESULTS ------------------
+    def numeric_stats(self):
+        """
+        count / mean / std / min / max per numeric column (describe() rows).
+        """
+        count = np.diag(self.n)
+        sx, sxx = np.diag(self.sx), np.diag(self.sxx)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.shift + sx / count
+            std = np.sqrt(np.maximum(sxx - sx * sx / count, 0) / (count - 1))
+        return pd.DataFrame({"count": count, "mean": mean, "std": std,
+                             "min": np.where(count > 0, self.min, np.nan),
+                             "max": np.where(count > 0, self.max, np.nan)},
+                            index=self.numeric).T
+
+    def correlation(self):
+        """
+        Pearson correlation over pairwise-complete rows, like DataFrame.corr().
+        """
+        n, sx, sxx = self.n, self.sx, self.sxx
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cov = n * self.sxy - sx * sx.T
+            corr = cov / np.sqrt((n * sxx - sx * sx) * (n * sxx.T - sx.T * sx.T))
+        corr = np.clip(corr, -1, 1)
+        # Constant / empty columns have no correlation, not even with themselves
+        np.fill_diagonal(corr, np.where(np.isfinite(np.diag(corr)), 1.0, np.nan))
+        return pd.DataFrame(corr, index=self.numeric, columns=self.numeric)
+
+
+def derived_columns(dataset_name):
+    """
+    The time-series features cleaning added to this dataset (none otherwise).
+    """
+    spec = load_spec(Path(dataset_name).stem)
+    return spec.feature_names if spec is not None else []
+
+
+def aggregate_frame(df, chunk_size=AGG_CHUNK_SIZE, exclude=()):
+    # The whole frame is at hand: one vectorized min/max pass fixes every
+    # histogram's range up front
+    numeric = df.select_dtypes(include="number").drop(columns=list(exclude), errors="ignore")
+    ranges = {col: (numeric[col].min(), numeric[col].max()) for col in numeric.columns}
+    aggregates = FeatureAggregates(ranges, exclude)
+    for start in range(0, max(len(df), 1), chunk_size):
+        aggregates.update(df.iloc[start:start + chunk_size])
+    return aggregates
+
+
+def aggregate_features(features, chunk_size=AGG_CHUNK_SIZE, exclude=()):
+    """
+    Same aggregates from a memory-mapped feature cache (see
+    feature_cache.py): nothing parsed, numeric columns at their cleaned
+    precision.
+    """
+    aggregates = FeatureAggregates(features.numeric_ranges(), exclude)
+    for chunk in features.decoded_chunks(chunk_size):
+        aggregates.update(chunk)
+    return aggregates
 
-        # Correlation heatmap
-        plt.figure(figsize=(8,6))
-        corr = df[num_cols].corr()
-        sns.heatmap(corr, annot=True, cmap="coolwarm", fmt=".2f")
-        plt.title(f"Correlation Heatmap ({processed_file.name})")
-        plt.tight_layout()
+
+def aggregate_csv(path, chunk_size=AGG_CHUNK_SIZE, exclude=()):
+    """
+    Same aggregates from a CSV streamed in chunks (never fully in memory).
+    """
+    schema = get_schema(path)
+    aggregates = FeatureAggregates(exclude=exclude)
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        aggregates.update(apply_schema(chunk, schema))
+    return aggregates
+
+
+# ------------------ FIGURES ------------------
+def figure_dir(dataset_name):
+    return ANALYSIS_DIR / Path(dataset_name).stem
+
+
+def _file_part(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(name))
+
+
+def figure_specs(aggregates, dataset_name):
+    """
+    One picklable (kind, path, title, data) per figure to draw.
+    """
+    out_dir = figure_dir(dataset_name)
+    specs = []
+    for col in aggregates.numeric:
+        hist = aggregates.histograms[col]
+        if hist.lo is not None:
+            specs.append(("hist", out_dir / f"hist_{_file_part(col)}.png",
+                          f"{col} Histogram ({dataset_name})", hist.trimmed()))
+    if aggregates.numeric:
+        specs.append(("corr", out_dir / "correlation_heatmap.png",
+                      f"Correlation Heatmap ({dataset_name})", aggregates.correlation()))
+    for col in aggregates.categorical:
+        specs.append(("counts", out_dir / f"counts_{_file_part(col)}.png",
+                      f"{col} Value Counts ({dataset_name})",
+                      aggregates.counts[col].sort_values(ascending=False)))
+    return specs
+
+
+def render_figure(spec):
+    """
+    Draws one figure spec to its PNG. Top-level so it runs on a process pool.
+    """
+    import matplotlib
+    if not SHOW_PLOTS:
+        matplotlib.use("Agg")  # headless: no window, no display needed
+    import matplotlib.pyplot as plt
+
+    kind, path, title, data = spec
+    if kind == "hist":
+        edges, counts = data
+        fig, ax = plt.subplots(figsize=(6, 4))
+        ax.bar(edges[:-1], counts, width=np.diff(edges), align="edge", edgecolor="black")
+        ax.set_ylabel("Count")
+    elif kind == "corr":
+        import seaborn as sns  # better heatmaps
+        fig, ax = plt.subplots(figsize=(8, 6))
+        sns.heatmap(data, annot=True, cmap="coolwarm", fmt=".2f", ax=ax)
+    else:
+        fig, ax = plt.subplots(figsize=(8, 4))
+        data.plot(kind="bar", color="skyblue", edgecolor="black", ax=ax)
+        ax.set_ylabel("Count")
+    ax.set_title(title)
+    fig.tight_layout()
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(path)
+    if SHOW_PLOTS:
         plt.show()
+    plt.close(fig)
+    return path
+
+
+_render_pool = None  # (workers, executor), started on first use and kept for later datasets
 
-    # ------------------ CATEGORICAL FEATURES ------------------
-    cat_cols = df.select_dtypes(include=["object"]).columns
-    if len(cat_cols) > 0:
+def render_pool(workers):
+    """
+    The process pool figures are drawn on. Started once per process (that
+    costs seconds: every worker imports matplotlib) and reused by every
+    later render_figures call.
+    """
+    global _render_pool
+    if _render_pool is None or _render_pool[0] != workers:
+        if _render_pool is not None:
+            _render_pool[1].shutdown()
+        _render_pool = (workers, ProcessPoolExecutor(max_workers=workers))
+        atexit.register(_render_pool[1].shutdown)
+    return _render_pool[1]
+
+def render_figures(specs, workers=RENDER_WORKERS):
+    """
+    Renders every spec (any mix of features and datasets), on the shared
+    render pool when workers > 1. Returns the written paths.
+    """
+    if workers <= 1 or SHOW_PLOTS or len(specs) <= 1:
+        return [render_figure(spec) for spec in specs]
+    return list(render_pool(workers).map(render_figure, specs))
+
+
+def _clear_figures(dataset_name):
+    out_dir = figure_dir(dataset_name)
+    if out_dir.exists():
+        for old in out_dir.glob("*.png"):
+            old.unlink()
+
+
+def print_summary(aggregates, dataset_name):
+    print(f"\n--- ANALYSIS & VISUALIZATION: {dataset_name} ---")
+    if aggregates.numeric:
+        print("\nNumerical Columns Stats:")
+        print(aggregates.numeric_stats())
+    if aggregates.categorical:
         print("\nCategorical Columns Value Counts:")
-        for col in cat_cols:
+        for col in aggregates.categorical:
             print(f"\n{col}:")
-            print(df[col].value_counts())
-
-            plt.figure(figsize=(8,4))
-            df[col].value_counts().plot(kind="bar", color="skyblue", edgecolor="black")
-            plt.title(f"{col} Value Counts ({processed_file.name})")
-            plt.ylabel("Count")
-            plt.tight_layout()
-            plt.show()
+            print(aggregates.counts[col].sort_values(ascending=False))
+
+
+# ------------------ ANALYZE ONE DATASET ------------------
+def analyze_dataset(df, dataset_name, render_workers=RENDER_WORKERS, features=None):
+    """
+    Prints full-data stats for a cleaned frame (or, with df=None, its
+    feature cache) and writes its figures to output/analysis/<stem>/.
+    Returns the figure paths.
+    """
+    exclude = derived_columns(dataset_name)
+    with span("aggregate", rows_in=len(df) if df is not None else len(features)):
+        aggregates = (aggregate_frame(df, exclude=exclude) if df is not None
+                      else aggregate_features(features, exclude=exclude))
+    print_summary(aggregates, dataset_name)
+    _clear_figures(dataset_name)
+    with span("render") as current:
+        paths = render_figures(figure_specs(aggregates, dataset_name), render_workers)
+        current.attrs["figures"] = len(paths)
+    return paths
+
+
+# ------------------ PROCESS ALL DATASETS ------------------
+def analyze_all_datasets(render_workers=RENDER_WORKERS):
+    """
+    Streams every cleaned CSV, then renders all datasets' figures on one pool.
+    """
+    specs = []
+    for processed_file in PROCESSED_DIR.glob("*.csv"):
+        aggregates = aggregate_csv(processed_file, exclude=derived_columns(processed_file.name))
+        print_summary(aggregates, processed_file.name)
+        _clear_figures(processed_file.name)
+        specs += figure_specs(aggregates, processed_file.name)
+    paths = render_figures(specs, render_workers)
+    print(f"\n🖼️  {len(paths)} figures written to {ANALYSIS_DIR}")
+    return paths
+
+if __name__ == "__main__":
+    analyze_all_datasets()
@@ -0,0 +1,302 @@
+# Purpose:
+# Memory-mapped model matrix written once by the cleaning stage.
+
+# Training, uncertainty and analysis all need the cleaned data as the
+# model's numeric matrix. Instead of each of them parsing '*_cleaned.csv'
+# and one-hot encoding it again, cleaning writes
+#   data/features/<cleaned stem>/
+#     X.npy      float32, C-contiguous (rows x features, FeatureTransformer layout)
+#     wide.npy   float64 copies of the numeric columns float32 would round
+#                (cleaned dtype float64 / int32 / int64, e.g. Turnover ~1e15),
+#                so analysis sees their exact values; the model reads X
+#     y.npy      target column
+#     rows.npy   uint64 row hashes (row_index.hash_rows, for incremental training)
+#     meta.json  feature names, fitted transformer, column order / dtypes,
+#                and the content hash of the cleaned CSV it was built from
+# Readers open the arrays with mmap_mode="r": nothing is parsed or copied,
+# and every process (pool workers, the forests' threads) shares the same
+# page-cache pages. A cache whose source hash no longer matches the cleaned
+# CSV is stale and ignored; callers then fall back to the CSV.
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from src.schema import apply_schema, get_schema
+from src.row_index import hash_rows
+from src.utils import detect_target_column
+from src.modeling.feature_transformer import FeatureTransformer, is_categorical
+from src.timeseries_features import load_spec
+
+FEATURES_DIR = ROOT_DIR / "data" / "features"
+
+# ------------------ SETTINGS ------------------
+CACHE_VERSION = 3
+EXACT_IN_FLOAT32 = {"float32", "int8", "int16", "uint8", "uint16", "bool"}  # cleaned dtypes X holds exactly
+WRITE_BLOCK = 100_000    # rows encoded into the memmap at a time
+HASH_BLOCK = 1 << 20
+
+
+def features_dir_for(cleaned_path):
+    return FEATURES_DIR / Path(cleaned_path).stem
+
+
+def _series_spec(cleaned_path):
+    spec = load_spec(Path(cleaned_path).stem)
+    return None if spec is None else spec.to_dict()
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_info(cleaned_path):
+    stat = Path(cleaned_path).stat()
+    return {"name": Path(cleaned_path).name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "sha256": content_hash(cleaned_path)}
+
+
+def _target_array(series):
+    """
+    Target as a plain numpy array np.save can write without pickling.
+    """
+    if is_categorical(series):
+        return series.astype(str).to_numpy(dtype=str)
+    return series.to_numpy()
+
+
+# ------------------ WRITE ------------------
+class _CacheWriter:
+    """
+    Fills X.npy / y.npy / rows.npy block by block into a temporary
+    directory; commit() swaps it in for the previous cache.
+    """
+    def __init__(self, out_dir, transformer, n_rows, columns, dtypes):
+        self.out_dir = Path(out_dir)
+        self.tmp_dir = self.out_dir.with_name(self.out_dir.name + ".tmp")
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.tmp_dir.mkdir(parents=True)
+        self.transformer = transformer
+        self.columns = columns
+        self.dtypes = dtypes
+        self.X = np.lib.format.open_memmap(self.tmp_dir / "X.npy", mode="w+", dtype=np.float32,
+                                           shape=(n_rows, len(transformer.feature_names_)))
+        self.wide_columns = [col for col in transformer.numeric_columns
+                             if col in dtypes and dtypes[col] not in EXACT_IN_FLOAT32]
+        self.wide = np.lib.format.open_memmap(self.tmp_dir / "wide.npy", mode="w+", dtype=np.float64,
+                                              shape=(n_rows, len(self.wide_columns)))
+        self.y_parts, self.hash_parts = [], []
+        self.rows = 0
+
+    def write(self, df):
+        for start in range(0, len(df), WRITE_BLOCK):
+            block = df.iloc[start:start + WRITE_BLOCK]
+            self.X[self.rows:self.rows + len(block)] = self.transformer.transform(block)
+            if self.wide_columns:
+                self.wide[self.rows:self.rows + len(block)] = \
+                    block[self.wide_columns].to_numpy(dtype=np.float64, na_value=np.nan)
+            self.rows += len(block)
+        self.y_parts.append(_target_array(df[self.transformer.target]))
+        self.hash_parts.append(hash_rows(df))
+
+    def commit(self, cleaned_path):
+        self.X.flush()
+        self.wide.flush()
+        del self.X, self.wide
+        y = np.concatenate(self.y_parts) if self.y_parts else np.empty(0)
+        np.save(self.tmp_dir / "y.npy", y)
+        np.save(self.tmp_dir / "rows.npy", np.concatenate(self.hash_parts) if self.hash_parts
+                else np.empty(0, dtype=np.uint64))
+        meta = {
+            "version": CACHE_VERSION,
+            "rows": self.rows,
+            "features": self.transformer.feature_names_,
+            "wide_columns": self.wide_columns,
+            "transformer": {"target": self.transformer.target,
+                            "numeric_columns": self.transformer.numeric_columns,
+                            "categories": self.transformer.categories,
+                            "timeseries": self.transformer.timeseries},
+            "columns": self.columns,
+            "dtypes": self.dtypes,
+            "source": _source_info(cleaned_path),
+        }
+        with open(self.tmp_dir / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+        # Readers still holding the old arrays keep their (unlinked) pages
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+        os.replace(self.tmp_dir, self.out_dir)
+        return self.out_dir
+
+
+def write_feature_cache(df, cleaned_path):
+    """
+    Encodes a cleaned frame into data/features/<cleaned stem>/. Returns the
+    cache directory.
+    """
+    target = detect_target_column(df)
+    transformer = FeatureTransformer().fit(df, target=target, timeseries=_series_spec(cleaned_path))
+    writer = _CacheWriter(features_dir_for(cleaned_path), transformer, len(df),
+                          [str(col) for col in df.columns], {str(col): str(df[col].dtype) for col in df.columns})
+    writer.write(df)
+    return writer.commit(cleaned_path)
+
+
+def write_feature_cache_csv(cleaned_path, chunk_size=WRITE_BLOCK):
+    """
+    Same cache from a cleaned CSV in two chunked passes (vocabularies and
+    row count, then encoding), for streaming mode where the cleaned rows
+    are never in memory at once.
+    """
+    schema = get_schema(cleaned_path)
+    n_rows, first, vocab = 0, None, {}
+    for chunk in pd.read_csv(cleaned_path, chunksize=chunk_size):
+        chunk = apply_schema(chunk, schema)
+        first = chunk if first is None else first
+        n_rows += len(chunk)
+        for col in chunk.columns:
+            if is_categorical(chunk[col]):
+                vocab.setdefault(col, set()).update(chunk[col].dropna().unique().tolist())
+    if first is None:
+        return None
+
+    # Layout from the first chunk, vocabularies from all of them (sorted, like a whole-file fit)
+    target = detect_target_column(first)
+    layout = FeatureTransformer().fit(first, target=target, timeseries=_series_spec(cleaned_path))
+    transformer = FeatureTransformer(target, layout.numeric_columns,
+                                     {col: sorted(vocab[col]) for col in layout.categories}, layout.timeseries)
+    writer = _CacheWriter(features_dir_for(cleaned_path), transformer, n_rows,
+                          [str(col) for col in first.columns],
+                          {str(col): str(first[col].dtype) for col in first.columns})
+    for chunk in pd.read_csv(cleaned_path, chunksize=chunk_size):
+        writer.write(apply_schema(chunk, schema))
+    return writer.commit(cleaned_path)
+
+
+# ------------------ READ ------------------
+class FeatureCache:
+    """
+    Read-only, memory-mapped view of one dataset's cache.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "meta.json") as f:
+            self.meta = json.load(f)
+        self.X = np.load(self.path / "X.npy", mmap_mode="r")
+        self.wide = np.load(self.path / "wide.npy", mmap_mode="r")
+        self.y = np.load(self.path / "y.npy", mmap_mode="r")
+        self.hashes = np.load(self.path / "rows.npy", mmap_mode="r")
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    @property
+    def features(self):
+        return self.meta["features"]
+
+    @property
+    def target(self):
+        return self.meta["transformer"]["target"]
+
+    @property
+    def transformer(self):
+        return FeatureTransformer(**self.meta["transformer"])
+
+    def matches(self, transformer):
+        """
+        True when X is laid out exactly like `transformer` (a model's) encodes.
+        """
+        return (transformer is not None and transformer.target == self.target
+                and transformer.feature_names_ == self.features)
+
+    def frame(self, rows=None):
+        """
+        X as a DataFrame with the feature names (what sklearn's fit() wants),
+        without copying the mapped array; `rows` selects a subset (copied).
+        """
+        X = self.X if rows is None else self.X[rows]
+        return pd.DataFrame(X, columns=self.features, copy=False)
+
+    def target_series(self, rows=None):
+        return pd.Series(self.y if rows is None else self.y[rows], name=self.target)
+
+    def decoded_chunks(self, chunk_size=WRITE_BLOCK):
+        """
+        The cleaned columns back from the matrix, chunk by chunk: numeric
+        columns as float32 (what the model sees) or, for the ones float32
+        would round, float64 from wide.npy; one-hot groups as categoricals,
+        plus the target. Columns the model doesn't use (raw timestamps) are
+        left out.
+        """
+        transformer = self.transformer
+        positions = {name: j for j, name in enumerate(self.features)}
+        wide = {name: k for k, name in enumerate(self.meta["wide_columns"])}
+        order = [col for col in self.meta["columns"]
+                 if col == self.target or col in positions or col in transformer.categories]
+        for start in range(0, max(len(self), 1), chunk_size):
+            block = slice(start, min(start + chunk_size, len(self)))
+            columns = {}
+            for col in order:
+                if col == self.target:
+                    columns[col] = np.asarray(self.y[block])
+                elif col in transformer.categories:
+                    vocab = transformer.categories[col]
+                    first = transformer.offsets_[col]
+                    dummies = self.X[block, first:first + len(vocab) - 1]
+                    codes = np.where(dummies.any(axis=1), dummies.argmax(axis=1) + 1, 0) if len(vocab) > 1 \
+                        else np.zeros(block.stop - block.start, dtype=np.int64)
+                    columns[col] = pd.Categorical.from_codes(codes, categories=vocab)
+                elif col in wide:
+                    columns[col] = self.wide[block, wide[col]]
+                else:
+                    columns[col] = self.X[block, positions[col]]
+            yield pd.DataFrame(columns)
+
+    def numeric_ranges(self):
+        """
+        {numeric column: (min, max)} over the whole matrix (plus a numeric
+        target), to lay histograms out before streaming.
+        """
+        ranges = {}
+        wide = {name: k for k, name in enumerate(self.meta["wide_columns"])}
+        for j, col in enumerate(self.transformer.numeric_columns):
+            values = self.wide[:, wide[col]] if col in wide else self.X[:, j]
+            ranges[col] = (float(np.nanmin(values)), float(np.nanmax(values))) if len(values) else (None, None)
+        if self.y.dtype.kind in "biuf" and len(self.y):
+            ranges[self.target] = (float(np.min(self.y)), float(np.max(self.y)))
+        return ranges
+
+
+def open_feature_cache(cleaned_path):
+    """
+    The cache built from this exact cleaned CSV, or None (missing, older
+    format, or the CSV changed since).
+    """
+    path = features_dir_for(cleaned_path)
+    cleaned_path = Path(cleaned_path)
+    if not (path / "meta.json").exists() or not cleaned_path.exists():
+        return None
+    try:
+        cache = FeatureCache(path)
+    except (OSError, ValueError):
+        return None
+    source = cache.meta.get("source", {})
+    if cache.meta.get("version") != CACHE_VERSION:
+        return None
+    stat = cleaned_path.stat()
+    if source.get("size") == stat.st_size and source.get("mtime_ns") == stat.st_mtime_ns:
+        return cache
+    # Touched but maybe unchanged: the content hash decides
+    return cache if source.get("size") == stat.st_size and source.get("sha256") == content_hash(cleaned_path) else None
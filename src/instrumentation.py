@@ -0,0 +1,344 @@
+# Purpose:
+# Timing / memory / row-count spans for every pipeline step.
+
+# Code wraps a step in `with span("dedup", rows_in=len(df)) as s: ...` and
+# sets `s.rows_out` when it knows the result size (timed_chunks() does the
+# same for every chunk a chunked reader hands out). Spans nest (stage ->
+# dataset -> sub-step) per thread, and children inherit their parent's
+# attributes (stage, dataset), so a span deep inside train_dataset() still
+# says which dataset it belongs to. Each finished span is one JSON line in
+# the active trace file:
+#   {"name", "cat", "id", "parent", "depth", "pid", "tid", "start", "dur",
+#    "rows_in", "rows_out", "rss_mb", "peak_rss_mb", "py_peak_mb", <attrs>}
+# The trace file is named in the environment, so pool workers (and
+# subprocesses) append to the same file; every record is a single small
+# O_APPEND write, which keeps lines from different processes whole.
+#
+#   trace_summary(path)       per dataset: steps by total time, the dominant one first
+#   export_chrome_trace(path) chrome://tracing / Perfetto JSON ("X" complete events)
+#
+# Memory per span: current RSS and the process high-water mark at the end
+# of the span (cheap, always on). TRACE_PYTHON_MEMORY adds tracemalloc's
+# exact peak of Python/numpy allocations inside the span, at a real cost.
+#
+# Optional sampling profiler: spans opened with profile=True sample every
+# thread's stack each PROFILE_INTERVAL seconds while PROFILE_ENV is set and
+# append folded stacks ("a;b;c 12") to <trace>.folded - the input format of
+# flamegraph.pl / speedscope.
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from itertools import count
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, RSS figures are left out
+    resource = None
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+TRACE_DIR = ROOT_DIR / "output" / "traces"
+
+# ------------------ SETTINGS ------------------
+TRACE_ENV = "PIPELINE_TRACE"        # path of the active trace file
+PROFILE_ENV = "PIPELINE_PROFILE"    # set -> profile=True spans run the stack sampler
+TRACE_PYTHON_MEMORY = False         # True = tracemalloc peak per span (slows allocation-heavy code)
+PROFILE_INTERVAL = 0.005            # seconds between stack samples
+KEEP_TRACES = 20                    # older traces in TRACE_DIR are deleted
+
+_local = threading.local()
+_ids = count(1)
+_page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# ------------------ MEMORY ------------------
+def rss_mb():
+    """
+    Current resident set size of this process (None where /proc is missing).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _page_size / 2**20
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    """
+    High-water RSS of this process so far.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+# ------------------ SPANS ------------------
+class Span:
+    def __init__(self, name, cat, parent, rows_in, attrs):
+        self.name = name
+        self.cat = cat
+        self.id = f"{os.getpid()}-{next(_ids)}"
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent else 0
+        self.attrs = {**(parent.attrs if parent else {}), **attrs}
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.py_peak = 0
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+
+    def record(self):
+        rec = {
+            "name": self.name,
+            "cat": self.cat,
+            "id": self.id,
+            "parent": self.parent.id if self.parent else None,
+            "depth": self.depth,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "start": round(self.start, 6),
+            "dur": round(time.perf_counter() - self._t0, 6),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rss_mb": _round(rss_mb()),
+            "peak_rss_mb": _round(peak_rss_mb()),
+        }
+        if tracemalloc.is_tracing():
+            rec["py_peak_mb"] = _round(self.py_peak / 2**20)
+        return {**rec, **self.attrs}
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def trace_path():
+    path = os.environ.get(TRACE_ENV)
+    return Path(path) if path else None
+
+
+def _write(rec, path):
+    line = (json.dumps(rec, default=str) + "\n").encode()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def span(name, cat="step", rows_in=None, profile=False, **attrs):
+    """
+    Times the block as one trace record. Set `.rows_out` (and any of
+    `.attrs`) on the yielded span before the block ends. Outside a trace
+    the block runs with only the timing bookkeeping.
+    """
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    if tracemalloc.is_tracing():
+        # The parent keeps the peak it reached so far; the child starts fresh
+        if parent is not None:
+            parent.py_peak = max(parent.py_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    current = Span(name, cat, parent, rows_in, attrs)
+    stack.append(current)
+    sampler = _Sampler(current) if profile and os.environ.get(PROFILE_ENV) else None
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        stack.pop()
+        if tracemalloc.is_tracing():
+            current.py_peak = max(current.py_peak, tracemalloc.get_traced_memory()[1])
+            if parent is not None:
+                parent.py_peak = max(parent.py_peak, current.py_peak)
+        path = trace_path()
+        if path is not None:
+            try:
+                _write(current.record(), path)
+            except OSError:
+                pass  # tracing must never break the pipeline
+
+
+def timed_chunks(chunks, name="read chunk", **attrs):
+    """
+    Yields from a chunk iterator (e.g. read_csv(chunksize=...)) with the
+    time spent fetching each chunk recorded as its own span.
+    """
+    chunks = iter(chunks)
+    while True:
+        with span(name, **attrs) as current:
+            chunk = next(chunks, None)
+            current.rows_out = None if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+
+# ------------------ TRACE FILES ------------------
+def start_trace(path=None, profile=False, python_memory=TRACE_PYTHON_MEMORY):
+    """
+    Makes `path` (default: a new output/traces/trace_<time>.jsonl) the
+    active trace for this process and the processes it starts.
+    Returns the path.
+    """
+    if path is None:
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
+        _prune_traces()
+        path = TRACE_DIR / f"trace_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.jsonl"
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.environ[TRACE_ENV] = str(path)
+    if profile:
+        os.environ[PROFILE_ENV] = "1"
+    if python_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return path
+
+
+def stop_trace():
+    os.environ.pop(TRACE_ENV, None)
+    os.environ.pop(PROFILE_ENV, None)
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _prune_traces():
+    traces = sorted(TRACE_DIR.glob("trace_*.jsonl"), key=lambda p: p.stat().st_mtime)
+    for old in traces[:-KEEP_TRACES] if len(traces) >= KEEP_TRACES else []:
+        for sidecar in [old, old.with_suffix(".chrome.json"), old.with_suffix(".folded")]:
+            sidecar.unlink(missing_ok=True)
+
+
+def read_trace(path):
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def export_chrome_trace(path, out_path=None):
+    """
+    Converts a JSONL trace to the Chrome trace-event format (open in
+    chrome://tracing or ui.perfetto.dev). Returns the written path.
+    """
+    path = Path(path)
+    out_path = Path(out_path) if out_path else path.with_suffix(".chrome.json")
+    records = read_trace(path)
+    events = []
+    for rec in records:
+        args = {k: v for k, v in rec.items()
+                if k not in ("name", "cat", "pid", "tid", "start", "dur") and v is not None}
+        label = rec["name"] if "dataset" not in rec or rec["cat"] == "step" else f"{rec['name']} {rec['dataset']}"
+        events.append({"name": label, "cat": rec["cat"], "ph": "X", "pid": rec["pid"],
+                       "tid": rec["tid"], "ts": rec["start"] * 1e6, "dur": rec["dur"] * 1e6,
+                       "args": args})
+    events.sort(key=lambda e: (e["ts"], -e["dur"]))
+    with open(out_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return out_path
+
+
+def trace_summary(path):
+    """
+    {dataset: [(step, total seconds, calls, rows_in, peak RSS MB), ...]}
+    with every dataset's steps sorted slowest first. Only leaf-most time
+    counts: a step's time excludes its child steps, so a stage that is
+    mostly 'fit' shows 'fit' on top instead of itself.
+    """
+    records = read_trace(path)
+    child_time = defaultdict(float)
+    for rec in records:
+        if rec["parent"]:
+            child_time[rec["parent"]] += rec["dur"]
+
+    totals = defaultdict(lambda: [0.0, 0, 0, 0.0])
+    for rec in records:
+        if rec["cat"] == "run":
+            continue  # the whole pipeline, reported on its own
+        key = (rec.get("dataset") or "-", f"{rec['stage']}/{rec['name']}"
+               if rec.get("stage") and rec["name"] != rec["stage"] else rec["name"])
+        entry = totals[key]
+        entry[0] += max(rec["dur"] - child_time[rec["id"]], 0.0)
+        entry[1] += 1
+        entry[2] += rec["rows_in"] or 0
+        entry[3] = max(entry[3], rec["peak_rss_mb"] or 0.0)
+
+    summary = defaultdict(list)
+    for (dataset, step), (seconds, calls, rows_in, peak) in totals.items():
+        summary[dataset].append((step, seconds, calls, rows_in, peak))
+    return {dataset: sorted(steps, key=lambda s: -s[1]) for dataset, steps in sorted(summary.items())}
+
+
+def print_trace_summary(path, top=5):
+    runs = [rec for rec in read_trace(path) if rec["cat"] == "run"]
+    if runs:
+        print(f"\n⏱️  Pipeline: {sum(rec['dur'] for rec in runs):.2f}s, "
+              f"{max(rec['peak_rss_mb'] or 0.0 for rec in runs):.1f} MB peak (parent process)")
+    for dataset, steps in trace_summary(path).items():
+        total = sum(s[1] for s in steps)
+        if not total:
+            continue  # only skipped or no-op stages, nothing to rank
+        print(f"\n⏱️  {dataset}")
+        for step, seconds, calls, rows_in, peak in steps[:top]:
+            rows = f"{rows_in:>12,} rows in" if rows_in else " " * 20
+            print(f"   {step:<28} {seconds:>8.2f}s {seconds / total:>5.0%}  x{calls:<4} {rows}  {peak:>8.1f} MB peak")
+
+
+# ------------------ SAMPLING PROFILER ------------------
+class _Sampler:
+    """
+    Samples every thread's Python stack of this process while the span is
+    open; folded stacks are appended next to the trace on stop.
+    """
+    def __init__(self, owner, interval=PROFILE_INTERVAL):
+        self.owner = owner
+        self.interval = interval
+        self.counts = Counter()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="stack-sampler")
+        self.thread.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self.done.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.counts[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+        path = trace_path()
+        if path is None or not self.counts:
+            return
+        prefix = ";".join(f"{k}={self.owner.attrs[k]}" for k in ("dataset", "stage") if k in self.owner.attrs)
+        lines = "".join(f"{prefix or self.owner.name};{stack} {n}\n" for stack, n in self.counts.items())
+        with open(path.with_suffix(".folded"), "a") as f:
+            f.write(lines)
@@ -0,0 +1,162 @@
+# Purpose:
+# Background pipeline jobs (queued, cancellable, with live progress).
+
+# The UI submits run_pipeline() here instead of blocking on a subprocess.
+# Each submission gets a job id and runs on a small thread pool; at most
+# MAX_CONCURRENT_JOBS pipelines run at once and later submissions wait in
+# the queue (two uploads never start two full runs side by side). The
+# pipeline's progress events are appended to the job as they happen, so a
+# poller sees each dataset's stage finish - and its outputs appear - long
+# before the whole run is done.
+
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from src.analysis_pipeline import PipelineCancelled, run_pipeline
+
+MAX_CONCURRENT_JOBS = 1
+KEEP_FINISHED_JOBS = 20   # finished jobs remembered for the UI
+
+
+class Job:
+    """
+    One pipeline run. status: queued -> running -> succeeded / failed /
+    cancelled. `events` are run_pipeline's progress events, in order.
+    """
+    def __init__(self, kwargs):
+        self.id = uuid.uuid4().hex[:8]
+        self.kwargs = kwargs
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events = []
+        self.stage = None
+        self.failures = {}    # dataset -> error of datasets that dropped out
+        self.error = None     # the run itself crashed
+        self.cancel = threading.Event()
+        self.future = None
+        self.lock = threading.Lock()
+
+    def on_event(self, event):
+        with self.lock:
+            self.events.append({**event, "time": time.time()})
+            if event["stage"] is not None:
+                self.stage = event["stage"]
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def snapshot(self):
+        """
+        Plain-dict copy of the job's state, safe to read while it runs.
+        """
+        with self.lock:
+            plan = next((e for e in self.events if e["status"] == "planned"), None)
+            nodes = {(e["dataset"], e["stage"]): e["status"] for e in self.events if e.get("dataset")}
+            running = [node for node, status in nodes.items() if status == "started"]
+            if self.status == "succeeded":
+                progress = 1.0
+            elif plan:
+                # A failed dataset's later stages never run: count them as settled
+                failed = {dataset for (dataset, _), status in nodes.items() if status == "failed"}
+                settled = sum(1 for (dataset, _), status in nodes.items()
+                              if status != "started" and dataset not in failed)
+                total = len(plan["datasets"]) * len(plan["stages"])
+                progress = (settled + len(failed) * len(plan["stages"])) / max(total, 1)
+            else:
+                progress = 0.0
+            return {
+                "id": self.id,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": progress,
+                "running": running,
+                "submitted_at": self.submitted_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "events": list(self.events),
+                "failures": dict(self.failures),
+                "error": self.error,
+            }
+
+
+def stage_outputs(snapshot, stage):
+    """
+    {dataset: files} written (or found up to date) by `stage` so far,
+    from a job snapshot - lets the UI show partial results mid-run.
+    """
+    return {event["dataset"]: event["outputs"] for event in snapshot["events"]
+            if event["stage"] == stage and event["status"] in ("done", "skipped")}
+
+
+class JobRunner:
+    def __init__(self, max_concurrent=MAX_CONCURRENT_JOBS):
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="pipeline-job")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, **kwargs):
+        """
+        Queues run_pipeline(**kwargs) and returns the job id.
+        """
+        job = Job(kwargs)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        job.future = self.executor.submit(self._run, job)
+        return job.id
+
+    def _run(self, job):
+        if job.cancel.is_set():
+            job.status, job.finished_at = "cancelled", time.time()
+            return
+        job.status, job.started_at = "running", time.time()
+        try:
+            ctx = run_pipeline(on_event=job.on_event, cancel=job.cancel, **job.kwargs)
+            if ctx is not None:
+                job.failures = {ds.name: ds.error for ds in ctx.failures()}
+            job.status = "succeeded"
+        except PipelineCancelled:
+            print(f"🛑 Pipeline job {job.id} cancelled")
+            job.status = "cancelled"
+        except Exception as e:
+            traceback.print_exc()
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def cancel(self, job_id):
+        """
+        Queued jobs never start; a running job stops at its next dataset
+        boundary (work already in flight finishes first).
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.done:
+            return False
+        job.cancel.set()
+        if job.future.cancel():
+            job.status, job.finished_at = "cancelled", time.time()
+        return True
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return job.snapshot() if job else None
+
+    def active(self):
+        """
+        Snapshots of the queued and running jobs, oldest first.
+        """
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.snapshot() for job in jobs if not job.done]
+
+    def _forget_old_jobs(self):
+        finished = [job for job in self.jobs.values() if job.done]
+        for job in sorted(finished, key=lambda job: job.submitted_at)[:-KEEP_FINISHED_JOBS]:
+            del self.jobs[job.id]
@@ -0,0 +1,298 @@
+import hashlib
+import json
+import numpy as np
+import joblib
+from pathlib import Path
+from joblib import Parallel, delayed, effective_n_jobs
+
+# A RandomForest flattened into a handful of contiguous arrays.
+#
+# All trees share one node table with global node ids; `children` holds the
+# (left, right) pair of every node and leaves are marked with feature -1;
+# `missing_left` is sklearn's missing_go_to_left (where NaN goes at each split).
+# On disk the model is a directory '<stem>_model.forest/' holding one .npy per
+# array plus meta.json, so the arrays can be memory-mapped read-only
+# (near-instant load, pages shared by every process that maps the same file).
+# meta.json records the sha256 of the pickle it was compiled from; a copy
+# whose pickle has changed since is ignored.
+
+ARRAYS = ["feature", "threshold", "children", "missing_left", "value", "roots"]
+COMPILED_SUFFIX = ".forest"
+HASH_BLOCK = 1 << 20
+
+# ---------------- EXPORT ----------------
+def _round_down_float32(threshold):
+    """
+    Largest float32 <= each float64 threshold. sklearn tests float32 X against
+    float64 thresholds; for float32 x, `x <= t` and `x <= round_down(t)` agree,
+    so splits stay exact at half the size.
+    """
+    threshold32 = threshold.astype(np.float32)
+    too_big = threshold32 > threshold
+    threshold32[too_big] = np.nextafter(threshold32[too_big], np.float32(-np.inf))
+    return threshold32
+
+def compile_forest(model):
+    """
+    Flattens a fitted RandomForestClassifier/Regressor into arrays + metadata.
+    """
+    is_classifier = hasattr(model, "classes_")
+    features, thresholds, children, missing_left, values, roots = [], [], [], [], [], []
+    offset = 0
+
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        is_leaf = tree.children_left == -1
+
+        features.append(np.where(is_leaf, -1, tree.feature).astype(np.int32))
+        thresholds.append(_round_down_float32(np.where(is_leaf, np.inf, tree.threshold)))
+        node_children = np.stack([tree.children_left, tree.children_right], axis=1) + offset
+        node_children[is_leaf] = -1
+        children.append(node_children.astype(np.int32))
+        missing_left.append(np.asarray(tree.missing_go_to_left, dtype=bool) & ~is_leaf)
+
+        if is_classifier:
+            # Normalise to class probabilities (what tree.predict_proba returns)
+            node_value = tree.value[:, 0, :]
+            node_value = node_value / node_value.sum(axis=1, keepdims=True)
+        else:
+            node_value = tree.value[:, 0, :1]
+        values.append(node_value.astype(np.float32))
+
+        roots.append(offset)
+        offset += n_nodes
+
+    arrays = {
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "children": np.concatenate(children),
+        "missing_left": np.concatenate(missing_left),
+        "value": np.concatenate(values),
+        "roots": np.array(roots, dtype=np.int32),
+    }
+    meta = {
+        "kind": "classifier" if is_classifier else "regressor",
+        "classes": model.classes_.tolist() if is_classifier else None,
+        "feature_names": [str(name) for name in model.feature_names_in_],
+        "n_trees": len(model.estimators_),
+        "max_depth": int(max(est.tree_.max_depth for est in model.estimators_)),
+    }
+    return CompiledForest(arrays, meta)
+
+def model_digest(model_file):
+    digest = hashlib.sha256()
+    with open(model_file, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def save_compiled_forest(compiled, forest_dir, model_file=None):
+    """
+    Writes the arrays and meta.json; `model_file` is the pickle the forest
+    came from, whose hash ties the export to it.
+    """
+    forest_dir = Path(forest_dir)
+    forest_dir.mkdir(parents=True, exist_ok=True)
+    (forest_dir / "meta.json").unlink(missing_ok=True)
+    for name in ARRAYS:
+        np.save(forest_dir / f"{name}.npy", np.ascontiguousarray(compiled.arrays[name]))
+    meta = dict(compiled.meta)
+    if model_file is not None:
+        meta["model_sha256"] = model_digest(model_file)
+    # meta.json is written last: its presence marks a complete export
+    with open(forest_dir / "meta.json", "w") as f:
+        json.dump(meta, f, indent=2)
+
+def load_compiled_forest(forest_dir, mmap=True):
+    forest_dir = Path(forest_dir)
+    with open(forest_dir / "meta.json") as f:
+        meta = json.load(f)
+    mmap_mode = "r" if mmap else None
+    arrays = {name: np.load(forest_dir / f"{name}.npy", mmap_mode=mmap_mode) for name in ARRAYS}
+    return CompiledForest(arrays, meta)
+
+def load_forest(model_file):
+    """
+    Loads '<stem>_model.pkl', preferring its compiled twin when that was
+    compiled from this exact pickle (same content hash). Falls back to
+    joblib otherwise.
+    """
+    model_file = Path(model_file)
+    forest_dir = model_file.with_suffix(COMPILED_SUFFIX)
+    meta_file = forest_dir / "meta.json"
+    if meta_file.exists():
+        with open(meta_file) as f:
+            compiled_from = json.load(f).get("model_sha256")
+        if compiled_from == model_digest(model_file):
+            return load_compiled_forest(forest_dir)
+    return joblib.load(model_file)
+
+# ---------------- EVALUATION ----------------
+class CompiledForest:
+    """
+    Array-backed forest. Exposes the few sklearn attributes the scoring code
+    reads (feature_names_in_, classes_) plus a vectorized batch evaluator.
+    """
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        self.feature_names_in_ = np.array(meta["feature_names"], dtype=object)
+        self.is_classifier = meta["kind"] == "classifier"
+        if self.is_classifier:
+            self.classes_ = np.array(meta["classes"])
+        self.n_trees = meta["n_trees"]
+
+    def leaf_values(self, X, trees=slice(None)):
+        """
+        Walks all rows of X down the selected trees at once.
+        Returns leaf values of shape (n_rows, n_selected_trees, n_outputs).
+        Only (row, tree) pairs that have not reached a leaf yet are advanced,
+        so the work is the total path length, not n_rows * n_trees * depth.
+        """
+        feature = self.arrays["feature"]
+        threshold = self.arrays["threshold"]
+        missing_left = self.arrays["missing_left"]
+        children = self.arrays["children"].reshape(-1)  # [2*node] left, [2*node+1] right
+
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        X_flat = X.reshape(-1)
+
+        roots = self.arrays["roots"][trees]
+        node = np.tile(roots, n_rows)                              # one slot per (row, tree)
+        index_type = np.int32 if X.size < 2**31 else np.int64
+        row_start = np.repeat(np.arange(n_rows, dtype=index_type) * n_features, len(roots))
+
+        # Compact working set: slots still walking, their node, X offset and split feature
+        split_feature = feature[node]
+        slot = np.flatnonzero(split_feature >= 0)
+        current, offset, split_feature = node[slot], row_start[slot], split_feature[slot]
+
+        while len(slot):
+            x = X_flat[offset + split_feature]
+            go_right = x > threshold[current]
+            # NaN compares False both ways: it goes where sklearn sent it in training
+            missing = np.isnan(x)
+            if missing.any():
+                go_right[missing] = ~missing_left[current[missing]]
+            current = children[2 * current + go_right]
+            split_feature = feature[current]
+
+            reached_leaf = split_feature < 0
+            if reached_leaf.any():
+                node[slot[reached_leaf]] = current[reached_leaf]
+                walking = ~reached_leaf
+                slot, current = slot[walking], current[walking]
+                offset, split_feature = offset[walking], split_feature[walking]
+
+        return self.arrays["value"][node].reshape(n_rows, len(roots), -1)
+
+    def _evaluate_block(self, X_block):
+        values = self.leaf_values(X_block)
+        if self.is_classifier:
+            votes = values.argmax(axis=2)
+        else:
+            votes = values[:, :, 0]
+        return values.mean(axis=1), votes.var(axis=1)
+
+    def predict_all(self, X, block_size=10_000, n_jobs=-1):
+        """
+        Same outputs as forest_inference.forest_predict():
+        (probability or None, prediction, variance of tree predictions).
+        Row blocks are evaluated in parallel threads.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        starts = range(0, X.shape[0], block_size)
+        n_jobs = max(1, min(effective_n_jobs(n_jobs), len(starts)))
+        blocks = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(self._evaluate_block)(X[start:start + block_size]) for start in starts
+        )
+        if not blocks:
+            n_out = len(self.classes_) if self.is_classifier else 1
+            blocks = [(np.zeros((0, n_out)), np.zeros(0))]
+
+        mean_value = np.concatenate([b[0] for b in blocks])
+        variance = np.concatenate([b[1] for b in blocks])
+
+        if self.is_classifier:
+            return mean_value, self.classes_[mean_value.argmax(axis=1)], variance
+        return None, mean_value[:, 0], variance
+
+    # ---------------- ADAPTIVE (EARLY-EXIT) EVALUATION ----------------
+    def _settled(self, mean, n_done, thresholds, z):
+        """
+        True for rows whose full-forest mean of a per-tree quantity in [0, 1]
+        can no longer land on the other side of any threshold.
+
+        Trees are i.i.d. draws of the same randomized learner, so the sum over
+        the `remaining` trees is predicted as remaining * mean, with variance
+        remaining * q(1-q) * (1 + remaining / n_done): the spread of those
+        trees plus the error in the running mean. q is the Agresti-Coull
+        adjusted rate, so unanimous rows still get a non-zero spread.
+        """
+        if not thresholds:
+            return np.ones(len(mean), dtype=bool)
+        remaining = self.n_trees - n_done
+        q = (mean * n_done + z * z / 2) / (n_done + z * z)
+        spread = z * np.sqrt(remaining * q * (1 - q) * (1 + remaining / n_done))
+        lower = (mean * self.n_trees - spread) / self.n_trees
+        upper = (mean * self.n_trees + spread) / self.n_trees
+
+        settled = np.ones(len(mean), dtype=bool)
+        for threshold in thresholds:
+            settled &= (upper < threshold) | (lower > threshold)
+        return settled
+
+    def _evaluate_block_adaptive(self, X_block, proba_thresholds, vote_thresholds, stage_trees, z):
+        n_rows = X_block.shape[0]
+        proba_sum = np.zeros((n_rows, len(self.classes_)))
+        vote_sum = np.zeros(n_rows)
+        n_done = np.zeros(n_rows, dtype=np.int32)
+        active = np.arange(n_rows)
+
+        for start in range(0, self.n_trees, stage_trees):
+            stop = min(start + stage_trees, self.n_trees)
+            values = self.leaf_values(X_block[active], trees=slice(start, stop))
+            proba_sum[active] += values.sum(axis=1)
+            vote_sum[active] += values.argmax(axis=2).sum(axis=1)
+            n_done[active] = stop
+            if stop == self.n_trees:
+                break
+
+            # Keep walking only the rows whose decision could still flip
+            settled = (self._settled(proba_sum[active, 1] / stop, stop, proba_thresholds, z)
+                       & self._settled(vote_sum[active] / stop, stop, vote_thresholds, z))
+            active = active[~settled]
+            if not len(active):
+                break
+
+        vote_mean = vote_sum / n_done
+        # Votes are 0/1, so E[vote^2] = E[vote]
+        return proba_sum / n_done[:, None], vote_mean - vote_mean ** 2, n_done
+
+    def predict_adaptive(self, X, proba_thresholds=(), vote_thresholds=(), stage_trees=8, z=3.0,
+                         block_size=10_000, n_jobs=-1):
+        """
+        Binary classifiers only. Like predict_all(), but trees are evaluated
+        in stages of `stage_trees` and a row stops once neither its mean
+        class-1 probability nor its vote fraction can cross the given
+        thresholds any more. Returns (probability, prediction, variance,
+        trees evaluated per row); settled rows report their partial-forest
+        estimates.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        starts = range(0, X.shape[0], block_size)
+        n_jobs = max(1, min(effective_n_jobs(n_jobs), len(starts)))
+        blocks = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(self._evaluate_block_adaptive)(
+                X[start:start + block_size], tuple(proba_thresholds), tuple(vote_thresholds), stage_trees, z)
+            for start in starts
+        )
+        if not blocks:
+            blocks = [(np.zeros((0, len(self.classes_))), np.zeros(0), np.zeros(0, dtype=np.int32))]
+
+        mean_value = np.concatenate([b[0] for b in blocks])
+        variance = np.concatenate([b[1] for b in blocks])
+        n_done = np.concatenate([b[2] for b in blocks])
+        return mean_value, self.classes_[mean_value.argmax(axis=1)], variance, n_done
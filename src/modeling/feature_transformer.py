@@ -0,0 +1,127 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# Fitted replacement for `pd.get_dummies(X, drop_first=True)` + column patching.
+#
+# Fitted once at training time, saved as '<stem>_model.features.json' next to
+# the model, and used by every scoring path to turn a raw frame straight into a
+# preallocated float32 matrix in the training column order. Column names and
+# order are exactly what get_dummies(drop_first=True) produces, so models and
+# compiled forests see the same layout in training and serving.
+# For time series it also carries the spec of the lag / rolling / return
+# features (see timeseries_features.py), which scoring rebuilds from raw
+# rows; the series' date column is never encoded.
+
+TRANSFORMER_SUFFIX = ".features.json"
+
+def is_categorical(series):
+    """
+    Columns get_dummies would one-hot encode: text, strings and categories.
+    """
+    return (
+        pd.api.types.is_object_dtype(series)
+        or pd.api.types.is_string_dtype(series)
+        or isinstance(series.dtype, pd.CategoricalDtype)
+    )
+
+def _to_json_value(value):
+    return value.item() if hasattr(value, "item") else value
+
+class FeatureTransformer:
+    def __init__(self, target=None, numeric_columns=None, categories=None, timeseries=None):
+        self.target = target
+        self.numeric_columns = numeric_columns or []
+        self.categories = categories or {}  # column -> full vocabulary (first one is dropped)
+        self.timeseries = timeseries        # SeriesSpec.to_dict() for time series, else None
+        self._build_layout()
+
+    def _build_layout(self):
+        self.feature_names_ = list(self.numeric_columns)
+        self.offsets_ = {}
+        for col, vocab in self.categories.items():
+            self.offsets_[col] = len(self.feature_names_)
+            self.feature_names_ += [f"{col}_{value}" for value in vocab[1:]]
+
+    # ---------------- FIT ----------------
+    def fit(self, df, target=None, timeseries=None):
+        """
+        Learns numeric columns and category vocabularies from the training
+        frame (the target column, if given, is left out).
+        """
+        self.target = target
+        self.timeseries = timeseries
+        self.numeric_columns = []
+        self.categories = {}
+        date_column = timeseries["date_column"] if timeseries else None
+        for col in df.columns:
+            series = df[col]
+            # Raw timestamps aren't a feature (they never repeat at scoring time)
+            if col in (target, date_column) or pd.api.types.is_datetime64_any_dtype(series):
+                continue
+            if is_categorical(series):
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    vocab = list(series.cat.categories)
+                else:
+                    vocab = sorted(series.dropna().unique())
+                self.categories[col] = [_to_json_value(v) for v in vocab]
+            else:
+                self.numeric_columns.append(col)
+        self._build_layout()
+        return self
+
+    # ---------------- TRANSFORM ----------------
+    def transform(self, df):
+        """
+        Raw frame -> float32 matrix (n_rows, n_features). Missing columns stay
+        0 and unseen categories map to all-zero dummies, like get_dummies +
+        reindex(fill_value=0) did.
+        """
+        X = np.zeros((len(df), len(self.feature_names_)), dtype=np.float32)
+
+        for j, col in enumerate(self.numeric_columns):
+            if col in df.columns:
+                X[:, j] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float32, na_value=np.nan)
+
+        for col, vocab in self.categories.items():
+            if col not in df.columns or len(vocab) < 2:
+                continue
+            codes = pd.Categorical(df[col], categories=vocab).codes
+            rows = np.flatnonzero(codes >= 1)  # code 0 is the dropped first category
+            X[rows, self.offsets_[col] + codes[rows] - 1] = 1.0
+        return X
+
+    def transform_frame(self, df):
+        """
+        Same matrix wrapped in a DataFrame with the training column names
+        (what sklearn's fit() wants to record feature_names_in_).
+        """
+        return pd.DataFrame(self.transform(df), columns=self.feature_names_, index=df.index)
+
+    # ---------------- PERSISTENCE ----------------
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "target": self.target,
+                "numeric_columns": self.numeric_columns,
+                "categories": self.categories,
+                "timeseries": self.timeseries,
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        return cls(state["target"], state["numeric_columns"], state["categories"], state.get("timeseries"))
+
+def transformer_path(model_file):
+    return Path(model_file).with_suffix(TRANSFORMER_SUFFIX)
+
+def load_feature_transformer(model_file):
+    """
+    The transformer saved next to '<stem>_model.pkl', or None for models
+    trained before transformers existed.
+    """
+    path = transformer_path(model_file)
+    return FeatureTransformer.load(path) if path.exists() else None
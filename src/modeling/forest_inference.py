@@ -0,0 +1,117 @@
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+
+from src.modeling.compiled_forest import CompiledForest, compile_forest
+
+# ---------------- SETTINGS ----------------
+BLOCK_SIZE = 10_000  # rows pushed through the trees at a time
+N_JOBS = -1          # threads walking trees in parallel (-1 = all cores)
+
+# Early exit (forest_predict_adaptive). Off by default: it only settles which
+# side of each cut-off a row is on (its label / bucket). A row that stops
+# early reports the mean of the trees it walked, so its probability and
+# variance (Risk_Percentage, uncertainty scores) are estimates, not the
+# full forest's values; Trees_Evaluated shows which rows those are.
+EARLY_EXIT = False   # True = labels from fewer trees, approximate numbers
+STAGE_TREES = 8      # trees evaluated per stage before rows are re-checked
+CONFIDENCE_Z = 3.0   # width of the bound on the trees not evaluated yet
+
+def _walk_trees(trees, X, is_classifier, n_outputs, block_size):
+    """
+    Runs one group of trees over every row block and returns running sums:
+    summed tree outputs (probabilities or values), summed votes and summed
+    squared votes. Nothing of shape (n_trees, n_rows) is ever built.
+    """
+    n_rows = X.shape[0]
+    value_sum = np.zeros((n_rows, n_outputs))
+    vote_sum = np.zeros(n_rows)
+    vote_sq_sum = np.zeros(n_rows)
+
+    for start in range(0, n_rows, block_size):
+        block = slice(start, start + block_size)
+        X_block = X[block]
+        for tree in trees:
+            if is_classifier:
+                tree_proba = tree.predict_proba(X_block, check_input=False)
+                vote = tree_proba.argmax(axis=1)  # same as tree.predict (class index)
+                value_sum[block] += tree_proba
+            else:
+                vote = tree.predict(X_block, check_input=False)
+                value_sum[block, 0] += vote
+            vote_sum[block] += vote
+            vote_sq_sum[block] += vote * vote
+
+    return value_sum, vote_sum, vote_sq_sum
+
+def forest_predict(model, X, block_size=BLOCK_SIZE, n_jobs=N_JOBS):
+    """
+    Single pass over a fitted RandomForest that yields everything the scoring
+    code needs at once:
+      probability - (n_rows, n_classes) like predict_proba (None for regressors)
+      prediction  - like model.predict
+      variance    - per-row variance of the individual tree predictions
+                    (same as np.var([tree.predict(X) for tree in estimators_]))
+    X must already be in the model's training column order.
+    Works on sklearn forests and on CompiledForest (array-backed) models.
+    """
+    if isinstance(model, CompiledForest):
+        return model.predict_all(X, block_size=block_size, n_jobs=n_jobs)
+
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    trees = model.estimators_
+    is_classifier = hasattr(model, "classes_")
+    n_outputs = len(model.classes_) if is_classifier else 1
+
+    # Split the forest into one group of trees per worker thread
+    n_jobs = min(effective_n_jobs(n_jobs), len(trees))
+    groups = [group for group in np.array_split(np.arange(len(trees)), n_jobs) if len(group)]
+    partials = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(_walk_trees)([trees[i] for i in group], X, is_classifier, n_outputs, block_size)
+        for group in groups
+    )
+
+    value_sum = sum(p[0] for p in partials)
+    vote_sum = sum(p[1] for p in partials)
+    vote_sq_sum = sum(p[2] for p in partials)
+
+    n_trees = len(trees)
+    mean_value = value_sum / n_trees
+    vote_mean = vote_sum / n_trees
+    variance = np.maximum(vote_sq_sum / n_trees - vote_mean ** 2, 0.0)
+
+    if is_classifier:
+        return mean_value, model.classes_[mean_value.argmax(axis=1)], variance
+    return None, mean_value[:, 0], variance
+
+def vote_fraction_thresholds(variance_threshold):
+    """
+    For 0/1 votes the tree variance is p * (1 - p) (p = class-1 vote
+    fraction), so a variance cut-off is crossed at two vote fractions.
+    """
+    root = np.sqrt(max(1 - 4 * variance_threshold, 0.0))
+    return ((1 - root) / 2, (1 + root) / 2)
+
+def forest_predict_adaptive(model, X, proba_thresholds=(), variance_thresholds=(),
+                            block_size=BLOCK_SIZE, n_jobs=N_JOBS):
+    """
+    forest_predict() that stops evaluating trees for a row once its outcome
+    relative to the given cut-offs is settled:
+      proba_thresholds    - on the class-1 probability (e.g. risk 0.8 / 0.4)
+      variance_thresholds - on the tree variance (e.g. 0.15 uncertainty)
+    Returns (probability, prediction, variance, trees evaluated per row).
+    With EARLY_EXIT = False (the default), and for regressors and
+    multi-class models, every tree is evaluated and the numbers are exact.
+    With early exit, rows that stop carry partial-forest estimates: right
+    for the cut-offs (up to the CONFIDENCE_Z bound), not for reporting.
+    """
+    is_binary = hasattr(model, "classes_") and len(model.classes_) == 2
+    if not (EARLY_EXIT and is_binary):
+        proba, predictions, variance = forest_predict(model, X, block_size, n_jobs)
+        n_trees = model.n_trees if isinstance(model, CompiledForest) else len(model.estimators_)
+        return proba, predictions, variance, np.full(len(predictions), n_trees, dtype=np.int32)
+
+    if not isinstance(model, CompiledForest):
+        model = compile_forest(model)
+    vote_thresholds = [p for v in variance_thresholds for p in vote_fraction_thresholds(v)]
+    return model.predict_adaptive(X, proba_thresholds, vote_thresholds, STAGE_TREES, CONFIDENCE_Z,
+                                  block_size, n_jobs)
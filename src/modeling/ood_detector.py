@@ -0,0 +1,103 @@
+import json
+import numpy as np
+from pathlib import Path
+
+# Learned out-of-distribution detector, fitted on each model's training matrix.
+#
+# Two checks, both plain matrix arithmetic over the model's float32 features:
+#   - per-feature envelopes: a row is OOD when any feature falls outside the
+#     training [0.1%, 99.9%] quantile range widened by ENVELOPE_MARGIN
+#     (catches the "9999 K air temperature" kind of value)
+#   - Mahalanobis distance to the training mean: catches rows whose features
+#     are each plausible but whose combination never occurred in training.
+#     The cut-off is the training rows' DISTANCE_QUANTILE widened by
+#     DISTANCE_MARGIN, so (like the envelopes) it leaves headroom instead of
+#     flagging the outermost 0.1% of the training data by construction
+# Saved as '<stem>_model.ood.json' next to the model. Feature order is the
+# feature transformer's, so any matrix the model can score can be checked.
+
+OOD_SUFFIX = ".ood.json"
+ENVELOPE_QUANTILES = (0.001, 0.999)
+ENVELOPE_MARGIN = 0.25       # widen each envelope by 25% of its width on both sides
+DISTANCE_QUANTILE = 0.999    # distance of the outermost training rows ...
+DISTANCE_MARGIN = 0.5        # ... times 1.5 is the cut-off (squared distance)
+BLOCK_SIZE = 50_000          # rows scored per block (bounds the temporaries)
+
+class OODDetector:
+    def __init__(self, lower=None, upper=None, mean=None, precision=None, threshold=None):
+        self.lower = None if lower is None else np.asarray(lower, dtype=np.float32)
+        self.upper = None if upper is None else np.asarray(upper, dtype=np.float32)
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        self.precision = None if precision is None else np.asarray(precision, dtype=np.float64)
+        self.threshold = threshold
+
+    # ---------------- FIT ----------------
+    def fit(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        q_low, q_high = np.nanquantile(X, ENVELOPE_QUANTILES, axis=0)
+        margin = ENVELOPE_MARGIN * (q_high - q_low)
+        self.lower = (q_low - margin).astype(np.float32)
+        self.upper = (q_high + margin).astype(np.float32)
+
+        # Pseudo-inverse: one-hot columns and constant features make the covariance singular
+        self.mean = np.nanmean(X, axis=0)
+        covariance = np.atleast_2d(np.cov(X - self.mean, rowvar=False))
+        self.precision = np.linalg.pinv(covariance, hermitian=True)
+        self.threshold = float(np.quantile(self._distance(X), DISTANCE_QUANTILE) * (1 + DISTANCE_MARGIN))
+        return self
+
+    # ---------------- SCORE ----------------
+    def _distance(self, X):
+        """
+        Squared Mahalanobis distance of each row to the training mean.
+        """
+        centered = np.asarray(X, dtype=np.float64) - self.mean
+        return np.einsum("ij,ij->i", centered @ self.precision, centered)
+
+    def score(self, X, block_size=BLOCK_SIZE):
+        """
+        Returns (features outside their envelope per row, squared distance).
+        """
+        X = np.asarray(X, dtype=np.float32)
+        outside = np.empty(len(X), dtype=np.int32)
+        distance = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), block_size):
+            block = X[start:start + block_size]
+            outside[start:start + len(block)] = ((block < self.lower) | (block > self.upper)).sum(axis=1)
+            distance[start:start + len(block)] = self._distance(block)
+        return outside, distance
+
+    def predict(self, X, block_size=BLOCK_SIZE):
+        """
+        Boolean OOD flag per row.
+        """
+        outside, distance = self.score(X, block_size)
+        return (outside > 0) | (distance > self.threshold)
+
+    # ---------------- PERSISTENCE ----------------
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "lower": self.lower.tolist(),
+                "upper": self.upper.tolist(),
+                "mean": self.mean.tolist(),
+                "precision": self.precision.tolist(),
+                "threshold": self.threshold,
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        return cls(state["lower"], state["upper"], state["mean"], state["precision"], state["threshold"])
+
+def ood_path(model_file):
+    return Path(model_file).with_suffix(OOD_SUFFIX)
+
+def load_ood_detector(model_file):
+    """
+    The detector saved next to '<stem>_model.pkl', or None for models
+    trained before detectors existed.
+    """
+    path = ood_path(model_file)
+    return OODDetector.load(path) if path.exists() else None
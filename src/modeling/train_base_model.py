@@ -1,55 +1,322 @@
+import json
 import pandas as pd
+import numpy as np
 import joblib  # Used to save the model
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
 from sklearn.metrics import accuracy_score, mean_squared_error
 from pathlib import Path
+import shutil
 import sys
 
-# Adding src to path so we can import utils
+# Adding src (and the project root) to path so we can import utils
 sys.path.append(str(Path(__file__).resolve().parents[1]))
-from utils import load_csv, detect_target_column
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from utils import detect_target_column
+from src.schema import read_csv_typed
+from src.modeling.compiled_forest import compile_forest, save_compiled_forest, COMPILED_SUFFIX
+from src.modeling.feature_transformer import FeatureTransformer, transformer_path
+from src.modeling.ood_detector import OODDetector, ood_path
+from src.instrumentation import span
+from src.row_index import hash_rows
+from src.timeseries_features import load_spec
 
-def train_model():
-    # Setup Paths
-    ROOT_DIR = Path(__file__).resolve().parents[2]
-    PROCESSED_DIR = ROOT_DIR / "data" / "processed"
-    MODEL_SAVE_DIR = ROOT_DIR / "models"
-    MODEL_SAVE_DIR.mkdir(exist_ok=True)
-    
-    for cleaned_file in PROCESSED_DIR.glob("*_cleaned.csv"):
-        print(f"\n--- Training Model for: {cleaned_file.name} ---")
-        
-        # 1. Load Data
-        df = pd.read_csv(cleaned_file)
-        
-        # 2. Detect Target & Features
-        target = detect_target_column(df)
-        X = df.drop(columns=[target])
-        y = df[target]
-        
-        # Convert text to numbers (One-Hot Encoding)
-        X = pd.get_dummies(X, drop_first=True)
-        
-        # 3. Split Data
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-        
-        # 4. Choose Model & Train
-        if y.dtype == 'object' or y.nunique() < 10:
-            model = RandomForestClassifier(n_estimators=100)
-            model.fit(X_train, y_train)
-            preds = model.predict(X_test)
-            print(f"Type: Classification | Accuracy: {accuracy_score(y_test, preds):.2f}")
+# Setup Paths
+ROOT_DIR = Path(__file__).resolve().parents[2]
+PROCESSED_DIR = ROOT_DIR / "data" / "processed"
+MODEL_SAVE_DIR = ROOT_DIR / "models"
+
+# ------------------ SETTINGS ------------------
+N_TREES = 100             # trees in a full fit
+FIT_JOBS = -1             # cores for a full fit when the caller sets no budget (-1 = all)
+MIN_TRAIN_ROWS = 50       # fewer cleaned rows than this -> training skipped (e.g. an export already ingested)
+
+# Incremental updates: when a model already exists, only the rows it has
+# not seen yet (plus some recent ones) are trained on. They grow the forest
+# by TREES_PER_UPDATE trees (sklearn warm_start) and the oldest trees are
+# retired beyond TREE_BUDGET, so an update costs O(new rows), not O(file).
+# The OOD detector is refitted on the whole file with every update; with no
+# unseen rows nothing is retrained or rewritten.
+INCREMENTAL = True        # False = always a full fit (so does the pipeline's --force)
+TREES_PER_UPDATE = 20
+TREE_BUDGET = 140         # most trees a forest keeps (oldest retired first)
+RECENT_ROWS = 2_000       # already-seen rows mixed into each update
+MAX_NEW_SHARE = 0.5       # more new rows than this share of the file -> full fit
+HOLDOUT_SHARE = 0.2       # of the update batch, held out for the drift check
+DRIFT_TOLERANCE = 0.05    # accuracy this far below (RMSE this share above) the last full fit's -> full fit
+
+ROWS_SUFFIX = ".rows.npy"      # sorted hashes of the rows the model has seen
+STATE_SUFFIX = ".train.json"   # full-fit holdout score + update history
+
+def rows_path(model_file):
+    return Path(model_file).with_suffix(ROWS_SUFFIX)
+
+def state_path(model_file):
+    return Path(model_file).with_suffix(STATE_SUFFIX)
+
+def _remove_model(model_file):
+    """
+    Deletes a model and everything saved with it.
+    """
+    model_file = Path(model_file)
+    for path in (model_file, transformer_path(model_file), ood_path(model_file),
+                 rows_path(model_file), state_path(model_file)):
+        path.unlink(missing_ok=True)
+    shutil.rmtree(model_file.with_suffix(COMPILED_SUFFIX), ignore_errors=True)
+
+def _is_classification(y):
+    return y.dtype == 'object' or y.nunique() < 10
+
+def _score(model, X, y, classification):
+    """
+    Holdout accuracy (classification) or RMSE (regression).
+    """
+    with span("evaluate", rows_in=len(X)):
+        preds = model.predict(X)
+    if classification:
+        return float(accuracy_score(y, preds))
+    return float(np.sqrt(mean_squared_error(y, preds)))
+
+def _drifted(score, baseline, classification):
+    if classification:
+        return score < baseline - DRIFT_TOLERANCE
+    return score > baseline * (1 + DRIFT_TOLERANCE)
+
+# ------------------ FULL FIT ------------------
+def _fit_full(X, y, n_jobs):
+    """
+    Fresh forest on 80% of the file. Returns (model, holdout score, X_train).
+    """
+    # 2. Split Data
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    # 3. Choose Model & Train
+    classification = _is_classification(y)
+    forest = RandomForestClassifier if classification else RandomForestRegressor
+    model = forest(n_estimators=N_TREES, n_jobs=n_jobs)
+    with span("fit", rows_in=len(X_train), mode="full"):
+        model.fit(X_train, y_train)
+    score = _score(model, X_test, y_test, classification)
+    if classification:
+        print(f"Type: Classification | Accuracy: {score:.2f}")
+    else:
+        print(f"Type: Regression | RMSE: {score:.2f}")
+    return model, score, X_train
+
+# ------------------ TRAINING DATA ------------------
+class TrainingData:
+    """
+    The cleaned data as the model sees it: either the cleaning stage's
+    memory-mapped feature cache (nothing parsed or encoded here) or a
+    cleaned frame that is encoded on demand.
+    """
+    def __init__(self, df=None, features=None, timeseries=None):
+        self.df = df
+        self.features = features
+        if features is not None:
+            self.target = features.target
+            self.transformer = features.transformer
+            self.hashes = np.asarray(features.hashes)
         else:
-            model = RandomForestRegressor(n_estimators=100)
-            model.fit(X_train, y_train)
-            preds = model.predict(X_test)
-            print(f"Type: Regression | RMSE: {mean_squared_error(y_test, preds, squared=False):.2f}")
+            self.target = detect_target_column(df)
+            self.transformer = FeatureTransformer().fit(df, target=self.target, timeseries=timeseries)
+            with span("hash rows", rows_in=len(df)):
+                self.hashes = hash_rows(df)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def X(self, rows=None):
+        """
+        Model matrix as a DataFrame (all rows, or the positions in `rows`).
+        """
+        if self.features is not None:
+            return self.features.frame(rows)
+        # Convert text to numbers (One-Hot Encoding, same layout as get_dummies(drop_first=True))
+        df = self.df if rows is None else self.df.iloc[rows]
+        with span("encode", rows_in=len(df)):
+            return self.transformer.transform_frame(df)
+
+    def y(self, rows=None):
+        if self.features is not None:
+            return self.features.target_series(rows)
+        return self.df[self.target] if rows is None else self.df[self.target].iloc[rows]
+
+def _same_layout(a, b):
+    return (a.target == b.target and a.numeric_columns == b.numeric_columns
+            and a.categories == b.categories)
 
-        # 5. Save the trained model file
-        model_path = MODEL_SAVE_DIR / f"{cleaned_file.stem}_model.pkl"
+# ------------------ INCREMENTAL UPDATE ------------------
+def _previous_fit(model_path, data):
+    """
+    (model, transformer, detector, seen hashes, state) of the saved model
+    when an incremental update can build on it, else None.
+    """
+    needed = [model_path, transformer_path(model_path), ood_path(model_path),
+              rows_path(model_path), state_path(model_path)]
+    if not INCREMENTAL or not all(path.exists() for path in needed):
+        return None
+    transformer = FeatureTransformer.load(transformer_path(model_path))
+    # New columns or categories change the feature layout: only a full fit can learn them
+    if not _same_layout(transformer, data.transformer):
+        return None
+    with open(state_path(model_path)) as f:
+        state = json.load(f)
+    return (joblib.load(model_path), transformer, OODDetector.load(ood_path(model_path)),
+            np.load(rows_path(model_path)), state)
+
+def _grow_forest(model, X_fit, y_fit, n_jobs):
+    """
+    Adds TREES_PER_UPDATE trees fitted on the update batch (warm_start keeps
+    the existing ones) and retires the oldest beyond TREE_BUDGET.
+    """
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + TREES_PER_UPDATE,
+                     n_jobs=n_jobs)
+    with span("fit", rows_in=len(X_fit), mode="incremental"):
+        model.fit(X_fit, y_fit)
+    retired = max(len(model.estimators_) - TREE_BUDGET, 0)
+    if retired:
+        model.estimators_ = model.estimators_[retired:]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+    return retired
+
+def _update_incremental(data, previous, n_jobs):
+    """
+    Trains the saved model on the unseen rows. Returns (model, holdout
+    score, update info), or None when the update has to be a full fit.
+    """
+    model, transformer, detector, seen, state = previous
+    hashes = data.hashes
+    pos = np.minimum(np.searchsorted(seen, hashes), max(len(seen) - 1, 0))
+    is_new = seen[pos] != hashes if len(seen) else np.ones(len(hashes), dtype=bool)
+    n_new = int(is_new.sum())
+    if n_new == 0:
+        print("✔️ No unseen rows: model kept as it is")
+        return model, transformer, detector, {"new_rows": 0}
+    if n_new > MAX_NEW_SHARE * len(data):
+        print(f"🆕 {n_new} of {len(data)} rows are new: full retrain")
+        return None
+
+    # New rows plus the most recent rows the model already knows
+    batch = np.concatenate([np.flatnonzero(is_new), np.flatnonzero(~is_new)[-RECENT_ROWS:]])
+    X_fit, X_hold, y_fit, y_hold = train_test_split(data.X(batch), data.y(batch), test_size=HOLDOUT_SHARE,
+                                                    random_state=42)
+    classification = state["metric"] == "accuracy"
+    if classification and not np.array_equal(np.unique(y_fit), model.classes_):
+        print("🆕 Update batch doesn't cover every class: full retrain")
+        return None
+
+    retired = _grow_forest(model, X_fit, y_fit, n_jobs)
+    score = _score(model, X_hold, y_hold, classification)
+    baseline = state["score"]
+    print(f"🔁 Incremental update: {n_new} new rows, +{TREES_PER_UPDATE} trees, {retired} retired "
+          f"({len(model.estimators_)} in forest) | holdout {state['metric']} {score:.2f} "
+          f"(last full fit {baseline:.2f})")
+    if _drifted(score, baseline, classification):
+        print(f"↩️ Holdout {state['metric']} drifted past {DRIFT_TOLERANCE}: full retrain")
+        return None
+
+    # The forest now knows every row of the file: so does the detector
+    with span("ood fit", rows_in=len(data)):
+        detector = OODDetector().fit(data.X().to_numpy(dtype=np.float32))
+    return model, transformer, detector, {"new_rows": n_new, "batch_rows": len(batch),
+                                          "retired": retired, "score": score}
+
+# ------------------ TRAIN ONE DATASET ------------------
+def train_dataset(df, dataset_name, n_jobs=None, features=None, full_fit=False):
+    """
+    Trains and saves one model from an already-loaded cleaned frame, or
+    from the cleaning stage's feature cache (`features`, see
+    feature_cache.py; `df` may then be None).
+    `dataset_name` is the cleaned file stem (e.g. 'messy_machine_data_cleaned').
+    `n_jobs` is the forest's core budget (None = FIT_JOBS).
+    An existing model is updated incrementally with the rows it hasn't seen
+    (see INCREMENTAL above); a full fit runs when there is none, when the
+    feature layout changed, when most rows are new or when the update's
+    holdout score drifts. full_fit=True always fits from scratch.
+    Returns (model, fitted feature transformer, fitted OOD detector), or
+    (None, None, None) when there are too few rows to fit a new model.
+    """
+    print(f"\n--- Training Model for: {dataset_name} ---")
+    n_jobs = FIT_JOBS if n_jobs is None else n_jobs
+    MODEL_SAVE_DIR.mkdir(exist_ok=True)
+    model_path = MODEL_SAVE_DIR / f"{dataset_name}_model.pkl"
+
+    # 1. Detect Target & Features
+    spec = load_spec(dataset_name)
+    data = TrainingData(df, features, spec.to_dict() if spec is not None else None)
+
+    updated = None
+    previous = None if full_fit else _previous_fit(model_path, data)
+    if previous is None and len(data) < MIN_TRAIN_ROWS:
+        # Cleaning leaves out rows other files already contributed (row_index.py);
+        # the file is scored with the model whose columns it has (see pipeline_context.py)
+        print(f"⏭️  Only {len(data)} cleaned rows (need {MIN_TRAIN_ROWS}); the rest were dropped or already "
+              f"ingested from other files, skipping training")
+        if model_path.exists():
+            # A full refit would have replaced it: its rows now belong to other files
+            _remove_model(model_path)
+            print(f"🗑️  Removed models/{model_path.name}")
+        return None, None, None
+    if previous is not None:
+        updated = _update_incremental(data, previous, n_jobs)
+
+    if updated is not None:
+        model, transformer, detector, update = updated
+        if update["new_rows"] == 0:
+            # The saved model, detector and compiled forest are still current
+            return model, transformer, detector
+        with open(state_path(model_path)) as f:
+            state = json.load(f)
+        state["updates"] = (state.get("updates", []) + [update])[-20:]
+    else:
+        transformer = data.transformer
+        model, score, X_train = _fit_full(data.X(), data.y(), n_jobs)
+
+        # OOD detector learned from the same training matrix the forest saw
+        with span("ood fit", rows_in=len(X_train)):
+            detector = OODDetector().fit(X_train.to_numpy(dtype=np.float32))
+        state = {"metric": "accuracy" if hasattr(model, "classes_") else "rmse",
+                 "score": score, "full_fit_rows": len(data), "updates": []}
+
+    # 4. Save the trained model file
+    with span("write"):
         joblib.dump(model, model_path)
-        print(f"Model saved to: models/{model_path.name}")
+    print(f"Model saved to: models/{model_path.name}")
+
+    # The fitted feature layout and OOD detector travel with the model for every scoring path
+    transformer.save(transformer_path(model_path))
+    detector.save(ood_path(model_path))
+
+    # Rows this model has seen, for the next incremental update
+    np.save(rows_path(model_path), np.unique(data.hashes))
+    with open(state_path(model_path), "w") as f:
+        json.dump(state, f, indent=2)
+
+    # 5. Export the array-backed copy used for fast (memory-mapped) scoring
+    forest_dir = model_path.with_suffix(COMPILED_SUFFIX)
+    with span("compile"):
+        save_compiled_forest(compile_forest(model), forest_dir, model_path)
+    print(f"Compiled forest saved to: models/{forest_dir.name}/")
+    return model, transformer, detector
+
+def train_model(datasets=None):
+    """
+    datasets: optional {cleaned stem: cleaned frame} handed over by the
+    pipeline. Without it, every '*_cleaned.csv' in data/processed is read.
+    Returns {cleaned stem: (trained model, feature transformer, OOD detector)}.
+    """
+    if datasets is None:
+        # Read lazily so only one file is in memory at a time
+        items = ((cleaned_file.stem, read_csv_typed(cleaned_file))
+                 for cleaned_file in PROCESSED_DIR.glob("*_cleaned.csv"))
+    else:
+        items = datasets.items()
+
+    models = {}
+    for dataset_name, df in items:
+        models[dataset_name] = train_dataset(df, dataset_name)
+    return models
 
 if __name__ == "__main__":
-    train_model()
\ No newline at end of file
+    train_model()
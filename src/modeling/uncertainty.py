@@ -1,6 +1,5 @@
 import pandas as pd
 import numpy as np
-import joblib
 from pathlib import Path
 import sys
 
@@ -10,78 +9,143 @@ ROOT_DIR = Path(__file__).resolve().parents[2]
 sys.path.append(str(ROOT_DIR))
 
 from src.utils import detect_target_column
+from src.schema import read_csv_typed
+from src.modeling.forest_inference import forest_predict_adaptive, N_JOBS
+from src.modeling.compiled_forest import load_forest
+from src.modeling.feature_transformer import load_feature_transformer
+from src.modeling.ood_detector import load_ood_detector
+from src.instrumentation import span
+from src.validation_rules import load_rules
+
+UNCERTAINTY_THRESHOLD = 0.15  # tree variance above this -> "High Risk"
 
 def check_ood(df_new, model_name):
     """
     Checks if the new data is 'Out-of-Distribution' (OOD).
-    Specifically flags impossible values like 9999K temperatures.
+    Specifically flags impossible values like 9999K temperatures, i.e. rows
+    breaking the dataset's validation rules (config/rules/).
+    Fallback for models trained before OOD detectors were saved with them.
     """
     print(f"--- Running OOD Check for {model_name} ---")
-    
-    # Flag temperatures that are physically impossible for this machine context
-    ood_mask = (df_new['Air_Temp_K'] > 500) | (df_new['Rotational_Speed_RPM'] < 0)
-    return ood_mask
 
-def estimate_uncertainty():
+    # Only datasets with a rule file (their own or one matching their columns) have physical limits to check
+    rules = load_rules(model_name.removesuffix("_cleaned"), df_new.columns)
+    if rules is None:
+        print(f"⚠️ No validation rules for {model_name}: no physical-bounds check, no row flagged OOD")
+        return np.zeros(len(df_new), dtype=bool)
+    keep, _ = rules.evaluate(df_new)
+    return ~keep
+
+def build_features(df, model, transformer=None):
+    """
+    Model matrix for a cleaned frame, in the training column order.
+    """
+    if transformer is not None:
+        return transformer.transform(df)
+
+    # Older models without a saved transformer: dummies aligned to the training columns
+    target = detect_target_column(df)
+    X = pd.get_dummies(df.drop(columns=[target]), drop_first=True)
+    return X.reindex(columns=model.feature_names_in_, fill_value=0)
+
+def estimate_dataset_uncertainty(df, model, dataset_name, transformer=None, n_jobs=N_JOBS, detector=None,
+                                 features=None):
+    """
+    Scores one cleaned frame with its model and saves
+    '<dataset_name>_failure_predictions.csv'. Returns the result frame.
+    `n_jobs` caps the threads walking the forest; `detector` is the model's
+    fitted OOD detector (None = rule-based check). `features` is the
+    frame's memory-mapped feature cache (used when laid out like the model's).
+    """
+    print(f"--- Estimating Uncertainty for: {dataset_name} ---")
+
+    # 1. Prepare Features (fitted transformer -> float32 matrix in training order)
+    if features is not None and features.matches(transformer) and len(features) == len(df):
+        X = features.X
+    else:
+        with span("encode", rows_in=len(df)):
+            X = build_features(df, model, transformer)
+
+    # 2. Run OOD Check (Out-of-Distribution) on the same matrix
+    with span("ood", rows_in=len(df)):
+        if detector is not None:
+            is_ood_row = detector.predict(X)
+        else:
+            is_ood_row = check_ood(df, dataset_name)
+
+    # 3. Calculate Ensemble Variance
+    # Variance measures how much the trees 'disagree' (one pass over the forest;
+    # with EARLY_EXIT on, rows stop once they are clearly on one side of the
+    # threshold and their score is a partial-forest estimate)
+    with span("tree eval", rows_in=len(df)) as current:
+        _, _, uncertainty_score, trees_evaluated = forest_predict_adaptive(
+            model, X, variance_thresholds=(UNCERTAINTY_THRESHOLD,), n_jobs=n_jobs)
+        current.attrs["trees_per_row"] = round(float(trees_evaluated.mean()), 1) if len(df) else 0
+
+    # 4. Flag High Risk & OOD
+    # assign() leaves the caller's frame (shared with other stages) untouched
+    results = df.assign(uncertainty_score=uncertainty_score, trees_evaluated=trees_evaluated)
+    results['failure_risk'] = np.where(results['uncertainty_score'] > UNCERTAINTY_THRESHOLD, "High Risk", "Low Risk")
+
+    # If the row was marked as OOD, override the risk label
+    results.loc[is_ood_row, 'failure_risk'] = "OOD - PHYSICAL ANOMALY"
+
+    # 5. Save Results to Output
+    output_path = ROOT_DIR / "output" / f"{dataset_name}_failure_predictions.csv"
+    with span("write", rows_in=len(results)):
+        results.to_csv(output_path, index=False)
+    print(f"✅ Analysis saved to: {output_path.name}")
+    return results
+
+def estimate_uncertainty(datasets=None, models=None, transformers=None, detectors=None):
+    """
+    datasets/models/transformers/detectors: optional {cleaned stem: frame},
+    {cleaned stem: model}, {cleaned stem: feature transformer} and
+    {cleaned stem: OOD detector} handed over by the pipeline. Without them, models are loaded from models/
+    and the matching cleaned CSVs from data/processed.
+    Returns {cleaned stem: result frame}.
+    """
     MODEL_DIR = ROOT_DIR / "models"
     PROCESSED_DIR = ROOT_DIR / "data" / "processed"
-    
+
+    if datasets is not None and models is not None:
+        transformers = transformers or {}
+        detectors = detectors or {}
+        return {
+            dataset_name: estimate_dataset_uncertainty(
+                df, models[dataset_name], dataset_name, transformers.get(dataset_name),
+                detector=detectors.get(dataset_name))
+            for dataset_name, df in datasets.items()
+            if dataset_name in models
+        }
+
     # Check if directories exist
     if not MODEL_DIR.exists():
         print("❌ Model directory not found!")
-        return
+        return {}
 
+    results = {}
     for model_file in MODEL_DIR.glob("*.pkl"):
         # Get base name (e.g., 'messy_machine_data_cleaned')
         dataset_name = model_file.stem.replace("_model", "")
-        
+
         # Look for the matching CSV file
         csv_path = PROCESSED_DIR / f"{dataset_name}.csv"
-        
+
         if not csv_path.exists():
             print(f"⚠️ Skipping: {csv_path.name} not found in processed folder.")
             continue
 
-        print(f"--- Estimating Uncertainty for: {csv_path.name} ---")
-        df = pd.read_csv(csv_path)
-        
+        df = read_csv_typed(csv_path)
+
         # Load the model
-        model = joblib.load(model_file)
-        
-        # 1. Run OOD Check (Out-of-Distribution)
-        is_ood_row = check_ood(df, dataset_name)
-        
-        # 2. Prepare Features
-        target = detect_target_column(df)
-        X = df.drop(columns=[target])
-        
-        # Ensure only numeric columns and match expected feature names
-        X = pd.get_dummies(X, drop_first=True)
-        expected_features = model.feature_names_in_
-        
-        for col in expected_features:
-            if col not in X.columns:
-                X[col] = 0
-        X = X[expected_features]
-        
-        # 3. Calculate Ensemble Variance
-        # Get predictions from every individual tree in the forest
-        tree_preds = np.array([tree.predict(X) for tree in model.estimators_])
-        
-        # Variance measures how much the trees 'disagree'
-        uncertainty_score = np.var(tree_preds, axis=0)
-
-        # 4. Flag High Risk & OOD
-        df['uncertainty_score'] = uncertainty_score
-        df['failure_risk'] = np.where(df['uncertainty_score'] > 0.15, "High Risk", "Low Risk")
-        
-        # If the row was marked as OOD, override the risk label
-        df.loc[is_ood_row, 'failure_risk'] = "OOD - PHYSICAL ANOMALY"
-
-        # 5. Save Results to Output
-        output_path = ROOT_DIR / "output" / f"{dataset_name}_failure_predictions.csv"
-        df.to_csv(output_path, index=False)
-        print(f"✅ Analysis saved to: {output_path.name}")
+        model = load_forest(model_file)
+        transformer = load_feature_transformer(model_file)
+        detector = load_ood_detector(model_file)
+
+        results[dataset_name] = estimate_dataset_uncertainty(df, model, dataset_name, transformer,
+                                                             detector=detector)
+    return results
 
 if __name__ == "__main__":
-    estimate_uncertainty()
\ No newline at end of file
+    estimate_uncertainty()
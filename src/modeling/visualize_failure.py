@@ -1,4 +1,6 @@
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # headless: plots are only saved, often from a pool worker
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
@@ -7,31 +9,42 @@ from pathlib import Path
 ROOT_DIR = Path(__file__).resolve().parents[2]
 OUTPUT_DIR = ROOT_DIR / "output"
 
-def plot_failure_distribution():
+def plot_failure_distribution(results=None):
+    """
+    results: optional {cleaned stem: uncertainty frame} handed over by the
+    pipeline. Without it, every '*_failure_predictions.csv' in output/ is read.
+    """
     print("\n--- Generating Failure Risk Visualizations ---")
-    
-    # Automatically find any file ending with '_failure_predictions.csv'
-    prediction_files = list(OUTPUT_DIR.glob("*_failure_predictions.csv"))
-    
-    if not prediction_files:
-        print("⚠️ No failure prediction CSVs found. Did you run uncertainty.py first?")
-        return
-
-    for prediction_file in prediction_files:
-        # Load the data
-        df = pd.read_csv(prediction_file)
-        
-        # Clean up name for the title (e.g., 'sales_cleaned_failure_predictions' -> 'SALES')
-        dataset_label = prediction_file.stem.replace("_failure_predictions", "").replace("_cleaned", "").upper()
-        
+
+    if results is not None:
+        items = results.items()
+    else:
+        # Automatically find any file ending with '_failure_predictions.csv'
+        prediction_files = list(OUTPUT_DIR.glob("*_failure_predictions.csv"))
+
+        if not prediction_files:
+            print("⚠️ No failure prediction CSVs found. Did you run uncertainty.py first?")
+            return
+
+        items = ((f.stem.replace("_failure_predictions", ""), pd.read_csv(f)) for f in prediction_files)
+
+    for dataset_name, df in items:
+        # Clean up name for the title (e.g., 'sales_cleaned' -> 'SALES')
+        dataset_label = dataset_name.replace("_cleaned", "").upper()
+        if df.empty:
+            # e.g. an export whose rows were all ingested from earlier files
+            print(f"⚠️ No rows to plot for: {dataset_label}")
+            continue
+
         print(f"Creating plot for: {dataset_label}")
 
         plt.figure(figsize=(10, 6))
         
         # Plot the distribution of uncertainty
-        # Green = Low Risk, Red = High Risk
+        # Green = Low Risk, Red = High Risk, Purple = Out-of-Distribution
         sns.histplot(data=df, x='uncertainty_score', hue='failure_risk', 
-                     element="step", palette={'High Risk': 'red', 'Low Risk': 'green'},
+                     element="step",
+                     palette={'High Risk': 'red', 'Low Risk': 'green', 'OOD - PHYSICAL ANOMALY': 'purple'},
                      alpha=0.6)
         
         plt.title(f"AI Failure Risk Distribution: {dataset_label}")
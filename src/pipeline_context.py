@@ -0,0 +1,221 @@
+# Purpose:
+# Hold every dataset's parsed, typed frame for one pipeline run.
+
+# Each raw CSV is parsed once. The frame is then handed from stage to stage
+# (check -> clean -> analysis -> training -> uncertainty) instead of every
+# stage re-reading CSV text from disk. Files on disk are still written by the
+# stages for auditing, they are just no longer read back inside the run.
+
+from pathlib import Path
+import sys
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.schema import read_csv_typed
+from src.validation_rules import find_rules_path, rules_path
+from src.feature_cache import features_dir_for, open_feature_cache
+from src.row_index import clean_inputs, upload_order
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+PROCESSED_DIR = ROOT_DIR / "data" / "processed"
+MODEL_DIR = ROOT_DIR / "models"
+OUTPUT_DIR = ROOT_DIR / "output"
+
+
+def model_artifacts(model_path):
+    """
+    Everything training writes: pickle, feature layout, OOD detector,
+    compiled forest, seen-row hashes and training state (the last two
+    drive incremental updates).
+    """
+    return [model_path,
+            model_path.with_suffix(".features.json"),
+            model_path.with_suffix(".ood.json"),
+            model_path.with_suffix(".forest"),
+            model_path.with_suffix(".rows.npy"),
+            model_path.with_suffix(".train.json")]
+
+
+class DatasetState:
+    """
+    Everything the pipeline knows about one dataset during a run.
+    """
+    def __init__(self, raw_path):
+        self.raw_path = Path(raw_path)
+        self.name = self.raw_path.stem            # e.g. 'messy_machine_data'
+        self.raw_df = None                        # parsed raw frame (freed after cleaning)
+        self.clean_df = None                      # cleaned, typed frame
+        self.cleaning_stats = None                # before/after counts from cleaning
+        self.model = None                         # trained estimator
+        self.transformer = None                   # fitted feature layout for the model
+        self.detector = None                      # OOD detector fitted with the model
+        self.failure_df = None                    # uncertainty results
+        self.error = None                         # "<stage>: <error>" once a stage failed
+        self.rebuild = False                      # --force: no incremental shortcuts (full model fit)
+
+    @property
+    def cleaned_name(self):
+        return f"{self.name}_cleaned"
+
+    # ---------------- ARTIFACT PATHS ----------------
+    @property
+    def cleaned_path(self):
+        return PROCESSED_DIR / f"{self.cleaned_name}.csv"
+
+    @property
+    def features_dir(self):
+        return features_dir_for(self.cleaned_path)
+
+    @property
+    def profile_path(self):
+        return OUTPUT_DIR / f"{self.name}_profile.json"
+
+    @property
+    def report_path(self):
+        return OUTPUT_DIR / f"{self.name}_report.txt"
+
+    @property
+    def rules_path(self):
+        """
+        The rule file cleaning validates with (own or column-matched), else
+        where its own would go.
+        """
+        columns = pd.read_csv(self.raw_path, nrows=0).columns
+        return find_rules_path(self.name, columns) or rules_path(self.name)
+
+    @property
+    def index_inputs(self):
+        """
+        Row-index entries of the earlier uploads this file's cleaning skips
+        rows against.
+        """
+        return clean_inputs(self.raw_path)
+
+    @property
+    def analysis_dir(self):
+        return OUTPUT_DIR / "analysis" / self.cleaned_name
+
+    @property
+    def model_path(self):
+        return MODEL_DIR / f"{self.cleaned_name}_model.pkl"
+
+    @property
+    def model_artifacts(self):
+        return model_artifacts(self.model_path)
+
+    @property
+    def model_file(self):
+        """
+        The model this dataset is scored with: its own, or - when training
+        was skipped because too few rows were left (an export other files
+        already contributed) - the classifier whose input columns it has.
+        None when there is neither.
+        """
+        from src.predict import find_model_file
+        return find_model_file(self.raw_path)
+
+    @property
+    def scoring_artifacts(self):
+        model_file = self.model_file
+        return model_artifacts(model_file) if model_file is not None else []
+
+    @property
+    def failure_path(self):
+        return OUTPUT_DIR / f"{self.cleaned_name}_failure_predictions.csv"
+
+    @property
+    def plot_path(self):
+        # visualize_failure names plots after the lower-cased dataset label
+        return OUTPUT_DIR / f"{self.name.lower()}_uncertainty_plot.png"
+
+    @property
+    def prediction_path(self):
+        return OUTPUT_DIR / f"FINAL_PREDICTIONS_{self.name}.csv"
+
+    @property
+    def prediction_columns_path(self):
+        return self.prediction_path.with_suffix(".columns")
+
+    # ---------------- FRAMES & MODELS ----------------
+    def load_raw(self):
+        if self.raw_df is None:
+            self.raw_df = read_csv_typed(self.raw_path)
+        return self.raw_df
+
+    def release_raw(self):
+        self.raw_df = None
+
+    def load_cleaned(self):
+        if self.clean_df is None:
+            self.clean_df = read_csv_typed(self.cleaned_path)
+        return self.clean_df
+
+    def load_features(self):
+        """
+        The cleaned data's memory-mapped feature cache, or None when it is
+        missing or stale. Opened fresh on every call (never kept on the
+        state, so pickling a DatasetState never copies the arrays).
+        """
+        return open_feature_cache(self.cleaned_path)
+
+    def load_failure(self):
+        if self.failure_df is None:
+            self.failure_df = pd.read_csv(self.failure_path)
+        return self.failure_df
+
+    def load_model(self):
+        """
+        Model + transformer + OOD detector from disk (used when the training
+        stage was skipped or fitted nothing), see model_file. None when there
+        is no model to load.
+        """
+        if self.model is None and (model_file := self.model_file) is not None:
+            from src.modeling.compiled_forest import load_forest
+            from src.modeling.feature_transformer import load_feature_transformer
+            from src.modeling.ood_detector import load_ood_detector
+            self.model = load_forest(model_file)
+            self.transformer = load_feature_transformer(model_file)
+            self.detector = load_ood_detector(model_file)
+        return self.model
+
+
+class PipelineContext:
+    """
+    One DatasetState per raw CSV, keyed by file stem, oldest upload first
+    (rows shared by overlapping exports belong to the file ingested first,
+    see row_index.py).
+    """
+    def __init__(self, raw_dir=None):
+        self.raw_dir = Path(raw_dir) if raw_dir else ROOT_DIR / "data" / "raw"
+        raw_files = upload_order(self.raw_dir.glob("*.csv"))
+        self.datasets = {raw_file.stem: DatasetState(raw_file) for raw_file in raw_files}
+
+    def __iter__(self):
+        """
+        Datasets still in the run (a failed dataset drops out of later stages).
+        """
+        return (ds for ds in self.datasets.values() if ds.error is None)
+
+    def __len__(self):
+        return len(self.datasets)
+
+    def failures(self):
+        return [ds for ds in self.datasets.values() if ds.error is not None]
+
+    def by_cleaned_name(self, cleaned_name):
+        return self.datasets[cleaned_name.removesuffix("_cleaned")]
+
+    def cleaned_frames(self):
+        """
+        {'<stem>_cleaned': cleaned frame}, the input shape train_model() takes.
+        """
+        return {ds.cleaned_name: ds.clean_df for ds in self if ds.clean_df is not None}
+
+    def models(self):
+        return {ds.cleaned_name: ds.model for ds in self if ds.model is not None}
+
+    def transformers(self):
+        return {ds.cleaned_name: ds.transformer for ds in self if ds.transformer is not None}
+
+    def detectors(self):
+        return {ds.cleaned_name: ds.detector for ds in self if ds.detector is not None}
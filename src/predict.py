@@ -1,7 +1,10 @@
 import pandas as pd
-import joblib
 from pathlib import Path
+import json
+import queue
+from contextlib import nullcontext
 import sys
+import threading
 import numpy as np
 
 # ---------------- PATH SETUP ----------------
@@ -9,77 +12,385 @@ ROOT_DIR = Path(__file__).resolve().parents[1]
 sys.path.append(str(ROOT_DIR))
 
 from src.utils import fix_data_types, detect_target_column
+from src.schema import read_csv_typed, get_schema, apply_schema
+from src.modeling.forest_inference import forest_predict_adaptive
+from src.modeling.compiled_forest import load_forest, model_digest
+from src.modeling.feature_transformer import load_feature_transformer
+from src.modeling.ood_detector import load_ood_detector
+from src.prediction_store import ColumnarWriter, columns_dir_for, save_columnar, write_latest_run
+from src.instrumentation import span, timed_chunks
+from src.row_index import RowIndex, SourceFilter
+from src.timeseries_features import SeriesFeaturizer, SeriesSpec
+
+# ---------------- SETTINGS ----------------
+STREAMING_MODE = False  # True = read/score/write in chunks (flat memory on any file size)
+CHUNK_SIZE = 50_000     # rows per chunk in streaming mode
+QUEUE_DEPTH = 2         # chunks buffered between the read, score and write stages
+SKIP_SCORED = True      # skip rows this model already scored in other files (see row_index.py)
+
+# ---------------- RISK THRESHOLDS ----------------
+HIGH_RISK = 80            # Risk_Percentage >= this -> High Risk
+MEDIUM_RISK = 40          # Risk_Percentage >= this -> Medium Risk
+CONFIDENT_LOW_RISK = 20   # Risk_Percentage <= this counts as a confident "healthy"
+TRUST_UNCERTAINTY = 0.1   # Uncertainty_Score below this can be High Trust
+
+# Every cut-off the forest's output is compared against (incl. the 50% class
+# decision). Early exit (forest_inference.EARLY_EXIT, off by default) stops a
+# row once none of these can flip; its numbers are then estimates.
+PROBA_THRESHOLDS = (CONFIDENT_LOW_RISK / 100, MEDIUM_RISK / 100, 0.5, HIGH_RISK / 100)
+VARIANCE_THRESHOLDS = (TRUST_UNCERTAINTY,)
 
 # ---------------- RISK LABEL LOGIC ----------------
+# Fixed label vocabularies: result columns are categoricals over these, so
+# every chunk / run encodes them the same way in the columnar output
+RISK_LEVELS = ["🟢 Low Risk", "🟡 Medium Risk", "🔴 High Risk"]
+TRUST_LEVELS = ["✅ High Trust", "⚠️ Low Trust (Manual Review)", "⚠️ Low Trust (Out of Distribution)"]
+
 def get_risk_level(risk):
-    if risk >= 80:
+    if risk >= HIGH_RISK:
         return "🔴 High Risk"
-    elif risk >= 40:
+    elif risk >= MEDIUM_RISK:
         return "🟡 Medium Risk"
     else:
         return "🟢 Low Risk"
 
-# ---------------- MAIN PREDICTION FUNCTION ----------------
-def run_predictions(new_data_path):
-    # 1. Load trained model
-    model_files = list((ROOT_DIR / "models").glob("*.pkl"))
-    if not model_files:
-        print("❌ No trained model found! Run training first.")
-        return
+# ---------------- MODEL LOADING ----------------
+MODEL_DIR = ROOT_DIR / "models"
+
+def _input_columns(transformer):
+    """
+    Raw columns a model reads (a time series' derived features are rebuilt
+    from its own columns and date).
+    """
+    if transformer.timeseries:
+        spec = transformer.timeseries
+        return set(spec["columns"]) | {spec["date_column"]} | set(transformer.categories)
+    return set(transformer.numeric_columns) | set(transformer.categories)
+
+def _is_classifier_file(model_file):
+    """
+    From the training state next to the model (no unpickling); models
+    without one are given the benefit of the doubt.
+    """
+    state_file = Path(model_file).with_suffix(".train.json")
+    if not state_file.exists():
+        return True
+    with open(state_file) as f:
+        return json.load(f).get("metric") == "accuracy"
 
-    model = joblib.load(model_files[0])
-    expected_features = model.feature_names_in_
+def match_model_file(columns):
+    """
+    First classifier in models/ whose input columns are all in `columns`,
+    or None.
+    """
+    columns = set(columns)
+    for model_file in sorted(MODEL_DIR.glob("*.pkl")):
+        transformer = load_feature_transformer(model_file)
+        if transformer is not None and _input_columns(transformer) <= columns and _is_classifier_file(model_file):
+            return model_file
+    return None
 
-    # 2. Load & clean data
-    df = pd.read_csv(new_data_path)
-    print(f"\n📂 Processing file: {new_data_path.name}")
+def find_model_file(data_path=None):
+    """
+    The model to score `data_path` with: the one trained on that dataset
+    ('<stem>_cleaned_model.pkl'), else the first classifier whose input
+    columns the file has. Without a path, the first model in models/.
+    """
+    if data_path is None:
+        model_files = sorted(MODEL_DIR.glob("*.pkl"))
+        return model_files[0] if model_files else None
+    own = MODEL_DIR / f"{Path(data_path).stem}_cleaned_model.pkl"
+    if own.exists():
+        return own
+    return match_model_file(str(col) for col in pd.read_csv(data_path, nrows=0).columns)
 
-    df = fix_data_types(df)
-    df = df.dropna()
+def is_regressor(model):
+    return not hasattr(model, "classes_")
 
-    # 3. Feature engineering
-    X = pd.get_dummies(df)
+def load_predictor(model_file=None):
+    """
+    Returns (model, feature transformer, OOD detector) or (None, None, None).
+    The model is the compiled forest when available; transformer and detector
+    are None for models saved before they existed.
+    """
+    model_file = model_file or find_model_file()
+    if model_file is None:
+        return None, None, None
+    return load_forest(model_file), load_feature_transformer(model_file), load_ood_detector(model_file)
 
-    target = detect_target_column(df)
-    if target in X.columns:
-        X = X.drop(columns=[target])
+def scored_rows_index(model_file):
+    """
+    The row index of what this model scored so far. Keyed to the pickle's
+    content, so only a changed model starts it over (a training run that
+    leaves the model as it was keeps it).
+    """
+    model_file = Path(model_file)
+    return RowIndex(f"predict/{model_file.stem}", version=model_digest(model_file))
 
-    # Align features
-    for col in expected_features:
-        if col not in X.columns:
-            X[col] = 0
-    X = X[expected_features]
+def scored_rows_filter(model_file, new_data_path):
+    """
+    SourceFilter for scoring one file, or None when SKIP_SCORED is off.
+    """
+    if not SKIP_SCORED or model_file is None:
+        return None
+    return SourceFilter(scored_rows_index(model_file), Path(new_data_path).stem)
 
-    # 4. Predictions
-    probabilities = model.predict_proba(X)[:, 1]
-    predictions = model.predict(X)
+def series_featurizer(transformer):
+    """
+    SeriesFeaturizer for a time-series model (None otherwise): rebuilds the
+    lag / rolling / return features the model was trained on, continuing
+    from the end of its training series.
+    """
+    if transformer is None or not transformer.timeseries:
+        return None
+    return SeriesFeaturizer.for_scoring(SeriesSpec.from_dict(transformer.timeseries))
 
-    # 5. Uncertainty estimation (Random Forest ensemble variance)
-    tree_preds = np.array([tree.predict(X) for tree in model.estimators_])
-    uncertainty = np.var(tree_preds, axis=0)
+# ---------------- SCORING STEPS ----------------
+def prepare_features(df, model, transformer=None, row_filter=None, series=None):
+    """
+    Cleans a raw frame and builds the model matrix; a row_index.SourceFilter
+    leaves out rows already scored from other files. Time-series models get
+    their window features first (`series` carries the windows from chunk to
+    chunk; by default the frame is one whole series).
+    Returns (cleaned frame, X in training column order).
+    """
+    with span("type fix", rows_in=len(df)):
+        df = fix_data_types(df)
+    with span("dropna", rows_in=len(df)) as current:
+        df = df.dropna()
+        current.rows_out = len(df)
+    series = series or series_featurizer(transformer)
+    if series is not None:
+        with span("series features", rows_in=len(df)):
+            df = series.add(df)
+    if row_filter is not None:
+        with span("skip scored", rows_in=len(df)) as current:
+            df = row_filter.apply(df)
+            current.rows_out = len(df)
 
-    # 6. Compile results
-    results = df.copy()
+    with span("encode", rows_in=len(df)):
+        # Feature engineering: fitted transformer straight into a float32 matrix
+        if transformer is not None:
+            return df, transformer.transform(df)
+
+        # Older models without a saved transformer: dummies aligned to the training columns
+        target = detect_target_column(df)
+        X = pd.get_dummies(df.drop(columns=[target]), drop_first=True)
+        X = X.reindex(columns=model.feature_names_in_, fill_value=0)
+        return df, X
+
+def run_forest(model, X):
+    """
+    (probability, prediction, variance, trees evaluated); exact full-forest
+    values unless early exit on the risk / trust cut-offs above is on.
+    """
+    return forest_predict_adaptive(model, X, PROBA_THRESHOLDS, VARIANCE_THRESHOLDS)
+
+def compile_results(df, proba, predictions, uncertainty, is_ood=None, trees_evaluated=None):
+    # Shallow copy: the new columns don't touch df, the input columns aren't duplicated
+    results = df.copy(deep=False)
     results["Prediction"] = predictions
-    results["Risk_Percentage"] = (probabilities * 100).round(2)
-    results["Risk_Level"] = results["Risk_Percentage"].apply(get_risk_level)
+    results["Risk_Percentage"] = (proba[:, 1] * 100).round(2)
+    risk = results["Risk_Percentage"].to_numpy()
+    # Same cut-offs as get_risk_level(), as codes into RISK_LEVELS
+    risk_codes = (risk >= MEDIUM_RISK).astype(np.int8) + (risk >= HIGH_RISK)
+    results["Risk_Level"] = pd.Categorical.from_codes(risk_codes, categories=RISK_LEVELS)
     results["Uncertainty_Score"] = uncertainty.round(4)
 
-    results["Trust_Level"] = np.where(
-        (results["Uncertainty_Score"] < 0.1) &
-        ((results["Risk_Percentage"] >= 80) | (results["Risk_Percentage"] <= 20)),
-        "✅ High Trust",
-        "⚠️ Low Trust (Manual Review)"
-    )
+    high_trust = ((results["Uncertainty_Score"].to_numpy() < TRUST_UNCERTAINTY) &
+                  ((risk >= HIGH_RISK) | (risk <= CONFIDENT_LOW_RISK)))
+    trust_codes = np.where(high_trust, 0, 1).astype(np.int8)
+
+    # Inputs unlike anything the model was trained on are never trusted
+    if is_ood is not None:
+        trust_codes[np.asarray(is_ood, dtype=bool)] = 2
+    results["Trust_Level"] = pd.Categorical.from_codes(trust_codes, categories=TRUST_LEVELS)
+    if is_ood is not None:
+        results["OOD_Flag"] = is_ood
+
+    # Diagnostic: trees behind each row's numbers (fewer = early-exit estimate)
+    if trees_evaluated is not None:
+        results["Trees_Evaluated"] = trees_evaluated
+    return results
+
+def score_frame(df, model, transformer=None, detector=None, row_filter=None, series=None):
+    """
+    Raw frame in, results frame (input columns + prediction columns) out.
+    """
+    df, X = prepare_features(df, model, transformer, row_filter, series)
+
+    # Predictions and uncertainty (ensemble variance) in one forest pass
+    with span("tree eval", rows_in=len(df)):
+        proba, predictions, uncertainty, trees_evaluated = run_forest(model, X)
+    with span("ood", rows_in=len(df)):
+        is_ood = detector.predict(X) if detector is not None else None
+    with span("compile results", rows_in=len(df)):
+        return compile_results(df, proba, predictions, uncertainty, is_ood, trees_evaluated)
+
+def prediction_output_path(new_data_path):
+    output_path = ROOT_DIR / "output" / f"FINAL_PREDICTIONS_{Path(new_data_path).stem}.csv"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    return output_path
+
+def save_results(results, new_data_path):
+    """
+    Writes the CSV plus its columnar copy and summary sidecar (which the
+    dashboards read), then marks this run as the latest one.
+    """
+    output_path = prediction_output_path(new_data_path)
+    with span("write", rows_in=len(results)):
+        results.to_csv(output_path, index=False)
+        save_columnar(results, output_path, source=Path(new_data_path).name)
+    return output_path
 
-    # 7. Save output
-    output_path = ROOT_DIR / "output" / f"FINAL_PREDICTIONS_{new_data_path.stem}.csv"
-    results.to_csv(output_path, index=False)
+# ---------------- STREAMING PREDICTION ----------------
+_DONE = object()   # end-of-stream marker passed through the queues
+_ABORT = object()  # scoring failed: stop writing, don't publish the run
+
+def _read_chunks(new_data_path, chunk_size, to_score, stop):
+    """
+    Reader stage: parses chunks (narrowed to the file's schema) ahead of
+    the scorer. Errors are handed downstream instead of dying silently.
+    """
+    try:
+        schema = get_schema(new_data_path)
+        for chunk in timed_chunks(pd.read_csv(new_data_path, chunksize=chunk_size)):
+            if stop.is_set():
+                return
+            to_score.put(apply_schema(chunk, schema))
+        to_score.put(_DONE)
+    except Exception as e:
+        to_score.put(e)
+
+def _write_chunks(output_path, to_write, errors, source=None):
+    """
+    Writer stage: appends each scored chunk to the output CSV (and its
+    columnar copy) as it arrives, so the first rows are on disk long before
+    the file is finished. The summary sidecar is written at the end.
+    """
+    try:
+        columns = ColumnarWriter(columns_dir_for(output_path))
+        with open(output_path, "w", newline="", encoding="utf-8") as f:
+            header = True
+            while (results := to_write.get()) is not _DONE and results is not _ABORT:
+                with span("write", rows_in=len(results)):
+                    results.to_csv(f, index=False, header=header)
+                    f.flush()
+                    columns.write(results)
+                header = False
+        summary = columns.close(source)
+        if results is _DONE:
+            write_latest_run(output_path, summary)
+        return
+    except Exception as e:
+        errors.append(e)
+    # Keep draining so the scorer never blocks on a dead writer
+    while (results := to_write.get()) is not _DONE and results is not _ABORT:
+        pass
+
+def run_predictions_streaming(new_data_path, model, transformer=None, detector=None,
+                              chunk_size=CHUNK_SIZE, on_chunk=None, row_filter=None):
+    """
+    Read -> score -> write as three overlapping stages joined by bounded
+    queues: the forest scores chunk i while chunk i+1 is parsed and chunk
+    i-1 is written. At most a few chunks are alive at once, whatever the
+    file size. `on_chunk(results)` sees every scored chunk as soon as it is
+    ready. Returns (rows written, output path).
+    """
+    output_path = prediction_output_path(new_data_path)
+    to_score, to_write = queue.Queue(QUEUE_DEPTH), queue.Queue(QUEUE_DEPTH)
+    stop, errors = threading.Event(), []
+    threading.Thread(target=_read_chunks, args=(new_data_path, chunk_size, to_score, stop), daemon=True).start()
+    writer = threading.Thread(target=_write_chunks, args=(output_path, to_write, errors, Path(new_data_path).name),
+                              daemon=True)
+    writer.start()
+
+    rows, finished = 0, False
+    series = series_featurizer(transformer)  # windows continue across chunks (file in date order)
+    try:
+        while (chunk := to_score.get()) is not _DONE:
+            if isinstance(chunk, Exception):
+                raise chunk
+            results = score_frame(chunk, model, transformer, detector, row_filter, series)
+            to_write.put(results)
+            rows += len(results)
+            if on_chunk is not None:
+                on_chunk(results)
+        finished = True
+    finally:
+        # Unblock the reader if scoring failed, then let the writer finish
+        stop.set()
+        while not to_score.empty():
+            to_score.get_nowait()
+        to_write.put(_DONE if finished else _ABORT)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+    return rows, output_path
+
+# ---------------- MAIN PREDICTION FUNCTION ----------------
+def run_predictions(new_data_path, model=None, transformer=None, detector=None, streaming=None,
+                    model_file=None):
+    """
+    Scores a CSV into output/FINAL_PREDICTIONS_<stem>.csv and returns the
+    results frame. In streaming mode (STREAMING_MODE or streaming=True) the
+    file is processed chunk by chunk and nothing is returned.
+    Rows the model (model_file, or the one loaded here) already scored in
+    other files are skipped (SKIP_SCORED).
+    """
+    # 1. Load trained model (unless a caller keeps one resident)
+    if model is None:
+        model_file = model_file or find_model_file(new_data_path)
+        model, transformer, detector = load_predictor(model_file)
+    if model is None:
+        print("❌ No trained model found! Run training first.")
+        return
+    if is_regressor(model):
+        # e.g. ADANIPORTS: a continuous target, so there is no failure probability to score
+        print(f"⚠️ {Path(new_data_path).name}: the model is a regressor; failure-risk scoring needs a classifier, skipping")
+        return
+
+    row_filter = scored_rows_filter(model_file, new_data_path)
+    with row_filter or nullcontext():
+        return _score_file(new_data_path, model, transformer, detector, streaming, row_filter)
+
+def _score_file(new_data_path, model, transformer, detector, streaming, row_filter):
+    if STREAMING_MODE if streaming is None else streaming:
+        print(f"\n📂 Streaming file: {Path(new_data_path).name}")
+        rows, output_path = run_predictions_streaming(new_data_path, model, transformer, detector,
+                                                      row_filter=row_filter)
+        if row_filter is not None:
+            row_filter.commit()
+            print(f"🆕 {row_filter.summary('scored')}")
+        print(f"✅ Prediction completed successfully! ({rows} rows)")
+        print(f"📁 Output saved at: {output_path.name}")
+        return
+
+    # 2. Load data
+    df = read_csv_typed(new_data_path)
+    print(f"\n📂 Processing file: {Path(new_data_path).name}")
+
+    # 3-6. Clean, build features, score, compile results
+    results = score_frame(df, model, transformer, detector, row_filter)
+
+    # 7. Save output (then remember these rows as scored)
+    output_path = save_results(results, new_data_path)
+    if row_filter is not None:
+        row_filter.commit()
+        print(f"🆕 {row_filter.summary('scored')}")
 
     print("✅ Prediction completed successfully!")
     print(f"📁 Output saved at: {output_path.name}")
+    return results
 
 # ---------------- ENTRY POINT ----------------
 if __name__ == "__main__":
+    import argparse
+
     RAW_DATA_PATH = ROOT_DIR / "data" / "raw" / "messy_machine_data.csv"
-    run_predictions(RAW_DATA_PATH)
+    parser = argparse.ArgumentParser(description="Score a CSV with the trained model")
+    parser.add_argument("path", nargs="?", default=RAW_DATA_PATH)
+    parser.add_argument("--stream", action="store_true", help="chunked read/score/write (flat memory)")
+    args = parser.parse_args()
+    run_predictions(args.path, streaming=args.stream or None)
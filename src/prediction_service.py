@@ -0,0 +1,271 @@
+# Purpose:
+# Long-lived local scoring service.
+
+# Keeps the model and its feature layout loaded in one warm process and
+# answers scoring requests over local HTTP, so clients (the Streamlit UI,
+# scripts) don't pay interpreter start-up + imports + model load per request.
+# Concurrent requests are coalesced into micro-batches for a single forest pass.
+
+# Endpoints:
+# GET  /health        -> {"status": "ok", "model": "<file>" or "per dataset"}
+# POST /predict       {"rows": [{col: value, ...}, ...]} -> {"results": [...]}
+# POST /predict_file  {"path": "<csv path>"} -> writes FINAL_PREDICTIONS_<stem>.csv
+#                     (rows already scored from other files are skipped, see row_index.py)
+#
+# Unless started with --model, each file is scored with the model trained on
+# that dataset (predict.find_model_file). Regressors are refused, and request
+# errors come back as {"error": "..."} with status 400 (bad request) or 500.
+
+import json
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# ---------------- PATH SETUP ----------------
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT_DIR))
+
+from src.predict import (find_model_file, match_model_file, is_regressor, load_predictor, prepare_features, run_forest,
+                         compile_results, save_results, scored_rows_filter)
+from src.schema import read_csv_typed
+
+# ---------------- SETTINGS ----------------
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_BATCH_ROWS = 50_000  # stop coalescing once a batch is this big
+MAX_WAIT_MS = 5          # how long the first request waits for company
+
+# ---------------- MICRO-BATCHING ----------------
+class MicroBatcher:
+    """
+    Collects feature matrices from concurrent requests and scores them in one
+    forest pass. Each submit() returns a Future with that request's slice of
+    (probability, prediction, variance, trees evaluated).
+    """
+    def __init__(self, max_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS):
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, model, X):
+        future = Future()
+        self.queue.put((model, np.ascontiguousarray(X, dtype=np.float32), future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        rows = len(batch[0][1])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            rows += len(item[1])
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            # A model reload can land mid-batch: score each model's requests together
+            by_model = {}
+            for item in batch:
+                by_model.setdefault(id(item[0]), []).append(item)
+            for items in by_model.values():
+                self._score(items)
+
+    def _score(self, items):
+        model = items[0][0]
+        try:
+            outputs = run_forest(model, np.vstack([X for _, X, _ in items]))
+        except Exception as e:
+            for _, _, future in items:
+                future.set_exception(e)
+            return
+
+        start = 0
+        for _, X, future in items:
+            end = start + len(X)
+            future.set_result(tuple(output[start:end] for output in outputs))
+            start = end
+
+# ---------------- SERVICE ----------------
+class PredictionService:
+    """
+    Resident models (with feature transformer and OOD detector) and
+    micro-batcher. `model_file` pins one model for every request; otherwise
+    each dataset gets its own, loaded on first use. A model is reloaded when
+    its .pkl changes (e.g. after the pipeline retrained it).
+    """
+    def __init__(self, model_file=None):
+        self.model_file = Path(model_file) if model_file else None
+        if self.model_file is not None and not self.model_file.exists():
+            raise FileNotFoundError(f"Model not found: {self.model_file}")
+        if self.model_file is None and find_model_file() is None:
+            raise FileNotFoundError("No trained model found! Run training first.")
+        self.lock = threading.Lock()
+        self.models = {}  # model file -> (mtime, (model, transformer, detector))
+        self.batcher = MicroBatcher()
+        if self.model_file is not None:
+            self.current_model(self.model_file)
+
+    def model_for(self, path=None, columns=None):
+        """
+        The pinned model, or the one for the dataset at `path` (or, for
+        rows, the first classifier that reads these `columns`).
+        """
+        if self.model_file is not None:
+            return self.model_file
+        model_file = find_model_file(path) if path is not None else match_model_file(columns)
+        if model_file is None:
+            raise FileNotFoundError(f"No trained model matches {Path(path).name if path else 'these columns'}")
+        return model_file
+
+    def current_model(self, model_file):
+        with self.lock:
+            mtime = model_file.stat().st_mtime
+            cached = self.models.get(model_file)
+            if cached is None or cached[0] != mtime:
+                predictor = load_predictor(model_file)
+                if is_regressor(predictor[0]):
+                    raise ValueError(f"{model_file.name} is a regressor; failure-risk scoring needs a classifier")
+                self.models[model_file] = cached = (mtime, predictor)
+                print(f"🔄 Model loaded: {model_file.name}")
+            return cached[1]
+
+    def score(self, df, model_file=None, row_filter=None):
+        model_file = model_file or self.model_for(columns=[str(col) for col in df.columns])
+        model, transformer, detector = self.current_model(model_file)
+        df, X = prepare_features(df, model, transformer, row_filter)
+        future = self.batcher.submit(model, X)
+        # OOD check runs on the request thread while the batch is scored
+        is_ood = detector.predict(X) if detector is not None else None
+        proba, predictions, uncertainty, trees_evaluated = future.result()
+        return compile_results(df, proba, predictions, uncertainty, is_ood, trees_evaluated)
+
+    def score_file(self, path):
+        """
+        Scores a CSV with its dataset's model, leaving out rows that model
+        already scored in other files. Returns (results, output path, rows
+        skipped).
+        """
+        model_file = self.model_for(path)
+        self.current_model(model_file)
+        row_filter = scored_rows_filter(model_file, path)
+        if row_filter is None:
+            results = self.score(read_csv_typed(path), model_file)
+            return results, save_results(results, path), 0
+        with row_filter:
+            results = self.score(read_csv_typed(path), model_file, row_filter)
+            output_path = save_results(results, path)
+            row_filter.commit()
+        return results, output_path, row_filter.skipped_rows
+
+# ---------------- HTTP LAYER ----------------
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None  # set by serve()
+
+    def _send(self, status, body):
+        payload = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            model_file = self.service.model_file
+            self._send(200, {"status": "ok", "model": model_file.name if model_file else "per dataset"})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/predict":
+                results = self.service.score(pd.DataFrame(request["rows"]))
+                self._send(200, '{"results": ' + results.to_json(orient="records", force_ascii=False) + "}")
+            elif self.path == "/predict_file":
+                results, output_path, skipped = self.service.score_file(request["path"])
+                self._send(200, {"output": str(output_path), "rows": len(results), "skipped": skipped})
+            else:
+                self._send(404, {"error": "not found"})
+        except (ValueError, KeyError, FileNotFoundError) as e:
+            self._send(400, {"error": f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def log_message(self, format, *args):
+        pass  # keep the console for model/status messages
+
+def serve(host=HOST, port=PORT, model_file=None):
+    ServiceHandler.service = PredictionService(model_file)
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    print(f"🚀 Prediction service listening on http://{host}:{port}")
+    server.serve_forever()
+
+# ---------------- CLIENT HELPERS ----------------
+class ServiceError(RuntimeError):
+    """
+    The service answered, but with an error (its message is the service's).
+    """
+
+def _call(path, payload=None, host=HOST, port=PORT, timeout=300):
+    url = f"http://{host}:{port}{path}"
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get("error", e.reason)
+        except ValueError:
+            message = e.reason
+        raise ServiceError(message) from None
+
+def is_service_running(host=HOST, port=PORT):
+    try:
+        return _call("/health", host=host, port=port, timeout=0.5).get("status") == "ok"
+    except OSError:
+        return False
+
+def predict_rows(rows, host=HOST, port=PORT):
+    """
+    rows: list of {column: value} dicts. Returns a results DataFrame.
+    """
+    return pd.DataFrame(_call("/predict", {"rows": rows}, host, port)["results"])
+
+def predict_file(path, host=HOST, port=PORT):
+    """
+    Scores a CSV on the service. Returns {"output": path, "rows": new rows
+    scored, "skipped": rows already scored from other files}.
+    """
+    return _call("/predict_file", {"path": str(Path(path).resolve())}, host, port)
+
+# ---------------- ENTRY POINT ----------------
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Warm local prediction service")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--model", default=None, help="score everything with this *_model.pkl (default: each dataset's own model)")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.model)
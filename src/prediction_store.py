@@ -0,0 +1,248 @@
+# Purpose:
+# Columnar prediction output + precomputed summary for dashboards.
+
+# Next to every FINAL_PREDICTIONS_<stem>.csv, scoring writes
+#   output/FINAL_PREDICTIONS_<stem>.columns/
+#       col_000.bin ...   one raw little-endian array per column
+#       meta.json         column names, dtypes, row count, category labels
+#       summary.json      counts, means, risk histogram, critical units
+# and then points output/LATEST_RUN.json at it. Text columns (Risk_Level,
+# Trust_Level, 'Type', ...) are stored as int32 category codes. Dashboards
+# read the pointer and the summary (constant time, no CSV parse) and
+# memory-map only the columns they display.
+
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+OUTPUT_DIR = ROOT_DIR / "output"
+LATEST_RUN_PATH = OUTPUT_DIR / "LATEST_RUN.json"
+COLUMNS_SUFFIX = ".columns"
+
+RISK_BINS = list(range(0, 101, 10))  # Risk_Percentage histogram edges
+CRITICAL_RISK = 90                   # Risk_Percentage >= this is a critical unit
+
+
+def _write_json(path, data):
+    tmp_path = Path(path).with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+# ------------------ SUMMARY ------------------
+class PredictionSummary:
+    """
+    Dashboard numbers, accumulated chunk by chunk (all sums and counts).
+    """
+    def __init__(self):
+        self.rows = 0
+        self.predicted_failures = 0
+        self.risk_sum = 0.0
+        self.uncertainty_sum = 0.0
+        self.critical = 0
+        self.low_trust = 0
+        self.ood = 0
+        self.risk_histogram = np.zeros(len(RISK_BINS) - 1, dtype=np.int64)
+        self.risk_levels = {}
+        self.trust_levels = {}
+
+    @staticmethod
+    def _add_counts(counts, series):
+        for label, n in series.value_counts().items():
+            counts[str(label)] = counts.get(str(label), 0) + int(n)
+
+    def update(self, results):
+        risk = results["Risk_Percentage"].to_numpy(dtype=np.float64)
+        self.rows += len(results)
+        self.predicted_failures += int(results["Prediction"].sum())
+        self.risk_sum += float(risk.sum())
+        self.uncertainty_sum += float(results["Uncertainty_Score"].sum())
+        self.critical += int((risk >= CRITICAL_RISK).sum())
+        self.low_trust += int(results["Trust_Level"].astype(str).str.contains("Low").sum())
+        if "OOD_Flag" in results.columns:
+            self.ood += int(results["OOD_Flag"].sum())
+        self.risk_histogram += np.histogram(risk, bins=RISK_BINS)[0]
+        self._add_counts(self.risk_levels, results["Risk_Level"])
+        self._add_counts(self.trust_levels, results["Trust_Level"])
+        return self
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "predicted_failures": self.predicted_failures,
+            "avg_risk": self.risk_sum / self.rows if self.rows else 0.0,
+            "avg_uncertainty": self.uncertainty_sum / self.rows if self.rows else 0.0,
+            "critical_units": self.critical,
+            "critical_risk": CRITICAL_RISK,
+            "low_trust": self.low_trust,
+            "ood_rows": self.ood,
+            "risk_histogram": {"edges": RISK_BINS, "counts": self.risk_histogram.tolist()},
+            "risk_levels": self.risk_levels,
+            "trust_levels": self.trust_levels,
+        }
+
+
+# ------------------ WRITING ------------------
+class ColumnarWriter:
+    """
+    Appends result chunks column by column. Numbers, booleans and dates are
+    stored raw (ints widened to int64 so every chunk fits); everything else
+    becomes int32 codes into a per-column label list (-1 = missing).
+    """
+    def __init__(self, columns_dir):
+        self.dir = Path(columns_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        for old in self.dir.glob("*"):
+            old.unlink()
+        self.columns = None   # [{"name", "file", "dtype", "categories"}]
+        self.files = []
+        self.rows = 0
+        self.summary = PredictionSummary()
+
+    def _storage(self, series):
+        if pd.api.types.is_bool_dtype(series):
+            return "bool"
+        if pd.api.types.is_integer_dtype(series):
+            return "int64"
+        if pd.api.types.is_float_dtype(series):
+            return str(series.dtype)
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return "datetime64[ns]"
+        return "category"
+
+    def _start(self, results):
+        self.columns = []
+        for i, name in enumerate(results.columns):
+            column = {"name": str(name), "file": f"col_{i:03d}.bin", "dtype": self._storage(results[name])}
+            if column["dtype"] == "category":
+                column["categories"] = []
+            self.columns.append(column)
+            self.files.append(open(self.dir / column["file"], "wb"))
+
+    def _encode(self, column, series):
+        if column["dtype"] != "category":
+            return series.to_numpy().astype(column["dtype"], copy=False)
+        # Map this chunk's labels onto the column's growing label list
+        # (a categorical's own label order is kept, e.g. the risk levels)
+        present = series.notna().to_numpy()
+        labels = series[present].astype(str)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            candidates = [str(v) for v in series.cat.categories]
+        else:
+            candidates = labels.unique().tolist()
+        known = set(column["categories"])
+        column["categories"] += [v for v in candidates if v not in known]
+
+        codes = np.full(len(series), -1, dtype=np.int32)
+        codes[present] = pd.Index(column["categories"]).get_indexer(labels)
+        return codes
+
+    def write(self, results):
+        if self.columns is None:
+            self._start(results)
+        for column, f in zip(self.columns, self.files):
+            f.write(np.ascontiguousarray(self._encode(column, results[column["name"]])).tobytes())
+        self.rows += len(results)
+        self.summary.update(results)
+
+    def close(self, source=None):
+        for f in self.files:
+            f.close()
+        _write_json(self.dir / "meta.json", {"rows": self.rows, "columns": self.columns or []})
+        summary = {"source": source, "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   **self.summary.to_dict()}
+        _write_json(self.dir / "summary.json", summary)
+        return summary
+
+
+def columns_dir_for(csv_path):
+    return Path(csv_path).with_suffix(COLUMNS_SUFFIX)
+
+
+def write_latest_run(csv_path, summary):
+    """
+    Points dashboards at the run that just finished (written last, atomically).
+    """
+    csv_path = Path(csv_path)
+    _write_json(LATEST_RUN_PATH, {
+        "name": csv_path.stem,
+        "csv": csv_path.name,
+        "columns": columns_dir_for(csv_path).name,
+        "finished_at": summary["finished_at"],
+    })
+
+
+def save_columnar(results, csv_path, source=None):
+    writer = ColumnarWriter(columns_dir_for(csv_path))
+    writer.write(results)
+    summary = writer.close(source)
+    write_latest_run(csv_path, summary)
+    return summary
+
+
+# ------------------ READING ------------------
+class PredictionStore:
+    """
+    Read side of one run: summary + lazily memory-mapped columns.
+    """
+    def __init__(self, columns_dir):
+        self.dir = Path(columns_dir)
+        with open(self.dir / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(self.dir / "summary.json", encoding="utf-8") as f:
+            self.summary = json.load(f)
+        self.rows = meta["rows"]
+        self.columns = {column["name"]: column for column in meta["columns"]}
+        self.name = self.dir.name.removesuffix(COLUMNS_SUFFIX)
+        self.csv_path = self.dir.with_suffix(".csv")
+
+    def raw(self, name):
+        """
+        The stored array (category codes for text columns), memory-mapped.
+        """
+        column = self.columns[name]
+        if self.rows == 0:
+            return np.empty(0, dtype=np.int32 if column["dtype"] == "category" else column["dtype"])
+        dtype = np.int32 if column["dtype"] == "category" else np.dtype(column["dtype"])
+        return np.memmap(self.dir / column["file"], dtype=dtype, mode="r", shape=(self.rows,))
+
+    def column(self, name, rows=None):
+        values = self.raw(name)
+        if rows is not None:
+            values = values[rows]
+        column = self.columns[name]
+        if column["dtype"] == "category":
+            return pd.Categorical.from_codes(np.asarray(values), categories=column["categories"])
+        return np.array(values)
+
+    def frame(self, columns=None, rows=None):
+        """
+        DataFrame of the requested columns (default: all), optionally only
+        the given row positions / mask. Unrequested columns are never read.
+        """
+        names = list(columns) if columns is not None else list(self.columns)
+        index = np.flatnonzero(rows) if rows is not None and np.asarray(rows).dtype == bool else rows
+        df = pd.DataFrame({name: self.column(name, index) for name in names})
+        if index is not None:
+            df.index = np.asarray(index)
+        return df
+
+
+def latest_run():
+    """
+    PredictionStore for the most recent scoring run, or None.
+    """
+    if not LATEST_RUN_PATH.exists():
+        return None
+    with open(LATEST_RUN_PATH, encoding="utf-8") as f:
+        pointer = json.load(f)
+    columns_dir = OUTPUT_DIR / pointer["columns"]
+    if not (columns_dir / "meta.json").exists():
+        return None
+    return PredictionStore(columns_dir)
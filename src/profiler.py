@@ -0,0 +1,297 @@
+# Purpose:
+# One-pass, chunked dataset profile (replaces describe(include="all")).
+
+# Shape, dtypes, null counts, approximate distinct counts, min/max/mean/std and
+# approximate quantiles are all gathered while the CSV streams through once in
+# fixed-size chunks. Every per-column summary is a mergeable sketch:
+#   - distinct counts: HyperLogLog registers (merge = elementwise max)
+#   - quantiles: KLL-style compactor levels (merge = concatenate + compact)
+#   - mean/std: count/mean/M2 combined with Chan's parallel formula
+# so chunk profiles (or profiles built by separate workers) merge into the
+# same result as one big pass. The final profile is saved as JSON in output/
+# for later stages and the UI to reuse.
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from src.row_index import SeenHashes, hash_rows, mark_seen
+
+OUTPUT_DIR = ROOT_DIR / "output"
+
+# ------------------ SETTINGS ------------------
+PROFILE_CHUNK_SIZE = 50_000
+HLL_PRECISION = 12        # 4096 registers, ~1.6% error on distinct counts
+QUANTILE_K = 256          # items kept per compactor level
+QUANTILES = {"25%": 0.25, "50%": 0.5, "75%": 0.75}
+
+
+# ------------------ SKETCHES ------------------
+def hash_values(series):
+    """
+    uint64 hash per non-null value (numbers hashed as float64, so 3 and 3.0
+    count as the same value in every chunk).
+    """
+    series = series.dropna()
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        series = series.astype("float64")
+    return pd.util.hash_pandas_object(series, index=False).to_numpy()
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter. 2**p one-byte registers per column.
+    """
+    def __init__(self, p=HLL_PRECISION):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        if len(hashes) == 0:
+            return
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        # rest < 2**52 is exact in float64, so frexp's exponent is its bit length
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        rank = (64 - self.p - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)  # linear counting for small sets
+        return int(round(estimate))
+
+
+class QuantileSketch:
+    """
+    KLL-style quantile sketch. levels[h] holds items of weight 2**h; a level
+    holding more than k items is sorted and every other item is promoted.
+    """
+    def __init__(self, k=QUANTILE_K, seed=0):
+        self.k = k
+        self.levels = []
+        self.rng = np.random.default_rng(seed)
+
+    def _add(self, level, items):
+        while len(self.levels) <= level:
+            self.levels.append(np.empty(0, dtype=np.float64))
+        self.levels[level] = np.concatenate([self.levels[level], items])
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                odd = len(items) % 2  # an odd item out stays on this level
+                self.levels[level] = items[:odd]
+                self._add(level + 1, items[odd + self.rng.integers(2)::2])
+            level += 1
+
+    def update(self, values):
+        self._add(0, np.asarray(values, dtype=np.float64))
+        self._compress()
+
+    def merge(self, other):
+        for level, items in enumerate(other.levels):
+            self._add(level, items)
+        self._compress()
+        return self
+
+    def quantiles(self, qs):
+        values = np.concatenate(self.levels) if self.levels else np.empty(0)
+        if len(values) == 0:
+            return [float("nan")] * len(qs)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, weights = values[order], weights[order]
+        # Each item sits at the middle of the rank range it represents
+        ranks = (np.cumsum(weights) - weights / 2) / weights.sum()
+        return [float(v) for v in np.interp(qs, ranks, values)]
+
+
+# ------------------ COLUMN / DATASET PROFILES ------------------
+def _merge_dtype(a, b):
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    numeric = ("int", "uint", "float")
+    return "float64" if a.startswith(numeric) and b.startswith(numeric) else "object"
+
+
+class ColumnProfile:
+    def __init__(self):
+        self.dtype = None
+        self.nulls = 0
+        self.distinct = HyperLogLog()
+        self.count = 0              # numeric values seen
+        self.mean = 0.0
+        self.m2 = 0.0               # sum of squared deviations from the mean
+        self.min = np.inf
+        self.max = -np.inf
+        self.quantiles = QuantileSketch()
+
+    def _merge_moments(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def update(self, series):
+        self.dtype = _merge_dtype(self.dtype, str(series.dtype))
+        self.nulls += int(series.isna().sum())
+        self.distinct.add_hashes(hash_values(series))
+
+        # Numbers stored as text ("messy" columns) still get numeric stats
+        if (pd.api.types.is_bool_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype)
+                or pd.api.types.is_datetime64_any_dtype(series)):
+            return
+        if pd.api.types.is_numeric_dtype(series):
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        self._merge_moments(len(values), mean, float(((values - mean) ** 2).sum()))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.quantiles.update(values)
+
+    def merge(self, other):
+        self.dtype = _merge_dtype(self.dtype, other.dtype)
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        if other.count:
+            self._merge_moments(other.count, other.mean, other.m2)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.quantiles.merge(other.quantiles)
+        return self
+
+    def to_dict(self):
+        summary = {"dtype": self.dtype, "nulls": self.nulls, "distinct": self.distinct.count()}
+        if self.count:
+            std = np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float("nan")
+            quantiles = self.quantiles.quantiles(list(QUANTILES.values()))
+            summary["numeric"] = {
+                "count": self.count, "mean": self.mean, "std": float(std), "min": self.min,
+                **dict(zip(QUANTILES, quantiles)), "max": self.max,
+            }
+        return summary
+
+
+class DatasetProfile:
+    """
+    Profile of a whole file, built chunk by chunk. Duplicate rows are counted
+    exactly from sorted row hashes (same scheme as streaming cleaning).
+    """
+    def __init__(self, source=None):
+        self.source = source
+        self.rows = 0
+        self.columns = {}
+        self.seen = SeenHashes()
+        self.duplicates = 0
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for col in chunk.columns:
+            self.columns.setdefault(col, ColumnProfile()).update(chunk[col])
+        is_dup, self.seen = mark_seen(hash_rows(chunk), self.seen)
+        self.duplicates += int(is_dup.sum())
+        return self
+
+    def merge(self, other):
+        """
+        Folds in the profile of a later part of the same file.
+        """
+        self.rows += other.rows
+        for col, column in other.columns.items():
+            if col in self.columns:
+                self.columns[col].merge(column)
+            else:
+                self.columns[col] = column
+        # Rows the other part counted as new may already be in this part
+        theirs = other.seen.values()
+        repeated = self.seen.contains(theirs)
+        self.duplicates += other.duplicates + int(repeated.sum())
+        self.seen.add(theirs[~repeated])
+        return self
+
+    def to_dict(self):
+        return {
+            "source": self.source,
+            "rows": self.rows,
+            "n_columns": len(self.columns),
+            "duplicate_rows": self.duplicates,
+            "columns": {col: column.to_dict() for col, column in self.columns.items()},
+        }
+
+
+# ------------------ ENTRY POINTS ------------------
+def profile_frame(df, source=None, chunk_size=PROFILE_CHUNK_SIZE):
+    profile = DatasetProfile(source)
+    for start in range(0, len(df), chunk_size):
+        profile.update(df.iloc[start:start + chunk_size])
+    return profile.to_dict()
+
+
+def profile_csv(path, chunk_size=PROFILE_CHUNK_SIZE):
+    path = Path(path)
+    profile = DatasetProfile(path.name)
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        profile.update(chunk)
+    return profile.to_dict()
+
+
+def profile_path(source):
+    return OUTPUT_DIR / f"{Path(source).stem}_profile.json"
+
+
+def save_profile(profile, path=None):
+    path = Path(path) if path else profile_path(profile["source"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2, default=float)
+    return path
+
+
+def load_profile(source):
+    """
+    Saved profile for a raw file name/path, or None if it was never profiled.
+    """
+    path = profile_path(source)
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def summary_table(profile):
+    """
+    describe()-shaped table (one column per dataset column) for printing.
+    """
+    rows = {}
+    for col, column in profile["columns"].items():
+        rows[col] = {"raw dtype": column.get("raw_dtype", column["dtype"]), "dtype": column["dtype"],
+                     "nulls": column["nulls"],
+                     "distinct~": column["distinct"], **column.get("numeric", {})}
+    return pd.DataFrame(rows)
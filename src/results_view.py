@@ -0,0 +1,124 @@
+# Purpose:
+# Server-side results view for the dashboard (filter, paginate, style, export).
+
+# Built once per prediction run (the UI caches it on the run's file identity
+# and mtime) and then answers every widget interaction without touching the
+# full table:
+#   - a risk index (row positions sorted by Risk_Percentage, highest first)
+#     turns "Minimum Risk %" into one binary search
+#   - only the requested page of rows is materialised and styled
+#   - the CSV export is built only when asked for
+# Reads the columnar output of prediction_store; prediction CSVs written
+# before it existed are loaded once into memory instead.
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.prediction_store import OUTPUT_DIR, PredictionStore, PredictionSummary, latest_run
+
+PAGE_SIZES = [50, 100, 250, 500]
+RISK_COLORS = {
+    "🔴 High Risk": "background-color: red",
+    "🟡 Medium Risk": "background-color: yellow",
+    "🟢 Low Risk": "background-color: lightgreen",
+}
+
+
+def latest_results():
+    """
+    (path, mtime) identifying the newest prediction run, or None. Cheap
+    enough to call on every rerun; use it as the cache key for load_view().
+    """
+    store = latest_run()
+    if store is not None:
+        meta = store.dir / "meta.json"
+        return str(store.dir), meta.stat().st_mtime
+    prediction_files = list(OUTPUT_DIR.glob("FINAL_PREDICTIONS_*.csv"))
+    if not prediction_files:
+        return None
+    latest_file = max(prediction_files, key=lambda x: x.stat().st_mtime)
+    return str(latest_file), latest_file.stat().st_mtime
+
+
+def load_view(path):
+    """
+    ResultsView for a path returned by latest_results().
+    """
+    path = Path(path)
+    if path.is_dir():
+        return ResultsView.from_store(PredictionStore(path))
+    return ResultsView.from_csv(path)
+
+
+class ResultsView:
+    def __init__(self, name, summary, risk, take):
+        """
+        name: file name shown / offered for download
+        summary: prediction_store summary dict
+        risk: Risk_Percentage per row
+        take(positions): DataFrame of those rows (index = row positions)
+        """
+        self.name = name
+        self.summary = summary
+        self._take = take
+        risk = np.nan_to_num(np.asarray(risk, dtype=np.float64), nan=-np.inf)
+        # Descending risk: rows passing any threshold are a prefix of the index
+        self.order = np.argsort(-risk, kind="stable")
+        self._ascending = np.ascontiguousarray(risk[self.order][::-1])
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(store.csv_path.name, store.summary, store.raw("Risk_Percentage"),
+                   lambda positions: store.frame(rows=positions))
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        df = pd.read_csv(csv_path)
+        return cls(Path(csv_path).name, PredictionSummary().update(df).to_dict(),
+                   df["Risk_Percentage"].to_numpy(), lambda positions: df.iloc[positions])
+
+    # ---------------- FILTER ----------------
+    def count(self, min_risk):
+        """
+        Rows with Risk_Percentage >= min_risk (binary search, no scan).
+        """
+        return len(self._ascending) - int(np.searchsorted(self._ascending, min_risk, side="left"))
+
+    def positions(self, min_risk, start=0, stop=None):
+        """
+        Row positions passing the filter, highest risk first, sliced.
+        """
+        n = self.count(min_risk)
+        stop = n if stop is None else min(stop, n)
+        return self.order[start:stop]
+
+    # ---------------- PAGES ----------------
+    def n_pages(self, min_risk, page_size):
+        return max(1, -(-self.count(min_risk) // page_size))
+
+    def page(self, min_risk, page, page_size):
+        """
+        DataFrame for one page (1-based) of the filtered rows.
+        """
+        start = (page - 1) * page_size
+        return self._take(self.positions(min_risk, start, start + page_size))
+
+    # ---------------- EXPORT ----------------
+    def to_csv(self, min_risk):
+        """
+        The filtered rows as CSV text, in file order.
+        """
+        return self._take(np.sort(self.positions(min_risk))).to_csv(index=False)
+
+
+def style_page(df):
+    """
+    Colours the Risk_Level cells of one page (a column lookup, not a
+    per-cell callback over the whole table).
+    """
+    if "Risk_Level" not in df.columns:
+        return df
+    return df.style.apply(lambda col: col.astype(str).map(RISK_COLORS).fillna("").tolist(),
+                          subset=["Risk_Level"])
@@ -0,0 +1,387 @@
+# Purpose:
+# Persistent index of row fingerprints across every ingested file and run.
+
+# Operators upload overlapping machine exports again and again; cleaning
+# only drops duplicates inside one file. This index remembers which rows
+# each source file already contributed:
+#   data/row_index/<namespace>/
+#     VERSION               what the index is valid for (e.g. the scoring model)
+#     ORDER                 source names in the order they were first seen
+#     <source>.idx.npy      uint64: [n, n sorted unique row fingerprints, Bloom filter words]
+# "clean" holds the cleaned rows each raw file contributed; "predict/<model>"
+# the rows scored with that model. A file's rows that another source already
+# contributed are skipped, so an overlapping export only costs its new rows
+# downstream. A source's own earlier rows are never skipped: re-running the
+# same file rebuilds its output in full and just replaces its entry.
+# For cleaning, "another source" means a raw file uploaded earlier: shared
+# rows belong to the oldest upload however the pipeline schedules the
+# files, and re-cleaning an old file doesn't hand its rows to newer ones.
+# Upload order is the clean namespace's ORDER, fixed the first time a file
+# is seen (see upload_order); re-saving or copying a file later doesn't
+# move it. Only files first seen together are ordered by mtime.
+#
+# A filter holds the namespace's lock file (.lock) from its first lookup
+# until its entry is recorded, so two processes filtering against the same
+# namespace (pipeline workers, the scoring service) take turns instead of
+# both keeping rows neither had recorded yet.
+#
+# Lookups open each entry memory-mapped. The Bloom filter (~10 bits per row,
+# ~1% false positives) rejects most new rows without touching the sorted
+# array; only the maybe-seen ones are binary-searched. Entries are written
+# to a temporary file and swapped in with os.replace, so a reader (another
+# pool worker) never sees half of one.
+
+import math
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+INDEX_DIR = ROOT_DIR / "data" / "row_index"
+
+# ------------------ SETTINGS ------------------
+BLOOM_FPR = 0.01       # target false-positive rate of each source's filter
+MAX_BLOOM_HASHES = 12
+ENTRY_SUFFIX = ".idx.npy"
+
+
+def row_fingerprints(df):
+    """
+    One uint64 per row, comparable across files and cleaning modes: numeric
+    columns at float32 precision (what the typed schema keeps) and
+    everything else as text, so an in-memory float32 frame and a streamed
+    float64 chunk of the same rows fingerprint alike.
+    """
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+            columns[str(col)] = series.to_numpy(dtype="float32", na_value=np.nan).astype("float64")
+        else:
+            columns[str(col)] = series.astype(object).where(series.notna(), None).astype(str).to_numpy()
+    return pd.util.hash_pandas_object(pd.DataFrame(columns, index=df.index), index=False).to_numpy()
+
+
+# ------------------ ROW HASHES ------------------
+# Full-precision row hashes (numbers as float64) for duplicates inside one
+# file (cleaning, profiling) and a model's seen rows (incremental training).
+def hash_rows(df):
+    """
+    One uint64 fingerprint per row. Numeric columns are hashed as float64 so
+    the same value hashes the same way in every chunk (int in one chunk,
+    float in another).
+    """
+    numeric_cols = df.select_dtypes(include="number").columns
+    if len(numeric_cols) > 0:
+        df = df.astype({col: "float64" for col in numeric_cols})
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+class SeenHashes:
+    """
+    Row hashes seen so far, as sorted uint64 runs of decreasing size. A new
+    run absorbs the previous one while that is no bigger (like carries in a
+    binary counter), so there are O(log n) runs and every hash is merged
+    O(log n) times - instead of the whole array once per chunk. Merges are
+    linear: a stable sort (timsort) of sorted runs only merges them. Only
+    hashes not in it yet are added (mark_seen filters them).
+    """
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs)
+
+    def contains(self, hashes):
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            pos = np.searchsorted(run, hashes)
+            pos[pos == len(run)] = 0
+            found |= run[pos] == hashes
+        return found
+
+    def add(self, hashes):
+        run = np.unique(np.asarray(hashes, dtype=np.uint64))
+        while self.runs and len(self.runs[-1]) <= len(run):
+            run = np.sort(np.concatenate([self.runs.pop(), run]), kind="stable")
+        if len(run):
+            self.runs.append(run)
+
+    def values(self):
+        """
+        Every hash, sorted (the runs are merged into one).
+        """
+        if len(self.runs) > 1:
+            self.runs = [np.sort(np.concatenate(self.runs), kind="stable")]
+        return self.runs[0] if self.runs else np.empty(0, dtype=np.uint64)
+
+
+def mark_seen(hashes, seen):
+    """
+    Flags rows whose hash is already in `seen` (a SeenHashes) or repeats
+    earlier in the same chunk, and adds the rest. Returns (is_duplicate, seen).
+    """
+    is_dup = pd.Series(hashes).duplicated().to_numpy(copy=True) | seen.contains(hashes)
+    seen.add(hashes[~is_dup])
+    return is_dup, seen
+
+
+# ------------------ BLOOM FILTER ------------------
+def _bloom_layout(n):
+    """
+    (words, hashes) for n fingerprints at BLOOM_FPR.
+    """
+    bits = max(64, math.ceil(-n * math.log(BLOOM_FPR) / math.log(2) ** 2))
+    words = -(-bits // 64)
+    hashes = min(MAX_BLOOM_HASHES, max(1, round(words * 64 / max(n, 1) * math.log(2))))
+    return words, hashes
+
+
+def _bloom_positions(fingerprints, bits, hashes):
+    """
+    Bit positions per fingerprint (hashes x rows) by double hashing: the
+    fingerprints are already uniform 64-bit hashes, so their two halves
+    serve as the two base hashes.
+    """
+    low = fingerprints & np.uint64(0xFFFFFFFF)
+    high = (fingerprints >> np.uint64(32)) | np.uint64(1)
+    steps = np.arange(hashes, dtype=np.uint64)[:, None]
+    return (low[None, :] + steps * high[None, :]) % np.uint64(bits)
+
+
+def build_bloom(fingerprints):
+    words, hashes = _bloom_layout(len(fingerprints))
+    bloom = np.zeros(words, dtype=np.uint64)
+    positions = _bloom_positions(fingerprints, words * 64, hashes).ravel()
+    np.bitwise_or.at(bloom, positions >> np.uint64(6), np.uint64(1) << (positions & np.uint64(63)))
+    return bloom
+
+
+def bloom_contains(bloom, n, fingerprints):
+    """
+    False where a fingerprint is certainly not in the filter built from n
+    fingerprints; True where it may be.
+    """
+    words, hashes = _bloom_layout(n)
+    positions = _bloom_positions(fingerprints, words * 64, hashes)
+    bits = (np.asarray(bloom)[positions >> np.uint64(6)] >> (positions & np.uint64(63))) & np.uint64(1)
+    return bits.all(axis=0)
+
+
+# ------------------ INDEX ------------------
+class RowIndex:
+    """
+    One namespace of the index: a sorted fingerprint array plus Bloom
+    filter per source. `version` (e.g. the scoring model's identity) wipes
+    the namespace when it no longer matches what was recorded.
+    """
+    def __init__(self, namespace, version=None, root=INDEX_DIR):
+        self.path = Path(root) / namespace
+        self.path.mkdir(parents=True, exist_ok=True)
+        if version is not None:
+            self._check_version(str(version))
+
+    def _check_version(self, version):
+        version_file = self.path / "VERSION"
+        if version_file.exists() and version_file.read_text() == version:
+            return
+        for entry in self.path.glob(f"*{ENTRY_SUFFIX}"):
+            entry.unlink(missing_ok=True)
+        tmp_path = version_file.with_name(f"VERSION.{os.getpid()}.tmp")
+        tmp_path.write_text(version)
+        os.replace(tmp_path, version_file)
+
+    def entry_path(self, source):
+        return self.path / f"{source}{ENTRY_SUFFIX}"
+
+    @contextmanager
+    def lock(self):
+        """
+        Exclusive hold on the namespace across processes (blocks until free).
+        """
+        with open(self.path / ".lock", "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def order(self):
+        """
+        Sources in first-seen order (see enroll).
+        """
+        order_file = self.path / "ORDER"
+        return order_file.read_text().split() if order_file.exists() else []
+
+    def enroll(self, sources):
+        """
+        Appends the sources not in ORDER yet, in the given order, and returns
+        the whole order. Call it under lock() when processes may race.
+        """
+        order = self.order()
+        new = [source for source in dict.fromkeys(sources) if source not in order]
+        if new:
+            order += new
+            tmp_path = self.path / f"ORDER.{os.getpid()}.tmp"
+            tmp_path.write_text("\n".join(order) + "\n")
+            os.replace(tmp_path, self.path / "ORDER")
+        return order
+
+    def sources(self):
+        return sorted(entry.name.removesuffix(ENTRY_SUFFIX) for entry in self.path.glob(f"*{ENTRY_SUFFIX}"))
+
+    def _open(self, source):
+        """
+        (sorted fingerprints, Bloom words) of one source, memory-mapped.
+        """
+        try:
+            entry = np.load(self.entry_path(source), mmap_mode="r")
+        except (OSError, ValueError):
+            return None, None   # replaced or removed meanwhile
+        n = int(entry[0]) if len(entry) else 0
+        return entry[1:n + 1], entry[n + 1:]
+
+    def __len__(self):
+        return sum(self.rows(source) for source in self.sources())
+
+    def rows(self, source):
+        fingerprints, _ = self._open(source)
+        return 0 if fingerprints is None else len(fingerprints)
+
+    def seen_elsewhere(self, fingerprints, source, among=None):
+        """
+        True for every fingerprint a different source (of `among`, default
+        all) already contributed.
+        """
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        seen = np.zeros(len(fingerprints), dtype=bool)
+        others = self.sources() if among is None else sorted(set(among) & set(self.sources()))
+        for other in others:
+            if other == source or seen.all():
+                continue
+            known, bloom = self._open(other)
+            if known is None or len(known) == 0:
+                continue
+            pending = np.flatnonzero(~seen)
+            candidates = pending[bloom_contains(bloom, len(known), fingerprints[pending])]
+            if len(candidates) == 0:
+                continue
+            values = fingerprints[candidates]
+            pos = np.searchsorted(known, values)
+            pos[pos == len(known)] = 0
+            seen[candidates[np.asarray(known[pos]) == values]] = True
+        return seen
+
+    def record(self, source, fingerprints):
+        """
+        Replaces the source's entry with these fingerprints.
+        """
+        known = np.unique(np.asarray(fingerprints, dtype=np.uint64))
+        entry = np.concatenate([np.array([len(known)], dtype=np.uint64), known, build_bloom(known)])
+        tmp_path = self.path / f".{source}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, entry)
+        os.replace(tmp_path, self.entry_path(source))
+
+    def forget(self, source):
+        self.entry_path(source).unlink(missing_ok=True)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+
+class SourceFilter:
+    """
+    Drops, frame by frame (or chunk by chunk), the rows another source (of
+    `among`, default any) already contributed, and collects the rest;
+    commit() records them as this source's rows. Used as a context manager
+    around apply() .. commit(), it holds the index lock throughout.
+    """
+    def __init__(self, index, source, among=None):
+        self.index = index
+        self.source = source
+        self.among = among
+        self.parts = []
+        self.new_rows = 0
+        self.skipped_rows = 0
+        self._lock = None
+
+    def __enter__(self):
+        self._lock = self.index.lock()
+        self._lock.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        lock, self._lock = self._lock, None
+        return lock.__exit__(*exc)
+
+    def apply(self, df):
+        fingerprints = row_fingerprints(df)
+        seen = self.index.seen_elsewhere(fingerprints, self.source, self.among)
+        skipped = int(np.count_nonzero(seen))
+        self.skipped_rows += skipped
+        self.new_rows += len(df) - skipped
+        self.parts.append(fingerprints[~seen])
+        return df[~seen] if skipped else df
+
+    def commit(self):
+        fingerprints = np.concatenate(self.parts) if self.parts else np.empty(0, dtype=np.uint64)
+        self.index.record(self.source, fingerprints)
+
+    def summary(self, done="ingested"):
+        return f"{self.new_rows} new rows, {self.skipped_rows} already {done} from other files (skipped)"
+
+
+def clean_index():
+    return RowIndex("clean")
+
+def upload_order(raw_files):
+    """
+    The raw files in upload order (oldest first): the order the clean index
+    first saw them in. Files it hasn't seen yet are enrolled now, oldest
+    mtime first; after that their place no longer depends on the file.
+    """
+    raw_files = [Path(raw_file) for raw_file in raw_files]
+    arrivals = sorted(raw_files, key=lambda path: (path.stat().st_mtime_ns, path.name))
+    index = clean_index()
+    with index.lock():
+        order = index.enroll(path.stem for path in arrivals)
+    rank = {stem: i for i, stem in enumerate(order)}
+    return sorted(raw_files, key=lambda path: rank[path.stem])
+
+def uploaded_before(raw_file):
+    """
+    Stems of the raw files (same folder) uploaded before this one.
+    """
+    raw_file = Path(raw_file)
+    stems = [path.stem for path in upload_order(raw_file.parent.glob("*.csv"))]
+    return stems[:stems.index(raw_file.stem)] if raw_file.stem in stems else stems
+
+def clean_filter(raw_file):
+    return SourceFilter(clean_index(), Path(raw_file).stem, among=uploaded_before(raw_file))
+
+def clean_inputs(raw_file):
+    """
+    Index entries a file's cleaning depends on (those of earlier uploads),
+    for the pipeline's stage key.
+    """
+    index = clean_index()
+    return [index.entry_path(stem) for stem in sorted(uploaded_before(raw_file))]
@@ -0,0 +1,203 @@
+# Purpose:
+# Compact, explicit dtypes for every CSV the project reads.
+
+# A schema is inferred once per file from a sample of its first rows and
+# cached in data/schemas/<file stem>.schema.json. Reads then hand read_csv
+# explicit dtypes instead of letting pandas guess (and keep) float64/int64 and
+# Python strings for everything:
+#   - float columns        -> float64; float32 only when every value survives
+#                             the round-trip exactly (whole numbers with NaN
+#                             gaps, halves...), rare for real measurements
+#   - integer columns      -> smallest int that holds them (checked after parsing)
+#   - numbers with junk    -> 'number': parsed with pd.to_numeric, the junk
+#                             ("unknown", "N/A") becomes NaN, float64
+#   - low-cardinality text -> category (e.g. 'Type', 'Symbol', 'Series')
+#   - date-like text       -> parsed datetimes
+# When the rest of the file doesn't fit the sample (NaN in an "int" column,
+# text in a "float" one) the file is read untyped once, the schema is
+# re-inferred from all of it and the cache is replaced.
+
+import json
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.instrumentation import span
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SCHEMA_DIR = ROOT_DIR / "data" / "schemas"
+
+# ------------------ SETTINGS ------------------
+SCHEMA_SAMPLE_ROWS = 10_000   # rows read to infer a schema
+CATEGORY_MAX_LEVELS = 1_000   # more distinct values than this stays text
+CATEGORY_MAX_RATIO = 0.5      # ... and so does text that is mostly unique
+NUMERIC_MIN_SHARE = 0.9       # text parsing as numbers this often is a numeric column
+INT_TYPES = ["int8", "int16", "int32", "int64"]
+SCHEMA_VERSION = 3            # bump when inference changes so cached schemas are redone
+
+
+# ------------------ INFERENCE ------------------
+def _smallest_int(lo, hi):
+    for dtype in INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    return "int64"
+
+def _looks_like_dates(values):
+    sample = values.head(200)
+    if not sample.str.contains(r"\d", regex=True).all():
+        return False
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # "could not infer format" for non-dates
+        parsed = pd.to_datetime(sample, errors="coerce")
+    return bool(parsed.notna().all())
+
+def _fits_float32(values):
+    values = values.to_numpy(dtype="float64")
+    return np.array_equal(values, values.astype("float32").astype("float64"), equal_nan=True)
+
+def infer_column(series):
+    """
+    Schema dtype for one column ('float32', 'float64', 'int16', 'number',
+    'category', 'datetime') or None to leave it to pandas (text, booleans,
+    empty columns).
+    """
+    values = series.dropna()
+    if len(values) == 0 or pd.api.types.is_bool_dtype(series):
+        return None
+    if pd.api.types.is_integer_dtype(series):
+        return _smallest_int(int(values.min()), int(values.max()))
+    if pd.api.types.is_float_dtype(series):
+        return "float32" if _fits_float32(values) else "float64"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+        return None
+
+    # Measurements with a few junk strings stay numbers, as fix_data_types would make them
+    if pd.to_numeric(values, errors="coerce").notna().mean() >= NUMERIC_MIN_SHARE:
+        return "number"
+    values = values.astype(str)
+    if _looks_like_dates(values):
+        return "datetime"
+    n_unique = values.nunique()
+    if n_unique <= CATEGORY_MAX_LEVELS and n_unique <= CATEGORY_MAX_RATIO * len(values):
+        return "category"
+    return None
+
+def infer_schema(df):
+    """
+    {'columns': header, 'dtypes': {col: dtype}, 'raw_dtypes': {col: pandas'
+    own guess}} for an untyped frame. The raw dtypes show what arrived as
+    text (e.g. 'str' for a numeric column with junk in it).
+    """
+    dtypes = {}
+    for col in df.columns:
+        dtype = infer_column(df[col])
+        if dtype is not None:
+            dtypes[col] = dtype
+    return {"version": SCHEMA_VERSION, "columns": [str(col) for col in df.columns], "dtypes": dtypes,
+            "raw_dtypes": {str(col): str(df[col].dtype) for col in df.columns}}
+
+
+# ------------------ CACHE ------------------
+def schema_path(csv_path):
+    return SCHEMA_DIR / f"{Path(csv_path).stem}.schema.json"
+
+def save_schema(schema, csv_path):
+    SCHEMA_DIR.mkdir(parents=True, exist_ok=True)
+    with open(schema_path(csv_path), "w") as f:
+        json.dump(schema, f, indent=2)
+
+def get_schema(csv_path):
+    """
+    Cached schema for the file, re-inferred from a sample when there is none,
+    it predates SCHEMA_VERSION or the file's header no longer matches it.
+    """
+    csv_path = Path(csv_path)
+    header = [str(col) for col in pd.read_csv(csv_path, nrows=0).columns]
+    cached = schema_path(csv_path)
+    if cached.exists():
+        with open(cached) as f:
+            schema = json.load(f)
+        if schema.get("version") == SCHEMA_VERSION and schema["columns"] == header:
+            return schema
+
+    schema = infer_schema(pd.read_csv(csv_path, nrows=SCHEMA_SAMPLE_ROWS))
+    save_schema(schema, csv_path)
+    return schema
+
+
+# ------------------ READING ------------------
+def read_options(schema):
+    """
+    dtype / parse_dates arguments for read_csv. Integers are parsed as int64
+    and floats as float64, and narrowed afterwards: read_csv would silently
+    wrap values that don't fit a small int, or round ones float32 can't hold.
+    """
+    dtype, parse_dates = {}, []
+    for col, kind in schema["dtypes"].items():
+        if kind == "datetime":
+            parse_dates.append(col)
+        elif kind in INT_TYPES:
+            dtype[col] = "int64"
+        elif kind == "number":
+            continue  # read as text, parsed in apply_schema
+        elif kind == "float32":
+            dtype[col] = "float64"
+        else:
+            dtype[col] = kind
+    return {"dtype": dtype, "parse_dates": parse_dates}
+
+def apply_schema(df, schema):
+    """
+    Casts an already-loaded frame to the schema's dtypes. Columns whose values
+    don't fit (out-of-range ints, floats float32 would round, unparseable
+    numbers) keep their dtype.
+    """
+    df = df.copy(deep=False)  # column assignments below don't touch the caller's frame
+    for col, kind in schema["dtypes"].items():
+        if col not in df.columns:
+            continue
+        series = df[col]
+        try:
+            if kind == "datetime":
+                if not pd.api.types.is_datetime64_any_dtype(series):
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore")
+                        df[col] = pd.to_datetime(series)
+            elif kind in INT_TYPES:
+                if pd.api.types.is_integer_dtype(series) and len(series):
+                    df[col] = series.astype(_smallest_int(int(series.min()), int(series.max())))
+            elif kind == "number":
+                df[col] = pd.to_numeric(series, errors="coerce").astype("float64")
+            elif kind == "float32":
+                series = series.astype("float64")
+                df[col] = series.astype("float32") if _fits_float32(series) else series
+            else:
+                df[col] = series.astype(kind)
+        except (ValueError, TypeError):
+            continue
+    return df
+
+def read_csv_typed(csv_path, **kwargs):
+    """
+    pd.read_csv with the file's cached schema (whole-file reads only; chunked
+    readers keep their own dtype handling).
+    """
+    csv_path = Path(csv_path)
+    with span("read", file=csv_path.name) as current:
+        schema = get_schema(csv_path)
+        try:
+            df = pd.read_csv(csv_path, **read_options(schema), **kwargs)
+        except (ValueError, TypeError, OverflowError):
+            # The sample didn't represent the whole file: learn from all of it
+            df = pd.read_csv(csv_path, **kwargs)
+            schema = infer_schema(df)
+            save_schema(schema, csv_path)
+        df = apply_schema(df, schema)
+        current.rows_out = len(df)
+    return df
@@ -0,0 +1,208 @@
+# Purpose:
+# Small DAG scheduler for the per-dataset pipeline stages.
+
+# A Stage declares what it needs (upstream stages, input files) and what it
+# writes (output files). The scheduler turns the selected stages into one
+# node per (dataset, stage) and runs every node whose upstream nodes for the
+# same dataset have settled - so after cleaning, e.g., feature plots and
+# model training of a dataset can run side by side on the process pool, and
+# one slow dataset never holds the others back at a stage boundary. A serial
+# stage (cleaning, whose row index makes each file depend on the uploads
+# before it) takes the datasets one at a time, in context order.
+#
+# Nodes whose inputs and code are unchanged since the last run are skipped
+# via the build manifest. A failing node drops its dataset's downstream
+# nodes; other datasets carry on. Stages left out of a selection are assumed
+# done: their outputs are picked up from disk.
+
+import copy
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from src.instrumentation import span
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class Stage:
+    def __init__(self, name, title, task, requires=(), inputs=None, outputs=None,
+                 apply=None, uses_cores=False, ships_frames=True, serial=False):
+        """
+        task(ds[, n_jobs]) -> result     top-level function (runs on the pool)
+        requires                        upstream stage names
+        inputs(ds) / outputs(ds)        files hashed into / recorded in the manifest
+        apply(ds, result)               stores the result on the parent's DatasetState
+        uses_cores                      task gets the forest n_jobs as second argument
+        ships_frames                    False = a pool task gets ds without its frames
+                                        (it maps the feature cache instead of unpickling them)
+        serial                          one dataset at a time, each after the ones before it
+        """
+        self.name = name
+        self.title = title
+        self.task = task
+        self.requires = tuple(requires)
+        self.inputs = inputs or (lambda ds: [])
+        self.outputs = outputs or (lambda ds: [])
+        self.apply = apply
+        self.uses_cores = uses_cores
+        self.ships_frames = ships_frames
+        self.serial = serial
+
+
+def run_node(stage_name, task, ds, *args):
+    """
+    One (dataset, stage) task under its trace span - in the parent or on a
+    pool worker. Sub-step spans inside the task inherit stage and dataset.
+    """
+    with span(stage_name, cat="stage", profile=True, stage=stage_name, dataset=ds.name):
+        return task(ds, *args)
+
+
+def _notify(on_event, stage, status, **details):
+    if on_event is not None:
+        on_event({"stage": stage, "status": status, **details})
+
+
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise PipelineCancelled()
+
+
+def select_stages(stages, names=None):
+    """
+    The stages to run, in declaration order. names=None selects all.
+    """
+    if names is None:
+        return list(stages)
+    known = [stage.name for stage in stages]
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)} (choose from {', '.join(known)})")
+    return [stage for stage in stages if stage.name in names]
+
+
+def _upstream(stages, selected):
+    """
+    {stage name: selected stages it has to wait for}. Dependencies are
+    followed through unselected stages (clean -> [train] -> predict).
+    """
+    by_name = {stage.name: stage for stage in stages}
+    selected_names = {stage.name for stage in selected}
+
+    def ancestors(name):
+        found = set()
+        for parent in by_name[name].requires:
+            found |= {parent} | ancestors(parent)
+        return found
+
+    return {stage.name: ancestors(stage.name) & selected_names for stage in selected}
+
+
+def run_graph(ctx, stages, selected, manifest, executor=None, n_jobs=1, force=False,
+              on_event=None, cancel=None):
+    """
+    Runs the selected stages for every dataset in ctx. executor=None runs
+    one node at a time in the parent (stage by stage, like a plain loop);
+    a process pool runs every ready node at once. Progress is reported
+    through on_event (see analysis_pipeline.py); setting `cancel` stops at
+    the next node boundary with PipelineCancelled.
+    """
+    upstream = _upstream(stages, selected)
+    order = {stage.name: i for i, stage in enumerate(selected)}
+    position = {ds.name: i for i, ds in enumerate(ctx)}
+    waiting = [(ds, stage) for stage in selected for ds in ctx]
+    settled = set()          # (dataset name, stage name)
+    announced = set()
+    running = {}             # future -> (ds, stage, key)
+    _notify(on_event, None, "planned", datasets=[ds.name for ds in ctx],
+            stages=[stage.name for stage in selected])
+
+    def turn_of(ds, stage):
+        """
+        False while an earlier dataset's node of a serial stage is pending.
+        """
+        if not stage.serial:
+            return True
+        pending = [other for other, s in waiting if s is stage] + \
+                  [other for other, s, _ in running.values() if s is stage]
+        return all(position[other.name] >= position[ds.name] for other in pending if other is not ds)
+
+    def settle(ds, stage):
+        settled.add((ds.name, stage.name))
+
+    def finish(ds, stage, key, result):
+        if stage.apply is not None:
+            stage.apply(ds, result)
+        outputs = stage.outputs(ds)
+        manifest.record(ds.name, stage.name, key, outputs)
+        settle(ds, stage)
+        _notify(on_event, stage.name, "done", dataset=ds.name, outputs=[str(p) for p in outputs])
+
+    def fail(ds, stage, error):
+        ds.error = f"{stage.name}: {type(error).__name__}: {error}"
+        print(f"❌ {stage.name} failed for {ds.name}: {type(error).__name__}: {error}")
+        settle(ds, stage)
+        _notify(on_event, stage.name, "failed", dataset=ds.name, error=f"{type(error).__name__}: {error}")
+
+    try:
+        while waiting or running:
+            _check_cancel(cancel)
+            # Drop nodes of datasets that failed upstream
+            waiting = [(ds, stage) for ds, stage in waiting if ds.error is None]
+            ready = [(ds, stage) for ds, stage in waiting
+                     if all((ds.name, parent) in settled for parent in upstream[stage.name])
+                     and turn_of(ds, stage)]
+            ready.sort(key=lambda node: order[node[1].name])
+            if executor is None:
+                ready = ready[:1]
+
+            for ds, stage in ready:
+                waiting.remove((ds, stage))
+                if stage.name not in announced:
+                    announced.add(stage.name)
+                    print(f"\n[{stage.name.upper()}] {stage.title}")
+
+                key = manifest.stage_key(stage.name, stage.inputs(ds))
+                if not force and manifest.is_current(ds.name, stage.name, key, stage.outputs(ds)):
+                    print(f"⏭️  {stage.name}: {ds.name} unchanged, skipping")
+                    settle(ds, stage)
+                    _notify(on_event, stage.name, "skipped", dataset=ds.name,
+                            outputs=[str(p) for p in stage.outputs(ds)])
+                    continue
+
+                _notify(on_event, stage.name, "started", dataset=ds.name)
+                args = (n_jobs,) if stage.uses_cores else ()
+                if executor is None:
+                    try:
+                        result = run_node(stage.name, stage.task, ds, *args)
+                    except Exception as e:
+                        fail(ds, stage, e)
+                    else:
+                        finish(ds, stage, key, result)
+                else:
+                    # A copy: the parent keeps updating ds while the pool pickles it
+                    shipped = copy.copy(ds)
+                    if not stage.ships_frames:
+                        shipped.raw_df = shipped.clean_df = None
+                    running[executor.submit(run_node, stage.name, stage.task, shipped, *args)] = (ds, stage, key)
+
+            if not ready and not running and waiting:
+                raise RuntimeError("Stage graph has nodes that can never run (dependency cycle?)")
+            if executor is None or not running:
+                continue
+            # Wake up now and then so a cancel request isn't stuck behind a long task
+            done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                ds, stage, key = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    fail(ds, stage, e)
+                else:
+                    finish(ds, stage, key, result)
+    except PipelineCancelled:
+        for future in running:
+            future.cancel()
+        wait(running)
+        raise
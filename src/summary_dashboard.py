@@ -1,37 +1,56 @@
 import pandas as pd
 from pathlib import Path
+import sys
 
 # Setup Paths
 ROOT_DIR = Path(__file__).resolve().parents[1]
 OUTPUT_DIR = ROOT_DIR / "output"
+sys.path.append(str(ROOT_DIR))
+
+from src.prediction_store import latest_run
+
+def summarize_csv(df):
+    """
+    Same numbers as the summary sidecar, for prediction CSVs written before
+    the columnar output existed.
+    """
+    return {
+        "rows": len(df),
+        "predicted_failures": int(df['Prediction'].sum()),
+        "avg_risk": df['Risk_Percentage'].mean(),
+        # Identify high-risk critical machines (Risk > 90%)
+        "critical_units": len(df[df['Risk_Percentage'] >= 90]),
+        # Identify machines where the AI is "Unsure" (Uncertainty > threshold)
+        "low_trust": int((df['Trust_Level'].str.contains("Low Trust")).sum()),
+    }
 
 def generate_dashboard():
-    # 1. Find the latest final prediction file
-    prediction_files = list(OUTPUT_DIR.glob("FINAL_PREDICTIONS_*.csv"))
-    if not prediction_files:
-        print("❌ No final predictions found. Run src/predict.py first!")
-        return
-    
-    # Pick the most recent one
-    latest_file = max(prediction_files, key=lambda x: x.stat().st_mtime)
-    df = pd.read_csv(latest_file)
-
-    # 2. Calculate Enhanced Statistics
-    total_samples = len(df)
-    total_failures = df['Prediction'].sum()
-    avg_risk = df['Risk_Percentage'].mean()
-    
-    # Identify high-risk critical machines (Risk > 90%)
-    critical_machines = len(df[df['Risk_Percentage'] >= 90])
-    
-    # Identify machines where the AI is "Unsure" (Uncertainty > threshold)
-    low_trust_count = (df['Trust_Level'].str.contains("Low Trust")).sum()
-    
+    # 1. Latest run: precomputed summary if there is one, else parse the newest CSV
+    store = latest_run()
+    if store is not None:
+        name, summary = store.csv_path.name, store.summary
+    else:
+        prediction_files = list(OUTPUT_DIR.glob("FINAL_PREDICTIONS_*.csv"))
+        if not prediction_files:
+            print("❌ No final predictions found. Run src/predict.py first!")
+            return
+
+        # Pick the most recent one
+        latest_file = max(prediction_files, key=lambda x: x.stat().st_mtime)
+        name, summary = latest_file.name, summarize_csv(pd.read_csv(latest_file))
+
+    # 2. Enhanced Statistics
+    total_samples = summary["rows"]
+    total_failures = summary["predicted_failures"]
+    avg_risk = summary["avg_risk"]
+    critical_machines = summary["critical_units"]
+    low_trust_count = summary["low_trust"]
+
     # 3. Print the Professional Dashboard
     print("\n" + "="*60)
     print(" 🛡️  INDUSTRIAL MACHINE SAFETY: ADVANCED RISK DASHBOARD ")
     print("="*60)
-    print(f"📊 Dataset Analyzed:      {latest_file.name.replace('FINAL_PREDICTIONS_', '')}")
+    print(f"📊 Dataset Analyzed:      {name.replace('FINAL_PREDICTIONS_', '')}")
     print(f"✅ Total Units Scanned:    {total_samples}")
     print(f"🚨 Predicted Failures:     {total_failures}")
     print(f"📉 Average Factory Risk:   {avg_risk:.2f}%")
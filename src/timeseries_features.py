@@ -0,0 +1,307 @@
+# Purpose:
+# Lag, rolling-window and return features for time-series datasets.
+
+# A dataset is a time series when it has a date column (typed datetime, or
+# text that parses as dates) whose values are (almost) all distinct, like
+# ADANIPORTS' daily 'Date'. Its cleaned rows are sorted by date once, and
+# every numeric column except the target gets
+#   <col>_lag<k>      value k rows back                     (LAGS)
+#   <col>_mean<w>     rolling mean over the last w rows     (WINDOWS)
+#   <col>_std<w>      rolling std over the last w rows
+#   <col>_return      change since the previous row (x / lag1 - 1)
+# placed before the target column (detect_target_column still finds it
+# last). The date itself is never encoded as a feature.
+#
+# Windows are updated incrementally: pandas' rolling kernels add the value
+# entering and drop the one leaving each window (O(1) per row), so a new
+# row only needs the previous max(window, lag) rows as context. That tail is
+# the window state, kept per dataset in
+#   data/timeseries/<dataset>/
+#     state.json     spec (date column, columns, lags, windows), rows done,
+#                    last date, digest of those rows, the window tail
+#     features.npy   float32 features of every row done so far
+# When the cleaned series only grew (same history, later days appended) the
+# next run computes the appended days from the stored tail and reuses the
+# stored features for the rest; any other change recomputes from scratch.
+# Scoring uses the same tail to continue a series past its training data.
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from src.schema import infer_column, read_csv_typed
+from src.utils import detect_target_column
+from src.row_index import row_fingerprints
+
+TIMESERIES_DIR = ROOT_DIR / "data" / "timeseries"
+
+# ------------------ SETTINGS ------------------
+LAGS = (1, 5)
+WINDOWS = (5, 20)
+MIN_UNIQUE_DATES = 0.95   # share of distinct dates for a column to order a series
+STATE_VERSION = 1
+
+
+def _dates(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # "could not infer format"
+        return pd.to_datetime(series, errors="coerce")
+
+
+def detect_date_column(df):
+    """
+    The column a time series is ordered by, or None: a datetime column (or
+    date-like text) whose values are nearly all distinct.
+    """
+    for col in df.columns:
+        series = df[col]
+        if not pd.api.types.is_datetime64_any_dtype(series):
+            if isinstance(series.dtype, pd.CategoricalDtype) or infer_column(series) != "datetime":
+                continue
+        values = series.dropna()
+        if len(values) > 1 and values.nunique() >= MIN_UNIQUE_DATES * len(values):
+            return col
+    return None
+
+
+# ------------------ SPEC ------------------
+class SeriesSpec:
+    """
+    Which columns get which features, and for which dataset's state.
+    """
+    def __init__(self, dataset, date_column, columns, lags=LAGS, windows=WINDOWS):
+        self.dataset = dataset
+        self.date_column = date_column
+        self.columns = list(columns)
+        self.lags = [int(k) for k in lags]
+        self.windows = [int(w) for w in windows]
+
+    @classmethod
+    def detect(cls, df, dataset, target):
+        """
+        Spec for a cleaned frame, or None when it isn't a time series.
+        """
+        date_column = detect_date_column(df)
+        if date_column is None:
+            return None
+        columns = [col for col in df.columns if col not in (date_column, target)
+                   and pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])]
+        return cls(dataset, date_column, columns) if columns else None
+
+    @property
+    def feature_names(self):
+        names = []
+        for col in self.columns:
+            names += [f"{col}_lag{k}" for k in self.lags]
+            for w in self.windows:
+                names += [f"{col}_mean{w}", f"{col}_std{w}"]
+            names.append(f"{col}_return")
+        return names
+
+    @property
+    def history(self):
+        """
+        Previous rows a new row's features depend on.
+        """
+        return max(self.lags + [w - 1 for w in self.windows])
+
+    def to_dict(self):
+        return {"dataset": self.dataset, "date_column": self.date_column, "columns": self.columns,
+                "lags": self.lags, "windows": self.windows}
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(**spec) if spec else None
+
+    def __eq__(self, other):
+        return isinstance(other, SeriesSpec) and self.to_dict() == other.to_dict()
+
+
+# ------------------ INCREMENTAL WINDOWS ------------------
+def _window_features(values, spec, tail=None):
+    """
+    float32 features (rows x spec.feature_names) for date-ordered `values`
+    (the spec's columns), continuing from the `tail` rows before them.
+    Rows without enough history yet see what there is: lags fall back to
+    the current value and the first return is 0.
+    """
+    context = 0 if tail is None else len(tail)
+    frame = values if not context else pd.concat([tail, values], ignore_index=True)
+    frame = frame.reset_index(drop=True).astype("float64")
+    out = np.empty((len(frame), len(spec.feature_names)), dtype=np.float64)
+    j = 0
+    for col in spec.columns:
+        x = frame[col]
+        for k in spec.lags:
+            out[:, j] = x.shift(k).fillna(x).to_numpy()
+            j += 1
+        for w in spec.windows:
+            rolling = x.rolling(w, min_periods=1)
+            out[:, j] = rolling.mean().to_numpy()
+            out[:, j + 1] = rolling.std(ddof=0).to_numpy()
+            j += 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = x.to_numpy() / x.shift(1).to_numpy() - 1
+        out[:, j] = np.where(np.isfinite(returns), returns, 0.0)
+        j += 1
+    return out[context:].astype(np.float32)
+
+
+class SeriesFeaturizer:
+    """
+    Adds the features to a frame, or to consecutive chunks of one series,
+    carrying the window tail from call to call.
+    """
+    def __init__(self, spec, tail=None, last_date=None):
+        self.spec = spec
+        self.tail = tail
+        self.last_date = last_date
+
+    @classmethod
+    def for_scoring(cls, spec):
+        """
+        Seeded with the dataset's stored tail, so rows dated after its
+        training data continue that series.
+        """
+        state = _load_state(spec.dataset)
+        if state is None or SeriesSpec.from_dict(state["spec"]) != spec:
+            return cls(spec)
+        return cls(spec, pd.DataFrame(state["tail"], columns=spec.columns), pd.Timestamp(state["last_date"]))
+
+    def add(self, df):
+        """
+        df sorted by date with the feature columns added (before the target,
+        i.e. the last column). The tail is only used when df starts after it.
+        """
+        df = sort_by_date(df, self.spec.date_column)
+        dates = _dates(df[self.spec.date_column])
+        continues = self.tail is not None and len(df) and self.last_date is not None \
+            and dates.iloc[0] > self.last_date
+        features = _window_features(df[self.spec.columns], self.spec, self.tail if continues else None)
+        if len(df):
+            recent = df[self.spec.columns].tail(self.spec.history)
+            self.tail = pd.concat([self.tail, recent], ignore_index=True).tail(self.spec.history) \
+                if continues else recent.reset_index(drop=True)
+            self.last_date = dates.iloc[-1]
+        return with_features(df, features, self.spec)
+
+
+def sort_by_date(df, date_column):
+    """
+    Rows in date order (stable, so same-day rows keep their file order);
+    the frame is only copied when it isn't sorted already.
+    """
+    dates = _dates(df[date_column])
+    if dates.is_monotonic_increasing:
+        return df.reset_index(drop=True)
+    order = np.argsort(dates.to_numpy(), kind="stable")
+    return df.iloc[order].reset_index(drop=True)
+
+
+def with_features(df, features, spec):
+    """
+    df with the feature columns inserted before its last (target) column.
+    """
+    block = pd.DataFrame(features, columns=spec.feature_names, index=df.index)
+    own = [col for col in df.columns if col not in block.columns]
+    return pd.concat([df[own[:-1]], block, df[own[-1:]]], axis=1)
+
+
+# ------------------ STATE ------------------
+def state_dir(dataset):
+    return TIMESERIES_DIR / dataset
+
+
+def _load_state(dataset):
+    path = state_dir(dataset) / "state.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    return state if state.get("version") == STATE_VERSION else None
+
+
+def _history_digest(df, spec):
+    return hashlib.sha256(row_fingerprints(df[[spec.date_column] + spec.columns]).tobytes()).hexdigest()
+
+
+def _save_state(spec, df, features):
+    out_dir = state_dir(spec.dataset)
+    tmp_dir = out_dir.with_name(f"{out_dir.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    np.save(tmp_dir / "features.npy", features)
+    tail = df[spec.columns].tail(spec.history)
+    state = {
+        "version": STATE_VERSION,
+        "spec": spec.to_dict(),
+        "rows": len(df),
+        "last_date": str(_dates(df[spec.date_column]).iloc[-1]) if len(df) else None,
+        "digest": _history_digest(df, spec),
+        "tail": tail.astype("float64").to_numpy().tolist(),
+    }
+    with open(tmp_dir / "state.json", "w") as f:
+        json.dump(state, f, indent=2)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+
+
+def load_spec(dataset):
+    """
+    The stored SeriesSpec of a dataset ('<stem>' or '<stem>_cleaned'), or
+    None when it isn't a time series.
+    """
+    state = _load_state(dataset.removesuffix("_cleaned"))
+    return None if state is None else SeriesSpec.from_dict(state["spec"])
+
+
+def add_series_features(df, dataset, target):
+    """
+    Cleaning entry point. Returns (frame, spec, rows computed): the cleaned
+    frame sorted by date with the features added, or (df, None, 0) when the
+    dataset isn't a time series. Only rows appended since the last run are
+    computed when the earlier rows are unchanged.
+    """
+    spec = SeriesSpec.detect(df, dataset, target)
+    if spec is None:
+        shutil.rmtree(state_dir(dataset), ignore_errors=True)
+        return df, None, 0
+    df = sort_by_date(df, spec.date_column)
+
+    state = _load_state(dataset)
+    done = 0
+    if (state is not None and SeriesSpec.from_dict(state["spec"]) == spec and 0 < state["rows"] <= len(df)
+            and _history_digest(df.iloc[:state["rows"]], spec) == state["digest"]):
+        done = state["rows"]
+    if done:
+        tail = pd.DataFrame(state["tail"], columns=spec.columns)
+        features = np.concatenate([np.load(state_dir(dataset) / "features.npy"),
+                                   _window_features(df[spec.columns].iloc[done:], spec, tail)])
+    else:
+        features = _window_features(df[spec.columns], spec)
+    _save_state(spec, df, features)
+    return with_features(df, features, spec), spec, len(df) - done
+
+
+def add_series_features_csv(csv_path, dataset, target=None):
+    """
+    Same for a cleaned CSV written in streaming mode: a series has to be
+    sorted as a whole, so the file is read once, extended and rewritten.
+    """
+    df = read_csv_typed(csv_path)
+    df, spec, computed = add_series_features(df, dataset, target or detect_target_column(df))
+    if spec is not None:
+        df.to_csv(csv_path, index=False)
+    return df, spec, computed
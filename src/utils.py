@@ -12,17 +12,22 @@
 # Be reused by all other files
 
 from pathlib import Path
+import sys
 import pandas as pd
 
 # Get project root directory
 ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from src.schema import read_csv_typed
 
 def load_csv(relative_path):
     """
-    Load a CSV file using a relative path from project root.
+    Load a CSV file using a relative path from project root, with the
+    file's cached compact dtypes (see schema.py).
     """
     file_path = ROOT_DIR / relative_path
-    return pd.read_csv(file_path)
+    return read_csv_typed(file_path)
 
 def save_csv(df, relative_path):
     """
@@ -50,7 +55,10 @@ def fix_data_types(df):
     numbers disguised as strings.
     """
     for col in df.columns:
-        if df[col].dtype == 'object':
+        # Text columns only ('object' or pandas' 'str'); categories and dates are already typed
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            continue
+        if df[col].dtype == 'object' or pd.api.types.is_string_dtype(df[col]):
             # Attempt to convert to numeric, turning non-convertible text to NaN
             converted = pd.to_numeric(df[col], errors='coerce')
             # If the column wasn't purely text (contains actual numbers), update it
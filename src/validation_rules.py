@@ -0,0 +1,239 @@
+# Purpose:
+# Declarative, per-dataset validation rules compiled to one vectorized mask.
+
+# Each dataset may have config/rules/<file stem>.json:
+#   {
+#     "required":    ["Air_Temp_K", "Rotational_Speed_RPM"],
+#     "ranges":      {"Air_Temp_K": {"exclusive_max": 500},
+#                     "Rotational_Speed_RPM": {"min": 0}},
+#     "categories":  {"Type": ["Low", "Medium", "High"]},
+#     "constraints": ["Low <= Close <= High", "`Deliverable Volume` <= Volume"]
+#   }
+# ranges take min / max (inclusive) and exclusive_min / exclusive_max;
+# constraints chain <, <=, >, >=, ==, != over column names (`backticks` for
+# names with spaces) and numbers. Every rule is compiled once into a
+# function returning its violating rows. A frame (or chunk) is then checked
+# in one pass: each rule's violations are counted and OR-ed into a single
+# mask, and the frame is filtered once at the end - no filtered copy per rule.
+# Missing values never violate a rule (the cleaning's dropna handles them).
+# A missing required column is an error. A dataset without a rule file of
+# its own (e.g. an export uploaded under another name) borrows the first one
+# whose columns it has (see find_rules_path); with none of those it is not
+# validated at all, and cleaning says so.
+
+import json
+import operator
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+RULES_DIR = ROOT_DIR / "config" / "rules"
+
+RANGE_BOUNDS = {
+    "min": operator.lt,            # value < min violates
+    "exclusive_min": operator.le,
+    "max": operator.gt,
+    "exclusive_max": operator.ge,
+}
+COMPARISONS = {"<=": operator.le, ">=": operator.ge, "==": operator.eq, "!=": operator.ne,
+               "<": operator.lt, ">": operator.gt}
+_COMPARISON_RE = re.compile(r"(<=|>=|==|!=|<|>)")
+_RANGE_TEXT = {"min": ">=", "exclusive_min": ">", "max": "<=", "exclusive_max": "<"}
+
+
+class RuleError(ValueError):
+    pass
+
+
+def rules_path(dataset_name):
+    return RULES_DIR / f"{dataset_name}.json"
+
+def _rule_columns(path):
+    """
+    Every column a rule file requires or references, or None when it can't
+    be read.
+    """
+    try:
+        rules = RuleSet.load(path)
+    except (OSError, ValueError):
+        return None
+    return set(rules.required + [col for rule in rules.rules for col in rule.columns])
+
+def find_rules_path(dataset_name, columns=None):
+    """
+    The dataset's own rule file, else (given its columns) the first rule
+    file whose columns it all has, else None.
+    """
+    own = rules_path(dataset_name)
+    if own.exists() or columns is None:
+        return own if own.exists() else None
+    columns = {str(col) for col in columns}
+    for path in sorted(RULES_DIR.glob("*.json")):
+        needed = _rule_columns(path)
+        if needed and needed <= columns:
+            return path
+    return None
+
+
+def _numbers(df, col):
+    """
+    Column as a float array (NaN for missing); text that isn't a number
+    becomes NaN too, like the cleaning's type rescue.
+    """
+    series = df[col]
+    if not pd.api.types.is_numeric_dtype(series):
+        series = pd.to_numeric(series, errors="coerce")
+    return series.to_numpy(dtype="float64", na_value=np.nan)
+
+
+def _parse_operand(text):
+    text = text.strip()
+    if text.startswith("`") and text.endswith("`"):
+        return "column", text[1:-1]
+    try:
+        return "number", float(text)
+    except ValueError:
+        if not text:
+            raise RuleError("empty operand in constraint")
+        return "column", text
+
+
+# ------------------ COMPILED RULES ------------------
+class Rule:
+    """
+    label     how the rule reads in reports ('Air_Temp_K < 500')
+    columns   columns the rule needs
+    violates  df -> bool array, True where the row breaks the rule
+    """
+    def __init__(self, label, columns, violates):
+        self.label = label
+        self.columns = columns
+        self.violates = violates
+
+
+def _range_rule(col, bounds):
+    checks = []
+    for key, limit in bounds.items():
+        if key not in RANGE_BOUNDS:
+            raise RuleError(f"unknown range bound '{key}' for {col} (use {', '.join(RANGE_BOUNDS)})")
+        checks.append((RANGE_BOUNDS[key], float(limit)))
+
+    def violates(df):
+        values = _numbers(df, col)
+        bad = np.zeros(len(values), dtype=bool)
+        for breaks, limit in checks:
+            bad |= breaks(values, limit)    # NaN compares False: never a violation
+        return bad
+
+    label = " and ".join(f"{col} {_RANGE_TEXT[key]} {limit:g}" for key, limit in bounds.items())
+    return Rule(label, [col], violates)
+
+
+def _category_rule(col, allowed):
+    allowed = list(allowed)
+
+    def violates(df):
+        series = df[col]
+        return (~series.isin(allowed) & series.notna()).to_numpy()
+
+    return Rule(f"{col} in {allowed}", [col], violates)
+
+
+def _constraint_rule(text):
+    parts = _COMPARISON_RE.split(text)
+    if len(parts) < 3:
+        raise RuleError(f"constraint '{text}' has no comparison")
+    operands = [_parse_operand(part) for part in parts[0::2]]
+    ops = [COMPARISONS[op] for op in parts[1::2]]
+    columns = [value for kind, value in operands if kind == "column"]
+
+    def violates(df):
+        values = [_numbers(df, value) if kind == "column" else value for kind, value in operands]
+        n = len(df)
+        bad = np.zeros(n, dtype=bool)
+        for op, left, right in zip(ops, values, values[1:]):
+            known = ~(np.isnan(left) | np.isnan(right))
+            bad |= known & ~op(left, right)
+        return bad
+
+    return Rule(" ".join(text.split()), columns, violates)
+
+
+class RuleSet:
+    def __init__(self, required=(), ranges=None, categories=None, constraints=(), source=None):
+        self.required = list(required)
+        self.source = source
+        self.rules = ([_range_rule(col, bounds) for col, bounds in (ranges or {}).items()] +
+                      [_category_rule(col, allowed) for col, allowed in (categories or {}).items()] +
+                      [_constraint_rule(text) for text in constraints])
+
+    @classmethod
+    def from_dict(cls, spec, source=None):
+        unknown = set(spec) - {"required", "ranges", "categories", "constraints"}
+        if unknown:
+            raise RuleError(f"{source or 'rules'}: unknown section(s) {', '.join(sorted(unknown))}")
+        return cls(spec.get("required", ()), spec.get("ranges"), spec.get("categories"),
+                   spec.get("constraints", ()), source)
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        with open(path) as f:
+            return cls.from_dict(json.load(f), source=path.name)
+
+    @property
+    def labels(self):
+        return [rule.label for rule in self.rules]
+
+    def check_columns(self, columns):
+        """
+        Raises RuleError naming every required / referenced column that is
+        missing from the frame.
+        """
+        needed = self.required + [col for rule in self.rules for col in rule.columns]
+        missing = list(dict.fromkeys(col for col in needed if col not in columns))
+        if missing:
+            raise RuleError(f"{self.source or 'rules'}: missing column(s) {', '.join(missing)}")
+
+    def evaluate(self, df):
+        """
+        One pass over the frame: (keep mask, {rule label: violating rows}).
+        A row breaking several rules is counted under each of them.
+        """
+        self.check_columns(df.columns)
+        bad = np.zeros(len(df), dtype=bool)
+        counts = {}
+        for rule in self.rules:
+            violates = rule.violates(df)
+            counts[rule.label] = int(np.count_nonzero(violates))
+            bad |= violates
+        return ~bad, counts
+
+    def apply(self, df):
+        """
+        (rows passing every rule, violation counts). The frame is copied once,
+        and not at all when nothing is violated.
+        """
+        keep, counts = self.evaluate(df)
+        return (df if keep.all() else df[keep]), counts
+
+
+def load_rules(dataset_name, columns=None):
+    """
+    The dataset's RuleSet (its own, or one matching `columns`, see
+    find_rules_path), or None when there is no rule file for it.
+    """
+    path = find_rules_path(dataset_name, columns)
+    return RuleSet.load(path) if path is not None else None
+
+
+def merge_counts(total, counts):
+    """
+    Adds one chunk's violation counts into the running totals.
+    """
+    for label, n in counts.items():
+        total[label] = total.get(label, 0) + n
+    return total
@@ -2,11 +2,19 @@ import streamlit as st
 import pandas as pd
 from pathlib import Path
 import subprocess
+import sys
+import time
 
 ROOT_DIR = Path(__file__).resolve().parent
 DATA_RAW = ROOT_DIR / "data" / "raw"
 OUTPUT_DIR = ROOT_DIR / "output"
 
+sys.path.append(str(ROOT_DIR))
+from src.job_runner import JobRunner, stage_outputs
+from src.prediction_service import ServiceError, is_service_running, predict_file
+from src.profiler import load_profile, summary_table
+from src.results_view import PAGE_SIZES, latest_results, load_view, style_page
+
 st.set_page_config(
     page_title="AI Failure Risk Predictor",
     layout="wide"
@@ -15,61 +23,163 @@ st.set_page_config(
 st.title("🛡️ AI-Based Model Failure & Risk Predictor")
 st.caption("Hackathon-ready uncertainty & risk analysis dashboard")
 
+# ---------------- PREDICTION SERVICE ----------------
+@st.cache_resource
+def start_prediction_service():
+    """
+    Starts the warm scoring service once per Streamlit server (if nobody else
+    has). Returns True when it answers.
+    """
+    if not is_service_running():
+        subprocess.Popen([sys.executable, str(ROOT_DIR / "src" / "prediction_service.py")], cwd=ROOT_DIR)
+        for _ in range(60):
+            if is_service_running():
+                break
+            time.sleep(0.5)
+    return is_service_running()
+
 # ---------------- FILE UPLOAD ----------------
 st.sidebar.header("📤 Upload CSV")
 uploaded_file = st.sidebar.file_uploader("Upload Machine CSV", type=["csv"])
 
 if uploaded_file:
     file_path = DATA_RAW / uploaded_file.name
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    # Every rerun (e.g. the job poll below) sees the same upload again; write it
+    # once, not under a pipeline that may be reading it
+    if st.session_state.get("uploaded_file_id") != uploaded_file.file_id:
+        with open(file_path, "wb") as f:
+            f.write(uploaded_file.getbuffer())
+        st.session_state["uploaded_file_id"] = uploaded_file.file_id
     st.sidebar.success("File uploaded successfully")
 
+    # ---------------- DATA PROFILE ----------------
+    # Written by the pipeline's data check; no need to re-read the CSV here
+    profile = load_profile(uploaded_file.name)
+    if profile:
+        with st.expander(f"🧾 Data Profile: {uploaded_file.name}"):
+            st.caption(f"{profile['rows']} rows · {profile['n_columns']} columns · "
+                       f"{profile['duplicate_rows']} duplicate rows")
+            st.dataframe(summary_table(profile).T.astype(str), use_container_width=True)
+
+    # ---------------- SCORE VIA SERVICE ----------------
+    if st.sidebar.button("⚡ Score Uploaded File"):
+        if start_prediction_service():
+            try:
+                response = predict_file(file_path)
+            except ServiceError as e:
+                st.sidebar.error(f"Scoring failed: {e}")
+            except OSError as e:
+                st.sidebar.error(f"Prediction service did not answer: {e}")
+            else:
+                st.sidebar.success(f"Scored {response['rows']} new rows → {Path(response['output']).name}")
+                if response.get("skipped"):
+                    st.sidebar.info(f"{response['skipped']} rows were already scored in earlier uploads (skipped)")
+        else:
+            st.sidebar.error("Prediction service is not available (is a model trained?)")
+
 # ---------------- RUN PIPELINE ----------------
+@st.cache_resource
+def job_runner():
+    """
+    One runner per Streamlit server: every session's runs share its queue.
+    """
+    return JobRunner()
+
+runner = job_runner()
 if st.sidebar.button("🚀 Run Full Pipeline"):
-    with st.spinner("Running analysis pipeline..."):
-        subprocess.run(["python", "src/analysis_pipeline.py"])
-    st.success("Pipeline completed successfully!")
+    st.session_state["job_id"] = runner.submit()
+
+job = runner.get(st.session_state.get("job_id", ""))
+if job:
+    st.subheader(f"⚙️ Pipeline Job {job['id']}")
+    if job["status"] == "queued":
+        ahead = [other for other in runner.active() if other["submitted_at"] < job["submitted_at"]]
+        st.info(f"Queued behind {len(ahead)} running/queued job(s)...")
+    elif job["status"] == "running":
+        running = ", ".join(f"{stage} ({dataset})" for dataset, stage in job["running"])
+        st.progress(job["progress"], text=f"Running: {running or 'starting'}")
+    elif job["status"] == "succeeded":
+        st.progress(1.0, text=f"Finished in {job['finished_at'] - job['started_at']:.0f}s")
+    elif job["status"] == "cancelled":
+        st.warning("Pipeline cancelled.")
+    else:
+        st.error(f"Pipeline crashed: {job['error']}")
+
+    if job["status"] in ("queued", "running"):
+        if st.button("🛑 Cancel Pipeline"):
+            runner.cancel(job["id"])
+
+    failed = {e["dataset"]: f"{e['stage']}: {e['error']}" for e in job["events"] if e["status"] == "failed"}
+    for dataset, error in failed.items():
+        st.error(f"{dataset} failed at {error}")
+
+    # Partial results: each dataset's outputs show up as soon as its stage is done
+    for dataset, outputs in stage_outputs(job, "clean").items():
+        with st.expander(f"🧹 Cleaned data: {dataset}"):
+            st.dataframe(pd.read_csv(outputs[0], nrows=20), use_container_width=True)
+    for dataset, outputs in stage_outputs(job, "uncertainty").items():
+        with st.expander(f"🎯 Failure predictions: {dataset}"):
+            st.dataframe(pd.read_csv(outputs[0], nrows=20), use_container_width=True)
+    for dataset, outputs in stage_outputs(job, "plot").items():
+        st.image(outputs[0], caption=dataset)
 
 # ---------------- LOAD RESULTS ----------------
-prediction_files = list(OUTPUT_DIR.glob("FINAL_PREDICTIONS_*.csv"))
+@st.cache_resource(max_entries=2)
+def cached_view(path, mtime):
+    """
+    One ResultsView per prediction run; (path, mtime) changes when a new
+    run is written, so reruns of the script never reload the results.
+    """
+    return load_view(path)
 
-if prediction_files:
-    latest_file = max(prediction_files, key=lambda x: x.stat().st_mtime)
-    df = pd.read_csv(latest_file)
+@st.cache_data(max_entries=4)
+def filtered_csv(path, mtime, min_risk):
+    return cached_view(path, mtime).to_csv(min_risk)
+
+results_key = latest_results()
+
+if results_key:
+    view = cached_view(*results_key)
+    summary = view.summary
 
     st.subheader("📊 Key Metrics")
     col1, col2, col3, col4 = st.columns(4)
 
-    col1.metric("Total Samples", len(df))
-    col2.metric("Predicted Failures", int(df["Prediction"].sum()))
-    col3.metric("Avg Risk %", f"{df['Risk_Percentage'].mean():.2f}%")
-    col4.metric("Low Trust Cases", (df["Trust_Level"].str.contains("Low")).sum())
+    col1.metric("Total Samples", summary["rows"])
+    col2.metric("Predicted Failures", int(summary["predicted_failures"]))
+    col3.metric("Avg Risk %", f"{summary['avg_risk']:.2f}%")
+    col4.metric("Low Trust Cases", summary["low_trust"])
 
     # ---------------- FILTER ----------------
     st.subheader("🔍 Filter Results")
     min_risk = st.slider("Minimum Risk %", 0, 100, 0)
-    filtered_df = df[df["Risk_Percentage"] >= min_risk]
+    n_rows = view.count(min_risk)
 
     # ---------------- TABLE ----------------
+    # Highest risk first, one page at a time
     st.subheader("📋 Prediction Results")
-    st.dataframe(
-        filtered_df.style.applymap(
-            lambda x: "background-color: red" if isinstance(x, str) and "High Risk" in x
-            else "background-color: yellow" if isinstance(x, str) and "Medium Risk" in x
-            else "background-color: lightgreen" if isinstance(x, str) and "Low Risk" in x
-            else ""
-        ),
-        use_container_width=True
-    )
+    col_size, col_page = st.columns(2)
+    page_size = col_size.selectbox("Rows per page", PAGE_SIZES, index=1)
+    n_pages = view.n_pages(min_risk, page_size)
+    page = col_page.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1)
+    first = (page - 1) * page_size
+    st.caption(f"Rows {min(first + 1, n_rows)}–{min(first + page_size, n_rows)} of {n_rows}")
+    st.dataframe(style_page(view.page(min_risk, page, page_size)), use_container_width=True)
 
     # ---------------- DOWNLOAD ----------------
-    st.download_button(
-        "⬇️ Download Results CSV",
-        filtered_df.to_csv(index=False),
-        file_name=latest_file.name,
-        mime="text/csv"
-    )
+    # Building the CSV of every filtered row only happens on request
+    if st.button("📦 Prepare Results CSV"):
+        st.download_button(
+            "⬇️ Download Results CSV",
+            filtered_csv(*results_key, min_risk),
+            file_name=view.name,
+            mime="text/csv"
+        )
 
 else:
     st.info("Upload data and run pipeline to see results.")
+
+# ---------------- POLL RUNNING JOB ----------------
+if job and job["status"] in ("queued", "running"):
+    time.sleep(1)
+    st.rerun()